@@ -2,4 +2,5 @@
 from importlib.metadata import version
 __version__ = version("cinet")
 
-from .interfaces import deepCINET, ECINET
\ No newline at end of file
+from .interfaces import deepCINET, ECINET
+from .ensemble import deepCINETEnsemble
\ No newline at end of file
@@ -0,0 +1,445 @@
+import copy
+import json
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+from .interfaces import BaseCINET, deepCINET, _file_params, _file_scorer, _scorer_tensors
+from .metrics import concordance_index_batch
+from .models import Dataset, FullyConnected, autocast
+from .serialization import save_file
+
+
+class StackedLinear(nn.Module):
+    """K nn.Linear layers of the same shape applied as one batched matmul
+
+    The weights are stored as a (K, in, out) tensor. An input shared by all
+    members, of shape (B, in), goes through a single (B, in) x (in, K * out)
+    GEMM, and per member inputs of shape (K, B, in) through one bmm.
+    """
+
+    def __init__(self, linears):
+        super(StackedLinear, self).__init__()
+        self.weight = nn.Parameter(torch.stack([linear.weight.detach().t() for linear in linears]))
+        self.bias = nn.Parameter(torch.stack([linear.bias.detach() for linear in linears]).unsqueeze(1))
+
+    def forward(self, x):
+        if x.dim() == 2:
+            num_members, in_size, out_size = self.weight.shape
+            output = x @ self.weight.transpose(0, 1).reshape(in_size, num_members * out_size)
+            return output.view(x.size(0), num_members, out_size).transpose(0, 1) + self.bias
+        return torch.baddbmm(self.bias, x, self.weight)
+
+    def member_state_dict(self, k):
+        return {'weight': self.weight[k].t(), 'bias': self.bias[k, 0]}
+
+
+class StackedBatchNorm(nn.Module):
+    """K nn.BatchNorm1d layers normalizing (K, B, C) inputs, each member with
+    its own batch statistics, running statistics and affine parameters
+    """
+
+    def __init__(self, norms):
+        super(StackedBatchNorm, self).__init__()
+        self.eps = norms[0].eps
+        self.momentum = norms[0].momentum
+        self.weight = nn.Parameter(torch.stack([norm.weight.detach() for norm in norms]).unsqueeze(1))
+        self.bias = nn.Parameter(torch.stack([norm.bias.detach() for norm in norms]).unsqueeze(1))
+        self.register_buffer('running_mean', torch.stack([norm.running_mean for norm in norms]))
+        self.register_buffer('running_var', torch.stack([norm.running_var for norm in norms]))
+        self.register_buffer('num_batches_tracked', norms[0].num_batches_tracked.clone())
+
+    def forward(self, x):
+        if self.training:
+            mean = x.mean(1, keepdim=True)
+            var = x.var(1, unbiased=False, keepdim=True)
+            with torch.no_grad():
+                # Running variance is unbiased, as in nn.BatchNorm1d
+                size = x.size(1)
+                self.running_mean.mul_(1 - self.momentum).add_(mean.squeeze(1), alpha=self.momentum)
+                self.running_var.mul_(1 - self.momentum).add_(var.squeeze(1), alpha=self.momentum * size / (size - 1))
+                self.num_batches_tracked += 1
+        else:
+            mean = self.running_mean.unsqueeze(1)
+            var = self.running_var.unsqueeze(1)
+        return (x - mean) * torch.rsqrt(var + self.eps) * self.weight + self.bias
+
+    def member_state_dict(self, k):
+        return {'weight': self.weight[k, 0],
+                'bias': self.bias[k, 0],
+                'running_mean': self.running_mean[k],
+                'running_var': self.running_var[k],
+                'num_batches_tracked': self.num_batches_tracked}
+
+
+class StackedFullyConnected(nn.Module):
+    """
+    K FullyConnected networks of the same shape evaluated together on the
+    same input. Linear and batchnorm layers are stacked, the element-wise
+    layers (activations, dropout) apply to all members at once. Returns the
+    (K, B) scores of the members.
+    """
+    def __init__(self, networks):
+        super(StackedFullyConnected, self).__init__()
+        self.num_members = len(networks)
+        self.layers = nn.ModuleList()
+        for blocks in zip(*[network.layers for network in networks]):
+            block = []
+            for members in zip(*blocks):
+                if isinstance(members[0], nn.Linear):
+                    block.append(StackedLinear(members))
+                elif isinstance(members[0], nn.BatchNorm1d):
+                    block.append(StackedBatchNorm(members))
+                else:
+                    block.append(copy.deepcopy(members[0]))
+            self.layers.append(nn.Sequential(*block))
+
+    def forward(self, x):
+        x = x.view(x.size(0), -1)
+        for layer in self.layers:
+            x = layer(x)
+        return x.squeeze(-1)
+
+    def member_state_dict(self, k):
+        ''' State dict of the FullyConnected network of member k
+        '''
+        state = {}
+        for name, module in self.named_modules():
+            if isinstance(module, (StackedLinear, StackedBatchNorm)):
+                for key, value in module.member_state_dict(k).items():
+                    state[name + '.' + key] = value.detach().clone()
+        return state
+
+
+class _StackedAdam:
+    """Adam (with the defaults of torch.optim.Adam) over stacked parameters
+    whose first dimension is the member, with one learning rate per member.
+    Members left out of a step (no pair in the batch) are not updated.
+    """
+
+    def __init__(self, params, lrs, betas=(0.9, 0.999), eps=1e-8):
+        self.params = list(params)
+        self.lrs = lrs
+        self.betas = betas
+        self.eps = eps
+        self.exp_avg = [torch.zeros_like(param) for param in self.params]
+        self.exp_avg_sq = [torch.zeros_like(param) for param in self.params]
+        self.steps = torch.zeros_like(lrs)
+
+    def zero_grad(self):
+        for param in self.params:
+            param.grad = None
+
+    @torch.no_grad()
+    def step(self, active):
+        beta1, beta2 = self.betas
+        self.steps += active
+        steps = self.steps.clamp(min=1)
+        step_sizes = self.lrs / (1 - beta1 ** steps)
+        corrections = (1 - beta2 ** steps).sqrt()
+        for param, exp_avg, exp_avg_sq in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            shape = (-1,) + (1,) * (param.dim() - 1)
+            mask = active.view(shape)
+            grad = param.grad
+            exp_avg.copy_(torch.where(mask, exp_avg * beta1 + grad * (1 - beta1), exp_avg))
+            exp_avg_sq.copy_(torch.where(mask, exp_avg_sq * beta2 + grad * grad * (1 - beta2), exp_avg_sq))
+            update = step_sizes.view(shape) * exp_avg / (exp_avg_sq.sqrt() / corrections.view(shape) + self.eps)
+            param.sub_(torch.where(mask, update, torch.zeros_like(update)))
+
+
+class deepCINETEnsemble(deepCINET):
+    def __init__(self, deltas=None, learning_rates=None, seeds=None, **kwargs):
+        # """
+        # Trains K deepCINET networks of the same architecture (nnHiddenLayers) as a single stacked
+        # network, e.g. for a grid of deltas and learning rates. Every batch of pairs is shared by the
+        # members and their layers are evaluated with batched matmuls, so the K networks train in one
+        # loop for about the cost of a single, K times wider, network.
+        #
+        # deltas : list of floats
+        #     Delta of every member. Batches are drawn from the pairs of the smallest delta, and each
+        #     member is trained on the pairs of a batch further apart than its own delta.
+        #     Set to None ([delta]) by default.
+        # learning_rates : list of floats
+        #     Learning rate of every member, all following the sc_milestones / sc_gamma schedule.
+        #     Set to None ([learning_rate]) by default.
+        # seeds : list of ints
+        #     Seed of the weight initialization of every member.
+        #     Set to None ([seed]) by default.
+        #
+        # Lists of a single value apply to all members. Only the 'pairs' objective with all pairs is
+        # supported. The members are trained in the calling process by the loop of train_members, on
+        # batches of distinct cell lines: engine must be 'native' and unique_cells True (their defaults
+        # here), and patience, n_jobs, out_of_core and compile_model are not supported.
+        #
+        # After fit, every member is a deepCINET of estimators_. predict and score return one row / value
+        # per member, and save writes all of them in one file.
+        # """
+        self.deltas = deltas
+        self.learning_rates = learning_rates
+        self.seeds = seeds
+        kwargs.setdefault('engine', 'native')
+        kwargs.setdefault('unique_cells', True)
+        super().__init__(**kwargs)
+
+    def _validate_params(self):
+        super()._validate_params()
+        for name in ['deltas', 'learning_rates', 'seeds']:
+            values = getattr(self, name)
+            assert values is None or isinstance(values, (list, tuple)), name + ' must be None or a list'
+        assert (self.objective == 'pairs'), 'deepCINETEnsemble only supports objective="pairs"'
+        assert (self.engine == 'native'), 'deepCINETEnsemble trains its members with its own loop, engine must be "native"'
+        assert self.unique_cells, 'deepCINETEnsemble trains on batches of distinct cell lines, unique_cells must be True'
+        assert self.patience is None, 'deepCINETEnsemble does not support early stopping (patience)'
+        assert self.n_jobs == 1, 'deepCINETEnsemble trains all the members in one process, n_jobs must be 1'
+        assert not self.out_of_core, 'deepCINETEnsemble does not support out_of_core'
+        assert not self.compile_model, 'deepCINETEnsemble does not support compile_model'
+        members = self.members()
+        assert len(members) > 0, 'deltas, learning_rates and seeds must not be empty'
+
+    def members(self):
+        """Returns the (delta, learning_rate, seed) of every member
+        """
+        values = [[float(delta) for delta in self.deltas] if self.deltas is not None else [self.delta],
+                  [float(lr) for lr in self.learning_rates] if self.learning_rates is not None else [self.learning_rate],
+                  [int(seed) for seed in self.seeds] if self.seeds is not None else [self.seed]]
+        num_members = max(len(value) for value in values)
+        for value in values:
+            assert len(value) in [1, num_members], 'deltas, learning_rates and seeds must have the same length or one value'
+        return [tuple(value[k] if len(value) > 1 else value[0] for value in values) for k in range(num_members)]
+
+    def fit(self, X=None, y=None, cross_validation=False, random_pairs=False, pair_sampling='all'):
+        """Train all the members on all the rows of X and y
+
+        Parameters
+        ----------
+        X : pandas.dataframe
+            Input training data.
+        y : pandas.dataframe
+            Output data to be predicted.
+        cross_validation, random_pairs, pair_sampling
+            As for deepCINET.fit, only their defaults are supported. The members are cross-validated by
+            cross_validate.
+
+        Returns
+        -------
+        list
+            One fitted deepCINET per member, in the order of members(). Also kept in estimators_.
+        """
+        self._validate_params()
+        assert not cross_validation, 'deepCINETEnsemble.fit trains on all the rows, use cross_validate'
+        assert not random_pairs, 'deepCINETEnsemble does not support random_pairs'
+        assert (pair_sampling == 'all'), 'deepCINETEnsemble only supports pair_sampling="all"'
+        members = self.members()
+        self._prepare_fit(X, y)
+        dataset = Dataset(self._fit_data, True, self.batch_size, min(delta for delta, _, _ in members),
+                          unique_cells=True, scaler=self.scaler_)
+        self._release_fit_data()
+        self._stacked_model = self.train_members(dataset, members)
+
+        self.estimators_ = []
+        for k, (delta, lr, seed) in enumerate(members):
+            estimator = self._member(delta, lr, seed)
+            estimator.hyperparams = dict(self.hyperparams, seed=seed)
+            estimator.config = dict(self.config, delta=delta, lr=lr)
+            estimator.genes_ = self.genes_
+            estimator.scaler_ = self.scaler_
+            estimator.siamese_model = estimator.get_model(estimator.config)
+            estimator.siamese_model.fc.load_state_dict(self._stacked_model.member_state_dict(k))
+            estimator.siamese_model.set_scaler(*dataset.scaler)
+            estimator.siamese_model.eval()
+            self.estimators_.append(estimator)
+        return self.estimators_
+
+    def predict(self, X):
+        """Predict a ranked list from input data with every member
+
+        Parameters
+        ----------
+        X : pandas.dataframe
+            Input test data, raw gene expressions with the genes used in fit.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per member, indexed by its (delta, learning_rate, seed), and one column per row of X.
+        """
+        index = pd.MultiIndex.from_tuples(self.members(), names=['delta', 'learning_rate', 'seed'])
+        return pd.DataFrame([estimator.predict(X).to_numpy() for estimator in self.estimators_],
+                            index=index, columns=X.index)
+
+    def score(self, X=None, y=None):
+        """Returns the concordance index of the predictions of every member, in the order of members()
+        """
+        return concordance_index_batch(np.asarray(y), self.predict(X).to_numpy())
+
+    def save(self, path):
+        """Save the fitted members in one flat file, read back by load
+
+        The arrays of every member, as deepCINET.save writes them, are prefixed by 'members.<k>.', and the
+        architecture they share is written once with the parameters of the ensemble.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file to write.
+        """
+        tensors = {}
+        for k, estimator in enumerate(self.estimators_):
+            for key, value in _scorer_tensors(estimator.siamese_model).items():
+                tensors['members.%d.%s' % (k, key)] = value
+        save_file(tensors, path, self._file_metadata(self.estimators_[0].siamese_model))
+
+    @classmethod
+    def _from_file(cls, tensors, metadata):
+        """The ensemble of a file written by save, see BaseCINET.load"""
+        ensemble = cls(**_file_params(metadata))
+        ensemble.genes_ = json.loads(metadata['genes'])
+        ensemble.estimators_ = []
+        for k, (delta, lr, seed) in enumerate(ensemble.members()):
+            prefix = 'members.%d.' % k
+            estimator = ensemble._member(delta, lr, seed)
+            estimator.genes_ = ensemble.genes_
+            estimator.siamese_model = _file_scorer({key[len(prefix):]: value for key, value in tensors.items()
+                                                    if key.startswith(prefix)}, metadata)
+            ensemble.estimators_.append(estimator)
+        return ensemble
+
+    def _member(self, delta, learning_rate, seed):
+        """Unfitted deepCINET of a member, with the parameters of the ensemble"""
+        params = {name: getattr(self, name) for name in BaseCINET._get_param_names()}
+        params['modelPath'] = ''
+        return deepCINET(nnHiddenLayers=self.nnHiddenLayers,
+                         **dict(params, delta=delta, learning_rate=learning_rate, seed=seed))
+
+    def fit_delta_path(self, X=None, y=None, deltas=None, pair_sampling='all'):
+        """Cross-validate the model for several delta values, as deepCINET.fit_delta_path, by training one
+        member per delta together (see cross_validate). learning_rates and seeds must then have one value.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per delta (the index) with the cross-validated concordance index ('ci') and the total
+            number of training pairs across folds ('pairs').
+        """
+        assert (pair_sampling == 'all'), 'deepCINETEnsemble only supports pair_sampling="all"'
+        start_deltas = self.deltas
+        self.deltas = [float(delta) for delta in deltas]
+        try:
+            results = self.cross_validate(X, y)
+        finally:
+            self.deltas = start_deltas
+        return results.set_index('delta')[['ci', 'pairs']]
+
+    def cross_validate(self, X=None, y=None):
+        """Cross-validate all the members on the folds used by deepCINET.fit
+
+        Parameters
+        ----------
+        X : pandas.dataframe
+            Input training data.
+        y : pandas.dataframe
+            Output data to be predicted.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per member with its delta, learning_rate and seed, the concordance index of its
+            out-of-fold predictions ('ci') and its total number of training pairs across folds ('pairs').
+
+        Examples
+        --------
+        >>> grid = deepCINETEnsemble(deltas=[0.0, 0.05, 0.1], learning_rates=[0.01, 0.01, 0.001])
+        >>> results = grid.cross_validate(X, y)
+        """
+        self._validate_params()
+        members = self.members()
+        combined_df = self._prepare_fit(X, y)
+        genes = self._fit_data[0]
+        predictions = np.empty((len(members), len(combined_df)))
+        deltas = np.array([delta for delta, _, _ in members])
+        num_pairs = np.zeros(len(members), dtype=np.int64)
+        for train_index, val_index in self.get_folds(combined_df):
+            dataset = Dataset(self._fit_data, True, self.batch_size, deltas.min(),
+                              train_index, unique_cells=True, scaler=self.scaler_)
+            pairs = dataset._sample_list
+            distances = np.abs(dataset.drug_resps[pairs.idxA] - dataset.drug_resps[pairs.idxB])
+            num_pairs += [(distances > delta).sum() for delta in deltas]
+            model = self.train_members(dataset, members)
+            mean, std = dataset.scaler
+            val_genes = (genes[val_index] - np.asarray(mean, dtype=np.float32)) / np.asarray(std, dtype=np.float32)
+            with torch.no_grad(), autocast(self.precision):
+                predictions[:, val_index] = model(torch.from_numpy(val_genes)).float().numpy()
+        results = pd.DataFrame(members, columns=['delta', 'learning_rate', 'seed'])
+        results['ci'] = concordance_index_batch(combined_df['target'].to_numpy(), predictions)
+        results['pairs'] = num_pairs
+        self._release_fit_data()
+        return results
+
+    def train_members(self, dataset, members):
+        """Train a StackedFullyConnected network with one member per (delta, learning_rate, seed) on the
+        pairs of dataset, whose delta must be the smallest one, and return it in evaluation mode
+
+        Parameters
+        ----------
+        dataset : Dataset
+            Training pair data set.
+        members : list
+            The (delta, learning_rate, seed) of every member.
+
+        Returns
+        -------
+        StackedFullyConnected
+        """
+        device = torch.device('cuda' if self.device == 'gpu' else 'cpu')
+        layers_size = [i for i in [dataset.gene_num(), *list(self.nnHiddenLayers), 1] if i != 0]
+        networks = []
+        for _, _, seed in members:
+            # Same initialization as a deepCINET trained with this seed
+            torch.manual_seed(seed)
+            networks.append(FullyConnected(layers_size, self.dropout, True))
+        model = StackedFullyConnected(networks).to(device)
+        learning_rates = torch.tensor([lr for _, lr, _ in members], device=device)
+        optimizer = _StackedAdam(model.parameters(), learning_rates.clone())
+        deltas = np.array([delta for delta, _, _ in members])
+        milestones = sorted(self.sc_milestones)
+
+        torch.manual_seed(self.seed)
+        pairs = dataset._sample_list
+        responses = dataset.drug_resps
+        model.train()
+        for epoch in range(self.max_epochs):
+            # MultiStepLR schedule, stepped once per epoch
+            optimizer.lrs = learning_rates * self.sc_gamma ** bisect_right(milestones, epoch)
+            loss_sum = torch.zeros(len(members), device=device)
+            steps = torch.zeros(len(members), device=device)
+            order = torch.randperm(len(pairs)).numpy()
+            for start in range(0, len(order), self.batch_size):
+                batch_pairs = pairs[order[start:start + self.batch_size]]
+                if len(batch_pairs) == 1 and len(order) > 1:
+                    # As pair_loader, don't feed batchnorm a trailing single pair
+                    continue
+                distances = np.abs(responses[batch_pairs.idxA] - responses[batch_pairs.idxB])
+                mask = torch.from_numpy(distances[None, :] > deltas[:, None]).to(device)
+                counts = mask.sum(1)
+                active = counts > 0
+                if not active.any():
+                    continue
+                batch = {key: value.to(device) for key, value in dataset._pair_batch(batch_pairs).items()}
+                with autocast(self.precision, device.type):
+                    scores = model(batch['genes']).float()
+                output = scores[:, batch['idxA']] - scores[:, batch['idxB']]
+                signs = batch['labels'] * 2 - 1
+                # MarginRankingLoss of every member on its own pairs
+                losses = (torch.relu(-signs * output) * mask).sum(1) / counts.clamp(min=1)
+                optimizer.zero_grad()
+                losses.sum().backward()
+                optimizer.step(active)
+                loss_sum += losses.detach()
+                steps += active
+            avg_loss = (loss_sum / steps.clamp(min=1)).cpu().numpy()
+            print("Epoch %d: avg_loss=[%s]" % (epoch, ", ".join("%.4g" % loss for loss in avg_loss)))
+        model.eval()
+        return model.cpu()
@@ -1,4 +1,8 @@
 from .models import *
+from .pairs import PairSampler, pair_cache, sample_pairs
+from .serialization import load_file, save_file
+from .shared import SharedArray
+from .solvers import rank_elastic_net_path
 from scipy import stats
 
 from random import randint
@@ -6,11 +10,17 @@ import sklearn
 import pandas as pd
 import numpy as np
 import argparse
+import copy
+import json
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from tensorboard.summary import Writer
 from abc import ABCMeta, abstractmethod, abstractstaticmethod
 import random
 
-from lifelines.utils import concordance_index
+from .metrics import concordance_index
 
 ## FIXME:: modularize these imports and remove as many as possible!
 
@@ -52,7 +62,19 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
     learning_rate=0.01, 
     device='cpu',
     max_epochs=12,
-    seed=420):
+    seed=420,
+    pairs_per_epoch=100000,
+    unique_cells=False,
+    objective='pairs',
+    n_jobs=1,
+    engine='lightning',
+    compile_model=False,
+    patience=None,
+    predict_chunk_size=None,
+    reuse_scaler=False,
+    out_of_core=False,
+    out_of_core_dir=None,
+    precision=32):
         """Initialize the CINET sklearn class
 
         All relevant variables can be initialized here. Of interest are 'delta' 'batch_size' 'modelPath' and 'device'.
@@ -101,6 +123,69 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         seed : int
             The seed value for neural network training. 
             Set to 420 by default.
+        pairs_per_epoch : int
+            Number of training pairs sampled per epoch when fitting with pair_sampling='stream'.
+            Set to 100000 by default.
+        unique_cells : bool
+            If true, training batches carry each distinct cell line once and the network scores every cell
+            a single time per batch, gathering pair differences from those scores. Otherwise both members
+            of every pair go through the network, as in earlier versions. The two modes also differ in the
+            batchnorm statistics, taken over the distinct cell lines of a batch instead of separately over
+            the first and the second members of its pairs.
+            Set to False by default.
+        objective : str
+            Training objective. 'pairs' iterates over batches of valid pairs. 'matrix' iterates over batches of
+            batch_size cell lines, scores each of them once and applies the ranking loss to every pair of the
+            batch whose responses differ by more than delta, so an epoch costs O(n) network evaluations.
+            Set to 'pairs' by default.
+        n_jobs : int
+            Number of cross-validation folds trained concurrently, each in its own process with an even share
+            of the CPU threads. The data is placed in shared memory once instead of being copied to every
+            process, and each fold loads its batches in its own process (num_workers is not used). -1 uses
+            all the CPUs.
+            Set to 1 (sequential folds) by default.
+        engine : str
+            How the network is trained. 'lightning' uses a PyTorch Lightning Trainer, for users who need its
+            callbacks and logging. 'native' uses a plain PyTorch loop (see DeepCINET.fit_native), with much less
+            overhead per step for small networks.
+            Set to 'lightning' by default.
+        compile_model : bool
+            If true, the training step of the 'native' engine is compiled with torch.compile (PyTorch 2.0 or later).
+            Set to False by default.
+        patience : int
+            If set, training stops once the concordance index of the validation cell lines did not improve for
+            patience epochs, and the weights of the best epoch are restored. The validation data is the held-out
+            fold in cross-validation, and the 20% of rows held out when cross_validation is False.
+            Set to None (train for max_epochs epochs) by default.
+        predict_chunk_size : int
+            Number of samples evaluated at once by predict. Bounds the memory of the activations when scoring
+            very large cohorts.
+            Set to None (all samples at once) by default.
+        reuse_scaler : bool
+            Gene expressions are z-scored with the per gene mean and standard deviation of the training rows,
+            which predict applies to new data as well. If true, these statistics are computed once on all the
+            rows passed to fit and reused by every cross-validation fold, instead of on the training rows of
+            each fold.
+            Set to False by default.
+        out_of_core : bool
+            If true, fit trains from a float32 file memory-mapped (see MemmapDataset): only the rows of the
+            current batch are read and standardized, instead of every data set holding a standardized copy of
+            its rows, and validation rows are predicted a chunk at a time. A float32 .npy file passed as X is
+            used as it is, other inputs are written to a file of out_of_core_dir block by block, without a
+            copy of X in memory. For inputs too large to train on in memory, such as whole-transcriptome
+            profiles, e.g. read with cinet.io.read_table or ExpressionStore.frame. Not supported with
+            pair_sampling='stream'.
+            Set to False by default.
+        out_of_core_dir : str
+            Directory of the file written by fit with out_of_core. The temporary directory is often a tmpfs
+            held in RAM, pass a directory on disk for data larger than memory.
+            Set to None (the temporary directory) by default.
+        precision : int or str
+            32 to train and predict in float32. 'bf16' runs the matrix products of the network in bfloat16
+            with float32 weights and accumulation (torch.autocast), for CPUs with native bfloat16 support
+            (e.g. AVX-512 BF16), where it halves the memory traffic of the gene expressions. Applies to the
+            'lightning' engine (Trainer precision), the 'native' engine and predict.
+            Set to 32 by default.
 
         Examples
         --------
@@ -125,6 +210,20 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         self.device = device
         self.max_epochs = max_epochs
         self.seed = seed
+        self.pairs_per_epoch = pairs_per_epoch
+        self.unique_cells = unique_cells
+        self.objective = objective
+        self.n_jobs = n_jobs
+        self.engine = engine
+        self.compile_model = compile_model
+        self.patience = patience
+        self.predict_chunk_size = predict_chunk_size
+        self.reuse_scaler = reuse_scaler
+        self.out_of_core = out_of_core
+        self.out_of_core_dir = out_of_core_dir
+        self.precision = precision
+        self._fit_data = None
+        self._gene_matrix = None
 
 
     def _validate_params(self): 
@@ -145,19 +244,112 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         assert isinstance(self.device, str), 'device must be of type str'
         assert (self.device in ['cpu', 'gpu']), 'device must be either "cpu" or "gpu"'
         assert isinstance(self.seed, int), 'seed must be of type int'
+        assert isinstance(self.pairs_per_epoch, int), 'pairs_per_epoch must be of type int'
+        assert isinstance(self.unique_cells, bool), 'unique_cells must be of type bool'
+        assert (self.objective in ['pairs', 'matrix']), 'objective must be either "pairs" or "matrix"'
+        assert isinstance(self.n_jobs, int), 'n_jobs must be of type int'
+        assert (self.n_jobs >= 1 or self.n_jobs == -1), 'n_jobs must be positive or -1'
+        assert (self.engine in ['lightning', 'native']), 'engine must be either "lightning" or "native"'
+        assert isinstance(self.compile_model, bool), 'compile_model must be of type bool'
+        assert self.patience is None or (isinstance(self.patience, int) and self.patience > 0), \
+            'patience must be None or a positive int'
+        assert self.predict_chunk_size is None or (isinstance(self.predict_chunk_size, int) and self.predict_chunk_size > 0), \
+            'predict_chunk_size must be None or a positive int'
+        assert isinstance(self.reuse_scaler, bool), 'reuse_scaler must be of type bool'
+        assert isinstance(self.out_of_core, bool), 'out_of_core must be of type bool'
+        assert self.out_of_core_dir is None or os.path.isdir(self.out_of_core_dir), \
+            'out_of_core_dir must be None or an existing directory'
+        assert (self.precision in [32, 'bf16']), 'precision must be either 32 or "bf16"'
 
 
-    def fit(self, X=None, y=None, cross_validation=True, random_pairs=False): 
+    def fit(self, X=None, y=None, cross_validation=True, random_pairs=False, pair_sampling='all'): 
         """Train the model based on training input data 
         
         Parameters
         ----------
-        X : pandas.dataframe
-            Input training data.
-        y : pandas.dataframe
-            Output data to be predicted.
+        X : pandas.dataframe or str
+            Input training data. It may hold more cell lines than y, of which only those of y are used, and
+            be memory-mapped (e.g. ExpressionStore.frame). Or the path of a .npy matrix whose rows are the
+            cell lines of y in order, which is memory-mapped rather than read.
+        y : pandas.dataframe or str
+            Output data to be predicted, or the name of the column of X holding it, the other columns being
+            the genes (e.g. 'target' with the tables of cinet.io.read_table).
+        pair_sampling : str
+            How training pairs are generated. 'all' builds every pair with a response difference above delta,
+            'stream' samples pairs_per_epoch valid pairs on the fly every epoch, keeping memory linear in
+            the number of samples.
+            Set to 'all' by default.
         """
         self._validate_params()
+        assert (pair_sampling in ['all', 'stream']), 'pair_sampling must be either "all" or "stream"'
+        assert not (random_pairs and pair_sampling == 'stream'), 'random_pairs requires pair_sampling="all"'
+        assert not (self.objective == 'matrix' and (random_pairs or pair_sampling == 'stream')), \
+            'objective="matrix" does not use random_pairs or pair_sampling'
+        assert not (self.out_of_core and pair_sampling == 'stream'), 'out_of_core requires pair_sampling="all"'
+        combined_df = self._prepare_fit(X, y)
+        if cross_validation and self.n_jobs != 1:
+            # Every fold builds its own loaders in a worker process
+            loaders = None
+        else:
+            loaders = self.get_dataloaders(combined_df, cross_validation, random_pairs, pair_sampling)
+
+        # TODO: Remove this? Hard-coded stuff here. 
+        # filename_log = f'Vorinostat-delta={self.delta:.3f}'
+        # checkpoint_callback = ModelCheckpoint(
+        #     monitor='val_ci',
+        #     dirpath='./Saved_models/DeepCINET/rnaseq/',
+        #     filename=filename_log,
+        #     save_top_k=1,
+        #     mode='max'
+        # )
+        self.hyperparams["folds"] = 1
+        # overfit_pct=hparams.overfit_pct)
+        if cross_validation:
+            num_rounds = 1
+            cross_val_ci_per_round = []
+            for _ in range(num_rounds):
+                if loaders is None:
+                    val_ci = self._cross_validate_parallel(combined_df, pair_sampling)
+                else:
+                    val_ci = self._cross_validate(loaders, combined_df['target'])
+                cross_val_ci_per_round.append(val_ci)
+        else:
+            if random_pairs:
+                valid_dl, random_dl, val_index = loaders[0]
+                self.siamese_model = self.get_model(self.config)
+                self.train_model(self.siamese_model, valid_dl)
+                y_val = combined_df['target'].iloc[val_index]
+                valid_predictions = self._predict_fit_rows(val_index, combined_df.index)
+
+                self.siamese_model = self.get_model(self.config)
+                self.train_model(self.siamese_model, random_dl)
+                random_predictions = self._predict_fit_rows(val_index, combined_df.index)
+
+                valid_score = concordance_index(y_val.to_numpy(), valid_predictions.to_numpy())
+                random_score = concordance_index(y_val.to_numpy(), random_predictions.to_numpy())
+                cross_val_ci_per_round = (valid_score, random_score)
+            else:
+                train_dl, val_dl, _ = loaders[0]
+                self.siamese_model = self.get_model(self.config)
+                if train_dl is not None:
+                    self.train_model(self.siamese_model, train_dl, val_dl)
+                    cross_val_ci_per_round = -1
+                    if self.modelPath != '': 
+                        torch.save(self.siamese_model, self.modelPath)
+                else:
+                    cross_val_ci_per_round = -2
+        self._release_fit_data()
+        return cross_val_ci_per_round
+
+    def _prepare_fit(self, X, y):
+        """Seed the run, build the hyperparameters and network configuration and return X and y joined
+        in a single DataFrame whose last column is 'target'.
+
+        X is converted once to a contiguous float32 matrix, kept with the responses in _fit_data until the end
+        of the fit. The data sets of the folds are built from these arrays (see get_pair_dataset), and the
+        returned DataFrame is a view of them, not a copy. With out_of_core, the matrix is the memory map of
+        the file of _open_gene_matrix, and no copy of X is made in memory.
+        """
         print("🚀🚀🚀🚀TESTING WITH HYPERPARAMETERS🚀🚀🚀🚀")
         print("delta", self.delta)
 
@@ -177,6 +369,7 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
             "sc_milestones" : self.sc_milestones,
             "sc_gamma" : self.sc_gamma,
             "device" : self.device,
+            "precision" : self.precision,
         }
 
         torch.backends.cudnn.benchmark = False
@@ -186,76 +379,199 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
 
         self.config = self.getConfig()
 
-        # Check if both data have same # of rows 
-        if len(X) != len(y):
-            raise Exception("X and y values are not of the same length")
-        
-        self.config['dat_size'] = X.shape[1]
+        values, rows, cols, y, index, columns = _gene_source(X, y)
+        self.config['dat_size'] = len(columns)
         self.config['dropout'] = self.dropout
         self.config['lr'] = self.learning_rate
+        self.config['delta'] = self.delta
 
-        combined_df = pd.concat([X, y], axis=1)
-        combined_df.columns.values[-1] = 'target'
+        self._close_gene_matrix()
+        if self.out_of_core:
+            genes = self._open_gene_matrix(X, values, rows, cols)
+        else:
+            # The only copy of X made by fit
+            if rows is not None or cols is not None:
+                values = values[np.ix_(np.arange(len(values)) if rows is None else rows,
+                                       np.arange(values.shape[1]) if cols is None else cols)]
+            genes = np.ascontiguousarray(values, dtype=np.float32)
+        self._fit_data = (genes, y.to_numpy())
+        combined_df = _fit_frame(genes, self._fit_data[1], index, columns)
 
-        # Check if the combined dataframe is the right size
-        if len(combined_df) != len(X): 
-            raise Exception("X and y values must have the same indices")
-        loaders = self.get_dataloaders(combined_df, cross_validation, random_pairs)
+        # Gene order expected by predict (any with a .npy file, whose genes have no names), and the scaler
+        # shared by all folds
+        self.genes_ = None if isinstance(X, str) else list(columns)
+        self.scaler_ = matrix_scaler(genes, np.arange(len(genes))) if self.reuse_scaler else None
+        return combined_df
 
-        # TODO: Remove this? Hard-coded stuff here. 
-        # filename_log = f'Vorinostat-delta={self.delta:.3f}'
-        # checkpoint_callback = ModelCheckpoint(
-        #     monitor='val_ci',
-        #     dirpath='./Saved_models/DeepCINET/rnaseq/',
-        #     filename=filename_log,
-        #     save_top_k=1,
-        #     mode='max'
-        # )
-        self.hyperparams["folds"] = 1
-        # overfit_pct=hparams.overfit_pct)
-        if cross_validation:
-            num_rounds = 1
-            cross_val_ci_per_round = []
-            for _ in range(num_rounds):
-                global_prediction = pd.DataFrame()
-                for (train_dl, val_dl, val_dataset) in loaders:
-                    self.siamese_model = self.get_model(self.config)
-                    trainer = self.get_trainer(self.hyperparams)
-                    trainer.fit(self.siamese_model, train_dl)
-                    predictions = self.predict(val_dataset)
-                    global_prediction = pd.concat([global_prediction, predictions])
-                    global_prediction = global_prediction.sort_index(axis=0)
-                val_ci = concordance_index(y.iloc[:,0].tolist(), global_prediction.iloc[:,0].tolist())
-                cross_val_ci_per_round.append(val_ci)
-        else:
-            if random_pairs:
-                valid_dl, random_dl, val_dataset = loaders[0]
-                self.siamese_model = self.get_model(self.config)
-                trainer = self.get_trainer(self.hyperparams)
-                trainer.fit(self.siamese_model, valid_dl)
-                y_val = val_dataset['target']
-                valid_predictions = self.predict(val_dataset.drop('target', axis=1))
+    def _open_gene_matrix(self, X, values, rows, cols):
+        """With out_of_core, returns the float32 matrix of the rows and columns of values used by the fit,
+        memory-mapped from the file the pair data sets of get_pair_dataset read from, kept in _gene_matrix.
 
-                self.siamese_model = self.get_model(self.config)
-                trainer = self.get_trainer(self.hyperparams)
-                trainer.fit(self.siamese_model, random_dl)
-                random_predictions = self.predict(val_dataset.drop('target', axis=1))
+        A float32 .npy file X is used as it is. Otherwise the file is written in out_of_core_dir a block of
+        rows at a time, so that only a block is ever converted in memory.
+        """
+        if isinstance(X, str) and rows is None and cols is None and values.dtype == np.float32 \
+                and values.flags.c_contiguous:
+            self._gene_matrix = X
+            return values
+        rows = np.arange(len(values)) if rows is None else rows
+        num_genes = values.shape[1] if cols is None else len(cols)
+        matrix = SharedArray.empty((len(rows), num_genes), np.float32,
+                                   dir=self.out_of_core_dir or tempfile.gettempdir())
+        self._gene_matrix = matrix
+        step = max(1, _BLOCK_BYTES // (4 * max(num_genes, 1)))
+        for start in range(0, len(rows), step):
+            block = values[rows[start:start + step]]
+            matrix.array[start:start + step] = block if cols is None else block[:, cols]
+        return matrix.array
 
-                valid_score = concordance_index(y_val.tolist(), valid_predictions.tolist())
-                random_score = concordance_index(y_val.tolist(), random_predictions.tolist())
-                cross_val_ci_per_round = (valid_score, random_score)
-            else:
-                train_dl, _, _ = loaders[0]
-                self.siamese_model = self.get_model(self.config)
-                trainer = self.get_trainer(self.hyperparams)
-                if train_dl is not None:
-                    trainer.fit(self.siamese_model, train_dl)
-                    cross_val_ci_per_round = -1
-                    if self.modelPath != '': 
-                        torch.save(self.siamese_model, self.modelPath)
-                else:
-                    cross_val_ci_per_round = -2
-        return cross_val_ci_per_round
+    def _close_gene_matrix(self):
+        """Remove the file written by _open_gene_matrix, if any"""
+        if isinstance(self._gene_matrix, SharedArray):
+            self._gene_matrix.close()
+        self._gene_matrix = None
+
+    def _release_fit_data(self):
+        """Drop the arrays of _prepare_fit and the cached pairs of the folds, and remove the file of
+        out_of_core once a fit is over
+        """
+        self._fit_data = None
+        pair_cache.clear()
+        self._close_gene_matrix()
+
+    def fit_delta_path(self, X=None, y=None, deltas=None, pair_sampling='all', callback=None):
+        """Cross-validate the model for several delta values sharing one data pipeline
+
+        The data is joined, split into folds and standardized once. Each fold enumerates its pairs once
+        (for the smallest delta) and the pairs of every delta are derived from those, since the pairs of a
+        larger delta are a subset of the pairs of a smaller one. Only the training itself is repeated per delta.
+
+        Parameters
+        ----------
+        X : pandas.dataframe
+            Input training data.
+        y : pandas.dataframe
+            Output data to be predicted.
+        deltas : array
+            Delta values to evaluate.
+        pair_sampling : str
+            'all' to build every valid pair, 'stream' to sample them on the fly (see fit).
+        callback : callable
+            Called as callback(delta, estimator) once the folds of each delta are trained. The estimator then
+            has that delta and, as after fit with cross_validation, the network of the last fold, so that it
+            can be saved.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per delta (the index) with the cross-validated concordance index ('ci') and the total
+            number of training pairs across folds ('pairs').
+
+        Examples
+        --------
+        >>> path = deepCINET(max_epochs=10).fit_delta_path(X, y, deltas=[0.0, 0.05, 0.1])
+        """
+        self._validate_params()
+        assert (pair_sampling in ['all', 'stream']), 'pair_sampling must be either "all" or "stream"'
+        assert not (self.out_of_core and pair_sampling == 'stream'), 'out_of_core requires pair_sampling="all"'
+        deltas = [float(delta) for delta in deltas]
+        start_delta = self.delta
+        # The folds are built for the smallest delta, whose cached pairs the other deltas are filtered from
+        self.delta = min(deltas)
+        combined_df = self._prepare_fit(X, y)
+
+        folds = []
+        for train_index, val_index in self.get_folds(combined_df):
+            train_ds = self.get_pair_dataset(combined_df, train_index, pair_sampling)
+            folds.append((train_ds,
+                          self.get_pair_dataset(combined_df, val_index, pair_sampling, train_ds.scaler),
+                          val_index))
+
+        results = []
+        try:
+            for delta in deltas:
+                self.delta = delta
+                self.config['delta'] = delta
+                loaders = []
+                num_pairs = 0
+                for train_ds, val_ds, val_index in folds:
+                    train_ds = train_ds.with_delta(delta)
+                    if train_ds._is_train:
+                        num_pairs += len(train_ds._sample_list)
+                    else:
+                        num_pairs += len(PairSampler(train_ds.drug_resps, delta))
+                    loaders.append((
+                        pair_loader(train_ds, self.batch_size, shuffle=pair_sampling != 'stream',
+                                    num_workers=self.num_workers),
+                        pair_loader(val_ds.with_delta(delta), self.batch_size, shuffle=pair_sampling != 'stream',
+                                    num_workers=self.num_workers),
+                        val_index))
+                val_ci = self._cross_validate(loaders, combined_df['target'])
+                results.append({'delta': delta, 'ci': val_ci, 'pairs': num_pairs})
+                if callback is not None:
+                    callback(delta, self)
+        finally:
+            self.delta = start_delta
+            self.config['delta'] = start_delta
+            self._release_fit_data()
+        return pd.DataFrame(results).set_index('delta')
+
+    def _cross_validate(self, loaders, y):
+        """Train one model per fold and return the concordance index of the out-of-fold predictions
+        against y, the responses of the fit data.
+        """
+        predictions = []
+        fold = 0
+        while loaders:
+            # Taken out of the list, so that the data sets of a fold are released once it is trained
+            train_dl, val_dl, val_index = loaders.pop(0)
+            # Seeded like the folds of _cross_validate_parallel, so that n_jobs doesn't change the result
+            np.random.seed(self.seed + fold)
+            torch.manual_seed(self.seed + fold)
+            fold += 1
+            self.siamese_model = self.get_model(self.config)
+            self.train_model(self.siamese_model, train_dl, val_dl)
+            predictions.append(self._predict_fit_rows(val_index, y.index))
+        # Out-of-fold predictions in the order of y
+        global_prediction = pd.concat(predictions).loc[y.index]
+        return concordance_index(y.to_numpy(), global_prediction.to_numpy())
+
+    def _cross_validate_parallel(self, dataSet, pair_sampling='all'):
+        """Train the cross-validation folds of dataSet concurrently in n_jobs processes and return the
+        concordance index of the out-of-fold predictions.
+
+        The arrays of _fit_data are shared with the processes through memory-mapped files. Each fold is seeded with seed plus
+        its position, and predictions are merged in fold order, so the result doesn't depend on which process
+        finishes first.
+        """
+        folds = self.get_folds(dataSet)
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        n_jobs = min(n_jobs, len(folds))
+        num_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+
+        estimator = copy.copy(self)
+        estimator.siamese_model = None
+        estimator._fit_data = None
+        # The file of out_of_core already holds the gene expressions
+        genes = self._gene_matrix if self._gene_matrix is not None else SharedArray(self._fit_data[0])
+        responses = SharedArray(self._fit_data[1])
+        try:
+            with ProcessPoolExecutor(n_jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(_fit_fold, estimator, genes, responses, dataSet.index, dataSet.columns[:-1],
+                                       train_index, val_index, pair_sampling, self.seed + fold, num_threads)
+                           for fold, (train_index, val_index) in enumerate(folds)]
+                results = [future.result() for future in futures]
+        finally:
+            if genes is not self._gene_matrix:
+                genes.close()
+            responses.close()
+
+        global_prediction = pd.concat([predictions for _, predictions in results])
+        global_prediction = global_prediction.loc[dataSet.index]
+        # As in the sequential loop, the model of the last fold is kept
+        self.siamese_model = self.get_model(self.config)
+        self.siamese_model.load_state_dict(results[-1][0])
+        return concordance_index(dataSet['target'].to_numpy(), global_prediction.to_numpy())
 
     def predict(self, X):
         """Predict a ranked list from input data
@@ -263,12 +579,13 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         Parameters
         ----------
         X : pandas.dataframe
-            Input test data.
+            Input test data, raw gene expressions with the genes used in fit. They are z-scored with the
+            statistics of the training data.
 
         Returns
         -------
-        torch.Tensor
-            Returns a pytorch tensor of the predicted values
+        pandas.Series
+            The predicted values, indexed like X.
 
         """
 
@@ -276,24 +593,131 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         # np.random.seed(self.hyperparams["seed"])
         # torch.manual_seed(self.hyperparams["seed"])
         
-        index = X.index.values.tolist()
-        X = torch.FloatTensor(X.values)
+        genes_order = getattr(self, 'genes_', None)
+        if genes_order is not None and not X.columns.equals(pd.Index(genes_order)):
+            X = X[genes_order]
+        genes = np.ascontiguousarray(X.to_numpy(), dtype=np.float32)
+        return pd.Series(self._predict_genes(genes), index=X.index)
+
+    def _predict_genes(self, genes, rows=None, chunk_size=None):
+        """Returns the predictions for the rows of the gene expression matrix genes (all of them by default),
+        computed chunk_size rows at a time (predict_chunk_size by default). Only the rows of the current chunk
+        are read from genes, which may be memory-mapped.
+        """
         if self.modelPath != '': 
-            self.siamese_model = torch.load(self.modelPath)
+            self.siamese_model = self._load_model(self.modelPath)
 
         self.siamese_model.eval()
-        
-        result_df = pd.Series(torch.squeeze(self.siamese_model.fc(X).detach()).numpy().tolist(), index=index)
-        return result_df
+        # Networks pickled before the training standardization was kept have no scaler buffers and get raw
+        # inputs
+        standardize = None
+        if 'gene_mean' in dict(self.siamese_model.named_buffers()):
+            standardize = self.siamese_model.standardize
+        num_rows = len(genes) if rows is None else len(rows)
+        chunk_size = chunk_size or getattr(self, 'predict_chunk_size', None) or max(num_rows, 1)
+        predictions = np.empty(num_rows, dtype=np.float32)
+        with torch.inference_mode(), autocast(getattr(self, 'precision', 32)):
+            for start in range(0, num_rows, chunk_size):
+                chunk = genes[start:start + chunk_size] if rows is None else genes[rows[start:start + chunk_size]]
+                chunk = torch.from_numpy(np.ascontiguousarray(chunk, dtype=np.float32))
+                if standardize is not None:
+                    chunk = standardize(chunk)
+                chunk = self.siamese_model.fc(chunk)
+                predictions[start:start + chunk_size] = chunk.view(-1).float().numpy()
+        return predictions
+
+    def _predict_fit_rows(self, rows, index):
+        """Returns the predictions for the rows (positions) of the fit data, as a Series labelled by index, the
+        index of the fit data. With out_of_core, they are read from the file batch_size rows at a time unless
+        predict_chunk_size is set.
+        """
+        rows = np.asarray(rows)
+        chunk_size = self.predict_chunk_size or (self.batch_size if self.out_of_core else None)
+        return pd.Series(self._predict_genes(self._fit_data[0], rows, chunk_size), index=index[rows])
+
+    def _load_model(self, path):
+        """Returns the network saved at path, loading it again only when the file was modified since the last
+        call.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cache = getattr(self, '_model_cache', None)
+        if cache is None or cache[0] != path or cache[1] != mtime:
+            self._model_cache = (path, mtime, torch.load(path))
+        return self._model_cache[2]
 
     def score(self, X=None, y=None):
-        temp_list = self.predict(X).tolist()
-        final_list = []
-        for t in temp_list: 
-            final_list.append(t[0])
+        # return stats.spearmanr(y, self.predict(X))
+        return concordance_index(y, self.predict(X).to_numpy())
+
+    def save(self, path):
+        """Save the fitted model in a compact flat file
+
+        Only what predict needs is written: the weights of the fully connected network, its layer sizes, the
+        standardization statistics of the training data and the gene order, along with the parameters of
+        the estimator. The file has the safetensors layout (see cinet.serialization.save_file), nothing in
+        it is pickled.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file to write.
 
-        # return stats.spearmanr(y,final_list)
-        return concordance_index(y,final_list)
+        Examples
+        --------
+        >>> model.save('models/Erlotinib.safetensors')
+        """
+        save_file(_scorer_tensors(self.siamese_model), path, self._file_metadata(self.siamese_model))
+
+    def _file_metadata(self, model):
+        """Metadata of the file written by save: the parameters of the estimator, the architecture of its
+        network model and the gene order
+        """
+        params = {name: getattr(self, name) for name in self._param_names()}
+        return {
+            'format': 'cinet',
+            'estimator': type(self).__name__,
+            'params': json.dumps(params),
+            'layers_size': json.dumps(list(model.layers_size)),
+            'dropout': json.dumps(model.dropout),
+            'batchnorm': json.dumps(model.batchnorm),
+            'linear': json.dumps(model.linear),
+            'genes': json.dumps(getattr(self, 'genes_', None)),
+        }
+
+    @classmethod
+    def load(cls, path):
+        """Load a model written by save
+
+        The file is memory-mapped and the network rebuilt as a CINETScorer, without unpickling anything or
+        creating a Lightning module.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+
+        Returns
+        -------
+        The fitted estimator (deepCINET, ECINET or deepCINETEnsemble, as saved), ready to predict and score.
+
+        Examples
+        --------
+        >>> model = deepCINET.load('models/Erlotinib.safetensors')
+        """
+        tensors, metadata = load_file(path)
+        if metadata['estimator'] == 'deepCINETEnsemble':
+            # Imported here, the ensemble module depends on this one
+            from .ensemble import deepCINETEnsemble
+            return deepCINETEnsemble._from_file(tensors, metadata)
+        estimator = {'deepCINET': deepCINET, 'ECINET': ECINET}[metadata['estimator']](**_file_params(metadata))
+        estimator.genes_ = json.loads(metadata['genes'])
+        estimator.siamese_model = _file_scorer(tensors, metadata)
+        return estimator
+
+    @classmethod
+    def _param_names(cls):
+        """Names of the constructor parameters of the class, including those of BaseCINET"""
+        return sorted(set(BaseCINET._get_param_names()) | set(cls._get_param_names()))
 
     # HELPER SUB-CLASSES AND SUB-FUNCTIONS
 
@@ -338,13 +762,47 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
 
     ### OPTIONAL TO IMPLEMENT ###
 
-    def get_trainer(self, hyperparams): 
+    def train_model(self, model, train_dl, val_dl=None):
+        """Train the network on the batches of a DataLoader
+
+        Parameters
+        ----------
+        model : DeepCINET
+            The PyTorch Lightning model returned by get_model.
+        train_dl : torch.utils.data.DataLoader
+            The training DataLoader.
+        val_dl : torch.utils.data.DataLoader
+            The validation DataLoader. Used for early stopping when patience is set, ignored otherwise.
+
+        The worker processes of the DataLoaders are stopped once training is over.
+        """
+        model.set_scaler(*train_dl.dataset.scaler)
+        early_stopping = None
+        if self.patience is not None and val_dl is not None:
+            early_stopping = ValidationEarlyStopping(val_dl.dataset, self.patience)
+        try:
+            if self.engine == 'native':
+                model.fit_native(train_dl, self.compile_model, early_stopping)
+            elif early_stopping is None:
+                trainer = self.get_trainer(self.hyperparams)
+                trainer.fit(model, train_dl)
+            else:
+                trainer = self.get_trainer(self.hyperparams, callbacks=[early_stopping])
+                trainer.fit(model, train_dl, val_dl)
+        finally:
+            shutdown_workers(train_dl)
+            if val_dl is not None:
+                shutdown_workers(val_dl)
+
+    def get_trainer(self, hyperparams, callbacks=None): 
         """Returns a PyTorch Lightning Trainer Object
 
         Parameters
         ----------
         hyperparams : dict
             A hyperparameter object with relevant values for trainer initialization.
+        callbacks : list
+            Lightning callbacks of the trainer.
 
         Returns
         -------
@@ -363,8 +821,8 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
                 # enable_benchmark=False,
                 num_sanity_val_steps=0,
                 # auto_find_lr=hparams.auto_find_lr,
-                #   callbacks=[EarlyStopping(monitor='val_ci', mode="max", patience=5),
-                #              checkpoint_callback],
+                callbacks=callbacks,
+                precision=hyperparams.get('precision', 32),
                 check_val_every_n_epoch=hyperparams['check_val_every_n_epoch'])
         
         return trainer
@@ -380,52 +838,91 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
         result = pd.cut(y, bins, labels=vec_folds)
         return result
 
-    def get_dataloaders(self, dataSet, cross_validation, random_pairs): 
+    def get_folds(self, dataSet):
+        """Returns the (train_index, val_index) cross-validation splits of dataSet, stratified on binned
+        target values.
+        """
+        y = dataSet['target']
+        num_folds = 5
+        # gene_data = Dataset(dataSet, False, self.batch_size)
+        # print(y)
+        new_y = self.classify_target(y)
+        # print(new_y)        
+        skf = StratifiedKFold(n_splits=num_folds, random_state=None)
+        # train_idx, val_idx = train_test_split(list(range(gene_data.__len__())), test_size=0.2)
+        # Only the number of rows of X matters to the split
+        return list(skf.split(np.zeros(len(dataSet)), new_y))
+
+    def get_pair_dataset(self, dataSet, idxs, pair_sampling='all', scaler=None):
+        """Returns the training pair data set of the rows idxs of dataSet.
+
+        Parameters
+        ----------
+        dataSet : pandas.DataFrame
+            Takes in a Pandas DataFrame object.
+        idxs : array
+            Positions of the rows of dataSet to draw pairs from.
+        pair_sampling : str
+            'all' to build every valid pair, 'stream' to sample them on the fly.
+        scaler : tuple
+            (mean, std) to z-score the gene expressions with, e.g. those of the training rows for validation
+            rows. Defaults to the scaler shared by all folds with reuse_scaler, and to the statistics of the
+            rows idxs otherwise.
+
+        Returns
+        -------
+        A Dataset, or a StreamDataset when pair_sampling is 'stream'. With the 'matrix' objective, a Dataset
+        of cell lines. A MemmapDataset over the file written by fit with out_of_core.
+        """
+        if scaler is None:
+            scaler = self.scaler_
+        if self._gene_matrix is not None:
+            return MemmapDataset(self._gene_matrix, self._fit_data[1], self.objective != 'matrix',
+                                 self.batch_size, self.delta, idxs, unique_cells=self.unique_cells, scaler=scaler)
+        # During a fit, the rows are gathered from the float32 arrays dataSet is a view of
+        data = self._fit_data if self._fit_data is not None else dataSet
+        if self.objective == 'matrix':
+            return Dataset(data, False, self.batch_size, self.delta, idxs, scaler=scaler)
+        if pair_sampling == 'stream':
+            return StreamDataset(data, self.batch_size, self.delta, idxs, self.pairs_per_epoch,
+                                 unique_cells=self.unique_cells, scaler=scaler)
+        return Dataset(data, True, self.batch_size, self.delta, idxs, unique_cells=self.unique_cells,
+                       scaler=scaler)
+
+    def get_dataloaders(self, dataSet, cross_validation, random_pairs, pair_sampling='all'): 
         """Returns a tuple containing the training and then the testing PyTorch DataLoaders.
 
         Parameters
         ----------
         dataSet : pandas.DataFrame
             Takes in a Pandas DataFrame object.
+        pair_sampling : str
+            'all' to build every valid pair, 'stream' to sample them on the fly.
 
         Returns
         -------
-        A tuple with two objects. The first one is the training dataloader (PyTorch.DataLoader), the 
-        second is the testing dataloader. 
+        A list of tuples, one per fold. The first object is the training dataloader (PyTorch.DataLoader),
+        the second is the testing dataloader and the third the positions of the validation rows in dataSet.
         """
-        y = dataSet['target']
-        X = dataSet.iloc[:, 0:-1]
         loaders = []
         if cross_validation:
-            num_folds = 5
-            # gene_data = Dataset(dataSet, False, self.batch_size)
-            # print(y)
-            new_y = self.classify_target(y)
-            # print(new_y)        
-            skf = StratifiedKFold(n_splits=num_folds, random_state=None)
-            result = skf.split(X,new_y)
-            # train_idx, val_idx = train_test_split(list(range(gene_data.__len__())), test_size=0.2)
+            result = self.get_folds(dataSet)
             count = 1
             for train_index, val_index in result:
-                dS = Dataset(dataSet, True, self.batch_size, self.delta, train_index)
-                num_pairs = len(dS._build_pairs(delta=self.delta))
-                randoms = random.sample(dS._build_pairs(delta=0.0), num_pairs)
-                train_dl = torch.utils.data.DataLoader(
+                dS = self.get_pair_dataset(dataSet, train_index, pair_sampling)
+                train_dl = pair_loader(
                     dS,
-                    batch_size=self.hyperparams['batch_size'], 
-                    shuffle=True, 
+                    self.hyperparams['batch_size'],
+                    shuffle=pair_sampling != 'stream',
                     num_workers=self.hyperparams['num_workers'],
-                    multiprocessing_context='spawn',
                 )
                 # val_dl = Dataset(dataSet, True, self.batch_size, self.delta, val_index)
-                val_dl = torch.utils.data.DataLoader(
-                    Dataset(dataSet, True, self.batch_size, self.delta, val_index),
-                    batch_size=self.hyperparams['batch_size'], 
-                    shuffle=True, 
+                val_dl = pair_loader(
+                    self.get_pair_dataset(dataSet, val_index, pair_sampling, dS.scaler),
+                    self.hyperparams['batch_size'],
+                    shuffle=pair_sampling != 'stream',
                     num_workers=self.hyperparams['num_workers'],
-                    multiprocessing_context='spawn',
                 )
-                val_dataset = X.iloc[val_index]
 
                 # train_aac = y.iloc[train_index]
                 # val_aac = y.iloc[val_index]
@@ -433,45 +930,158 @@ class BaseCINET(sklearn.base.BaseEstimator, metaclass=ABCMeta):
                 # aux = pd.concat([df.assign(dataset=k) for (df, k) in tables])
                 # fig = sns.displot(aux, x="target", hue="dataset", kind="kde", fill=True, legend=True).set(title="AAC Distribution Comparison", xlabel="AAC Standarized", ylabel="Density")
                 # fig.savefig('AAC Distribution Comparison-' + str(count) + '.png')
-                loaders.append((train_dl, val_dl, val_dataset))
+                loaders.append((train_dl, val_dl, val_index))
                 count = count + 1
         else:
-            gene_data = Dataset(dataSet, False, self.batch_size)
-            train_idx, val_idx = train_test_split(list(range(gene_data.__len__())), test_size=0.2)
-            train_dl = torch.utils.data.DataLoader(
-                    Dataset(dataSet, True, self.batch_size, self.delta, train_idx),
-                    batch_size=self.hyperparams['batch_size'], 
-                    shuffle=True, 
+            train_idx, val_idx = train_test_split(list(range(len(dataSet))), test_size=0.2)
+            dS = self.get_pair_dataset(dataSet, train_idx, pair_sampling)
+            train_dl = pair_loader(
+                    dS,
+                    self.hyperparams['batch_size'],
+                    shuffle=pair_sampling != 'stream',
                     num_workers=self.hyperparams['num_workers'],
-                    multiprocessing_context='spawn',
                 )
             if random_pairs:
-                dS = Dataset(dataSet, True, self.batch_size, self.delta, train_idx)
-                num_pairs = len(dS)
-                randoms = random.sample(dS._build_pairs(delta=0.0), num_pairs)
-                val_dl = torch.utils.data.DataLoader(
-                        Dataset(dataSet, True, self.batch_size, 0.0, pre_built=True, pairs=randoms),
-                        batch_size=self.hyperparams['batch_size'], 
-                        shuffle=True, 
+                # Same number of pairs, drawn among all pairs (delta=0) of
+                # the training rows, which the pair cache already holds
+                randoms = sample_pairs(dS._build_pairs(delta=0.0), len(dS))
+                val_dl = pair_loader(
+                        Dataset(dataSet.iloc[train_idx], True, self.batch_size, 0.0, pre_built=True, pairs=randoms,
+                                unique_cells=self.unique_cells, scaler=dS.scaler),
+                        self.hyperparams['batch_size'],
+                        shuffle=True,
                         num_workers=self.hyperparams['num_workers'],
-                        multiprocessing_context='spawn',
                     )
-                val_dataset = dataSet.iloc[val_idx]
-                loaders.append((train_dl, val_dl, val_dataset))
+                loaders.append((train_dl, val_dl, np.asarray(val_idx)))
             else:
-                """
-                val_dl = torch.utils.data.DataLoader(
-                        Dataset(dataSet, True, self.batch_size, self.delta, val_idx),
-                        batch_size=self.hyperparams['batch_size'], 
-                        shuffle=True, 
-                        num_workers=self.hyperparams['num_workers'],
-                        multiprocessing_context='spawn',
-                    )
-                """
-                loaders.append((train_dl, None, None))
+                val_dl = None
+                if self.patience is not None:
+                    # Held out rows, for early stopping
+                    val_dl = pair_loader(
+                            self.get_pair_dataset(dataSet, val_idx, pair_sampling, dS.scaler),
+                            self.hyperparams['batch_size'],
+                            shuffle=pair_sampling != 'stream',
+                            num_workers=self.hyperparams['num_workers'],
+                        )
+                loaders.append((train_dl, val_dl, None))
         return loaders
 
 
+def _scorer_tensors(model):
+    """Arrays of the network model written by save: the weights of the fully connected network and the
+    standardization statistics
+    """
+    return {key: value.detach().cpu().numpy() for key, value in model.state_dict().items()
+            if key.startswith('fc.') or key in ['gene_mean', 'gene_std']}
+
+
+def _file_params(metadata):
+    """Constructor parameters of the estimator of a file written by save"""
+    params = json.loads(metadata['params'])
+    # JSON has no tuples
+    if 'nnHiddenLayers' in params:
+        params['nnHiddenLayers'] = tuple(params['nnHiddenLayers'])
+    # The loaded network is used, not the file modelPath pointed to
+    params['modelPath'] = ''
+    return params
+
+
+def _file_scorer(tensors, metadata):
+    """CINETScorer with the arrays tensors of _scorer_tensors, in evaluation mode"""
+    model = CINETScorer(json.loads(metadata['layers_size']), json.loads(metadata['dropout']),
+                        json.loads(metadata['batchnorm']), json.loads(metadata['linear']))
+    state = model.state_dict()
+    state.update({name: torch.from_numpy(array) for name, array in tensors.items()})
+    model.load_state_dict(state)
+    model.eval()
+    return model
+
+
+# Size of the blocks of rows written to the file of out_of_core
+_BLOCK_BYTES = 2 ** 26
+
+
+def _gene_source(X, y):
+    """Returns the gene expressions and responses passed to fit as (values, rows, cols, y, index, columns):
+    the matrix values of X, not copied when possible (e.g. memory-mapped), the positions rows and cols of the
+    cell lines and genes of the fit in it (None for all of them), the responses y as a Series, and the labels
+    of the rows and columns of the fit.
+    """
+    if isinstance(y, pd.DataFrame):
+        y = y.iloc[:, 0]
+    if isinstance(X, str):
+        values = np.load(X, mmap_mode='r')
+        if values.ndim != 2:
+            raise Exception("X must be the path of a 2-D .npy matrix")
+        if not isinstance(y, pd.Series):
+            y = pd.Series(np.asarray(y), name='target')
+        if len(values) != len(y):
+            raise Exception("X and y values are not of the same length")
+        return values, None, None, y, y.index, pd.RangeIndex(values.shape[1])
+
+    cols = None
+    columns = X.columns
+    if isinstance(y, str):
+        position = X.columns.get_loc(y)
+        cols = np.delete(np.arange(X.shape[1]), position)
+        columns = X.columns.delete(position)
+        y = X[y]
+    rows = None
+    index = X.index
+    if not y.index.equals(X.index):
+        # Aligned on X, as joining them would: the rows of X of the cell lines of y, in the order of X
+        if not (y.index.is_unique and X.index.is_unique):
+            raise Exception("X and y values must have the same indices")
+        rows = X.index.get_indexer(y.index)
+        if (rows < 0).any():
+            raise Exception("X and y values must have the same indices")
+        rows = np.sort(rows)
+        index = X.index[rows]
+        y = y.loc[index]
+        if len(rows) == len(X):
+            rows = None
+    return X.to_numpy(), rows, cols, y, index, columns
+
+
+def _fit_frame(genes, responses, index, columns):
+    """DataFrame of the gene expressions genes followed by the 'target' column responses, which holds a view
+    of genes rather than a copy
+    """
+    dataSet = pd.DataFrame(genes, index=index, columns=columns, copy=False)
+    dataSet['target'] = responses
+    return dataSet
+
+
+def _fit_fold(estimator, genes, responses, index, columns, train_index, val_index, pair_sampling, seed,
+              num_threads):
+    """Train one cross-validation fold in a worker process of BaseCINET._cross_validate_parallel and return
+    the state dict of the trained network with its predictions for the validation rows.
+    """
+    torch.set_num_threads(num_threads)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    genes = np.load(genes, mmap_mode='r') if isinstance(genes, str) else np.asarray(genes)
+    estimator._fit_data = (genes, np.asarray(responses))
+    dataSet = _fit_frame(*estimator._fit_data, index, columns)
+    train_ds = estimator.get_pair_dataset(dataSet, train_index, pair_sampling)
+    train_dl = pair_loader(
+        train_ds,
+        estimator.hyperparams['batch_size'],
+        shuffle=pair_sampling != 'stream',
+    )
+    val_dl = None
+    if estimator.patience is not None:
+        val_dl = pair_loader(
+            estimator.get_pair_dataset(dataSet, val_index, pair_sampling, train_ds.scaler),
+            estimator.hyperparams['batch_size'],
+            shuffle=False,
+        )
+    estimator.siamese_model = estimator.get_model(estimator.config)
+    estimator.train_model(estimator.siamese_model, train_dl, val_dl)
+    predictions = estimator._predict_fit_rows(val_index, index)
+    return estimator.siamese_model.state_dict(), predictions
+
+
 ### INHERITING CLASSES ###
 
 
@@ -503,16 +1113,58 @@ class deepCINET(BaseCINET):
         
 
 class ECINET(BaseCINET): 
+    def __init__(self, ratio=0.4, reg_contr=0.4, solver='sgd', num_lambdas=20, **kwargs):
+        # """
+        # ratio : float
+        #     Share of the L1 penalty in the elastic net penalty, the L2 penalty getting the rest.
+        # reg_contr : float
+        #     Weight of the elastic net penalty in the loss.
+        # solver : str
+        #     'sgd' trains the linear network by minibatches with a Lightning Trainer. 'coordinate_descent'
+        #     solves the convex problem directly with squared hinge (margin 1) pair losses, along a
+        #     regularization path ending at reg_contr (see cinet.solvers.rank_elastic_net_path). The path
+        #     is kept in lambdas_ and coef_path_.
+        # num_lambdas : int
+        #     Number of points of the regularization path of the 'coordinate_descent' solver.
+        # """
+        self.ratio = ratio
+        self.reg_contr = reg_contr
+        self.solver = solver
+        self.num_lambdas = num_lambdas
+        super().__init__(**kwargs)
+
+    def _validate_params(self): 
+        super()._validate_params()
+        assert isinstance(self.ratio, float), 'ratio must be of type float'
+        assert (0.0 <= self.ratio <= 1.0), 'ratio must be between 0 and 1'
+        assert isinstance(self.reg_contr, float), 'reg_contr must be of type float'
+        assert (self.solver in ['sgd', 'coordinate_descent']), 'solver must be either "sgd" or "coordinate_descent"'
+        assert isinstance(self.num_lambdas, int), 'num_lambdas must be of type int'
+        assert (self.num_lambdas >= 1), 'num_lambdas must be at least 1'
+
     def getConfig(self): 
         return {
             'nnHiddenLayers': (0,0,0,0),
             'batchnorm': False,
-            # TODO: Not hardcode these two following values
-            'ratio': 0.4, 
-            'reg_contr': 0.4,
+            'ratio': self.ratio, 
+            'reg_contr': self.reg_contr,
         }
 
     def get_model(self, config):
         return DeepCINET(hyperparams=self.hyperparams, config=config, linear=True)
 
+    def train_model(self, model, train_dl, val_dl=None):
+        if self.solver == 'sgd':
+            return super().train_model(model, train_dl, val_dl)
+        # Solve on all the valid pairs of the (standardized) training data
+        dataset = train_dl.dataset
+        model.set_scaler(*dataset.scaler)
+        pairs = pair_cache.get(dataset.drug_resps, dataset.delta)
+        self.lambdas_, self.coef_path_ = rank_elastic_net_path(dataset.gene_exprs.numpy(), pairs, self.ratio,
+                                                              self.reg_contr, self.num_lambdas)
+        linear = model.fc.layers[0]
+        with torch.no_grad():
+            linear.weight.copy_(torch.from_numpy(self.coef_path_[-1]).view_as(linear.weight))
+            linear.bias.zero_()
+
 
@@ -0,0 +1,294 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def read_table(path, cache_dir=None, mmap=True):
+    """Read a cell line table CSV through a binary cache
+
+    The tables of the package (train_data/<drug>.csv, test_data/*_Test_Data/<drug>.csv, ...) have the cell
+    lines in the first column followed by numeric columns (the response and the gene expressions). The
+    first time a table is read, it is parsed with pandas and its values stored as a float32 .npy matrix,
+    with the cell lines and column names in a JSON file. Later reads memory-map that matrix instead of
+    parsing the CSV again, which is near-instant whatever the number of genes.
+
+    The cache files are named after a hash of the absolute path, size and modification time of the CSV, so
+    editing or replacing it invalidates them, and the stale ones are removed. Tables with non numeric
+    columns are read with pandas and not cached.
+
+    Parameters
+    ----------
+    path : str
+        Path of the CSV file.
+    cache_dir : str
+        Directory of the cache files. Defaults to a .cinet_cache directory next to the CSV file, ignored by
+        the .gitignore of this repository. Add .cinet_cache/ to the .gitignore of other repositories
+        holding CSV files, or pass a directory outside of them.
+    mmap : bool
+        If true, the cached matrix is memory-mapped copy-on-write: it is read from disk as it is used, and
+        changes to the returned DataFrame never reach the cache. Otherwise it is read in memory.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The table, indexed by its first column, as ``pd.read_csv(path).set_index('cell_line')`` but with
+        float32 values.
+
+    Examples
+    --------
+    >>> table = read_table('train_data/Erlotinib.csv')
+    >>> X, y = table.iloc[:, 1:], table.iloc[:, 0]
+    """
+    path = os.path.abspath(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), '.cinet_cache')
+    stat = os.stat(path)
+    key = hashlib.sha1(('%s:%d:%d' % (path, stat.st_size, stat.st_mtime_ns)).encode('utf-8')).hexdigest()[:16]
+    stem = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0])
+    matrix_path = '%s-%s.npy' % (stem, key)
+    info_path = '%s-%s.json' % (stem, key)
+
+    if not os.path.exists(info_path):
+        table = pd.read_csv(path)
+        table = table.set_index(list(table.columns[[0]]))
+        if not all(pd.api.types.is_numeric_dtype(dtype) for dtype in table.dtypes):
+            return table
+        _write_cache(table, stem, matrix_path, info_path)
+
+    with open(info_path) as file:
+        info = json.load(file)
+    matrix = np.load(matrix_path, mmap_mode='c' if mmap else None)
+    index = pd.Index(info['index'], name=info['index_name'])
+    return pd.DataFrame(matrix, index=index, columns=info['columns'], copy=False)
+
+
+def _write_cache(table, stem, matrix_path, info_path):
+    """Write the cache files of table, the JSON file last since its presence marks a complete cache"""
+    cache_dir = os.path.dirname(stem)
+    os.makedirs(cache_dir, exist_ok=True)
+    pattern = glob.escape(stem) + '-' + '[0-9a-f]' * 16
+    for stale in glob.glob(pattern + '.npy') + glob.glob(pattern + '.json'):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    info = {'index_name': table.index.name,
+            'index': table.index.tolist(),
+            'columns': table.columns.tolist()}
+    # Written to temporary files and renamed, so that concurrent readers never
+    # see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+    with os.fdopen(fd, 'wb') as file:
+        np.save(file, np.ascontiguousarray(table.to_numpy(), dtype=np.float32))
+    os.replace(tmp_path, matrix_path)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(info, file)
+    os.replace(tmp_path, info_path)
+
+
+class ExpressionStore:
+    """Gene expressions of a source dataset stored once, with the responses to all its drugs
+
+    The per drug tables (one CSV per drug with the response and the expression of every tested cell line)
+    repeat the expression matrix of the dataset once per drug. A store keeps it a single time instead, as a
+    float32 .npy matrix of cell lines x genes that is memory-mapped, and the responses as a sparse table of
+    (cell line, drug, response) triplets grouped by drug. The (X, y) of a drug are then gathered from the
+    matrix by row index lookup, without any parsing, with the cell lines in the order of the original
+    table.
+
+    A store is a directory created by write or from_tables, holding expression.npy, responses.npz and
+    store.json (the names of the cell lines, genes and drugs).
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store.
+    mmap : bool
+        If true, the expression matrix is memory-mapped (copy-on-write) instead of read in memory.
+
+    Examples
+    --------
+    >>> store = ExpressionStore.from_tables('gdsc_store', {drug: 'test_data/GDSC_Test_Data/' + drug + '.csv'
+    ...                                                    for drug in drugs})
+    >>> X, y = store.load('Erlotinib')
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'store.json')) as file:
+            info = json.load(file)
+        self.cells = pd.Index(info['cells'], name=info['index_name'])
+        self.genes = pd.Index(info['genes'])
+        self.drugs = list(info['drugs'])
+        self._drug_index = {drug: k for k, drug in enumerate(self.drugs)}
+        self.expression = np.load(os.path.join(path, 'expression.npy'), mmap_mode='c' if mmap else None)
+        with np.load(os.path.join(path, 'responses.npz')) as responses:
+            self._cell_idx = responses['cell']
+            self._values = responses['response']
+            self._offsets = responses['offsets']
+
+    def __len__(self):
+        return len(self.drugs)
+
+    def __contains__(self, drug):
+        return drug in self._drug_index
+
+    def load(self, drug, genes=None):
+        """Returns the (X, y) of the cell lines tested with drug
+
+        Parameters
+        ----------
+        drug : str
+            Name of the drug.
+        genes : list
+            Genes (columns of X) to load, all of them by default.
+
+        Returns
+        -------
+        tuple
+            X, a pandas.DataFrame of the gene expressions of the tested cell lines, and y, a pandas.Series
+            ('target') of their responses, both indexed by cell line.
+        """
+        start, end = self._span(drug)
+        rows = self._cell_idx[start:end]
+        index = self.cells[rows]
+        if genes is None:
+            X = pd.DataFrame(self.expression[rows], index=index, columns=self.genes, copy=False)
+        else:
+            columns = self.genes.get_indexer(genes)
+            if (columns < 0).any():
+                raise KeyError("Genes not in the store: %s" % list(pd.Index(genes)[columns < 0]))
+            X = pd.DataFrame(self.expression[np.ix_(rows, columns)], index=index, columns=genes, copy=False)
+        y = pd.Series(self._values[start:end], index=index, name='target')
+        return X, y
+
+    def responses(self, drug):
+        """Returns the y of load(drug) alone, without gathering the gene expressions
+        """
+        start, end = self._span(drug)
+        return pd.Series(self._values[start:end], index=self.cells[self._cell_idx[start:end]], name='target')
+
+    def frame(self):
+        """Returns the gene expressions of all the cell lines as a DataFrame over the expression matrix, which
+        isn't read until it is used. With the responses of a drug, fit uses the rows of the tested cell lines
+        only, and with out_of_core reads them from the matrix a block at a time.
+
+        Examples
+        --------
+        >>> model = deepCINET(out_of_core=True)
+        >>> model.fit(store.frame(), store.responses('Erlotinib'))
+        """
+        return pd.DataFrame(self.expression, index=self.cells, columns=self.genes, copy=False)
+
+    def _span(self, drug):
+        """Returns the (start, end) of the triplets of drug"""
+        if drug not in self._drug_index:
+            raise KeyError("Drug %s is not in the store %s" % (drug, self.path))
+        k = self._drug_index[drug]
+        return self._offsets[k], self._offsets[k + 1]
+
+    def table(self, drug):
+        """Returns the table of drug as read_table would from a per drug CSV: the response ('target')
+        followed by the gene expressions
+        """
+        X, y = self.load(drug)
+        return pd.concat([y, X], axis=1)
+
+    @classmethod
+    def write(cls, path, expression, responses):
+        """Create a store from an expression matrix and a response matrix
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store, created if needed.
+        expression : pandas.DataFrame
+            Gene expressions, cell lines x genes.
+        responses : pandas.DataFrame
+            Responses, cell lines x drugs, NaN where a cell line was not tested. Its cell lines must all be in
+            expression.
+
+        Returns
+        -------
+        ExpressionStore
+            The new store.
+        """
+        rows = expression.index.get_indexer(responses.index)
+        if (rows < 0).any():
+            raise ValueError("Cell lines without expression: %s" % list(responses.index[rows < 0]))
+        values = responses.to_numpy(dtype=np.float32).T
+        # By drug, and in the order of responses for each drug
+        drug_idx, cell_pos = np.nonzero(~np.isnan(values))
+        cls._write(path, expression.index, expression.columns, expression.to_numpy(), list(responses.columns),
+                   rows[cell_pos], drug_idx, values[drug_idx, cell_pos])
+        return cls(path)
+
+    @classmethod
+    def from_tables(cls, path, tables):
+        """Create a store from per drug tables, in the format of read_table
+
+        The expression of a cell line is taken from the first table it appears in. All tables must have the
+        same genes.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store, created if needed.
+        tables : dict
+            Path of the CSV table of every drug, by drug name.
+
+        Returns
+        -------
+        ExpressionStore
+            The new store.
+        """
+        genes = None
+        cells = {}
+        blocks = []
+        cell_idx, drug_idx, values = [], [], []
+        for k, (drug, table_path) in enumerate(tables.items()):
+            table = read_table(table_path)
+            X = table.iloc[:, 1:]
+            if genes is None:
+                genes = X.columns
+                index_name = table.index.name
+            elif not X.columns.equals(genes):
+                if set(X.columns) != set(genes):
+                    raise ValueError("The genes of %s differ from those of the other tables" % table_path)
+                X = X[genes]
+            new = ~table.index.isin(list(cells)) & ~table.index.duplicated()
+            for cell in table.index[new]:
+                cells[cell] = len(cells)
+            blocks.append(X.to_numpy(dtype=np.float32)[new])
+            cell_idx.append(np.array([cells[cell] for cell in table.index], dtype=np.int64))
+            drug_idx.append(np.full(len(table), k, dtype=np.int64))
+            values.append(table.iloc[:, 0].to_numpy(dtype=np.float32))
+        cell_idx = np.concatenate(cell_idx)
+        drug_idx = np.concatenate(drug_idx)
+        values = np.concatenate(values)
+        keep = ~np.isnan(values)
+        cls._write(path, pd.Index(list(cells), name=index_name), genes, np.concatenate(blocks), list(tables),
+                   cell_idx[keep], drug_idx[keep], values[keep])
+        return cls(path)
+
+    @staticmethod
+    def _write(path, cells, genes, expression, drugs, cell_idx, drug_idx, values):
+        """Write the files of a store, the triplets being grouped by drug"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'expression.npy'), np.ascontiguousarray(expression, dtype=np.float32))
+        np.savez(os.path.join(path, 'responses.npz'),
+                 cell=np.asarray(cell_idx, dtype=np.int32),
+                 response=np.asarray(values, dtype=np.float32),
+                 offsets=np.searchsorted(drug_idx, np.arange(len(drugs) + 1)).astype(np.int64))
+        info = {'index_name': cells.name,
+                'cells': cells.tolist(),
+                'genes': list(genes),
+                'drugs': drugs}
+        with open(os.path.join(path, 'store.json'), 'w') as file:
+            json.dump(info, file)
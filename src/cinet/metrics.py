@@ -0,0 +1,153 @@
+import numpy as np
+
+
+def concordance_index(y_true, y_pred):
+    """Concordance index of predictions against observed responses
+
+    Same definition as ``lifelines.utils.concordance_index`` without censoring:
+    the fraction of pairs with different responses whose predictions are in
+    the same order, pairs with tied predictions counting for one half.
+    Computed in O(n log^2 n) with vectorized merge sort passes instead of
+    comparing every pair in O(n^2).
+
+    Parameters
+    ----------
+    y_true : array_like
+        Observed responses, of length n.
+    y_pred : array_like
+        Predicted scores, of length n.
+
+    Returns
+    -------
+    float
+        The concordance index, between 0 and 1.
+
+    Raises
+    ------
+    ZeroDivisionError
+        If all responses are equal, there are no pairs to compare.
+
+    Examples
+    --------
+    >>> concordance_index([0.1, 0.5, 0.3], [0.2, 0.7, 0.4])
+    1.0
+    """
+    y_pred = np.asarray(y_pred, dtype=np.float64).ravel()
+    return float(concordance_index_batch(y_true, y_pred[None, :])[0])
+
+
+def concordance_index_batch(y_true, y_pred):
+    """Concordance indices of many prediction vectors against one response vector
+
+    Every row of y_pred (e.g. the predictions of several models, or of a
+    delta sweep) is scored against y_true at once, which is much faster than
+    calling concordance_index once per row.
+
+    Parameters
+    ----------
+    y_true : array_like
+        Observed responses, of length n.
+    y_pred : array_like
+        Predicted scores, of shape (m, n).
+
+    Returns
+    -------
+    numpy.ndarray
+        The m concordance indices.
+
+    Raises
+    ------
+    ZeroDivisionError
+        If all responses are equal, there are no pairs to compare.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    y_pred = np.atleast_2d(np.asarray(y_pred, dtype=np.float64))
+    if y_pred.ndim != 2 or y_pred.shape[1] != y_true.shape[0]:
+        raise ValueError("y_pred must have shape (m, %d)" % y_true.shape[0])
+    if np.isnan(y_true).any() or np.isnan(y_pred).any():
+        raise ValueError("NaNs detected in inputs, please correct or drop.")
+
+    num_rows, size = y_pred.shape
+    y_sorted = np.sort(y_true)
+    admissible = size * (size - 1) // 2 - _tied_pairs(y_sorted[None, :] == np.roll(y_sorted, 1)[None, :])[0]
+    if admissible == 0:
+        raise ZeroDivisionError("No admissable pairs in the dataset.")
+
+    # Order every row by response, and by decreasing prediction among equal
+    # responses: pairs (i, j) with i before j and pred[i] < pred[j] are then
+    # exactly the concordant pairs, none of them sharing a response
+    order = np.lexsort((-y_pred, np.broadcast_to(y_true, y_pred.shape)), axis=-1)
+    preds = np.take_along_axis(y_pred, order, axis=-1)
+    less, less_equal = _ordered_pairs(_dense_ranks(preds))
+
+    # Pairs with tied predictions, minus those that also share a response
+    same = (preds == np.roll(preds, 1, axis=-1)) & (y_sorted == np.roll(y_sorted, 1))[None, :]
+    tied = less_equal - less - _tied_pairs(same)
+    return (less + 0.5 * tied) / admissible
+
+
+def _dense_ranks(values):
+    """Rank of every value in its row, equal values sharing a rank"""
+    order = np.argsort(values, axis=-1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+    new_value = np.ones(values.shape, dtype=np.int64)
+    new_value[:, 0] = 0
+    new_value[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ranks = np.empty_like(new_value)
+    np.put_along_axis(ranks, order, np.cumsum(new_value, axis=-1), axis=-1)
+    return ranks
+
+
+def _tied_pairs(same_as_previous):
+    """Number of pairs inside the runs of equal values of every row, given a
+    mask telling whether each element equals the previous one
+    """
+    same_as_previous = same_as_previous.copy()
+    same_as_previous[:, 0] = False
+    positions = np.arange(same_as_previous.shape[1])
+    run_starts = np.maximum.accumulate(np.where(same_as_previous, 0, positions), axis=-1)
+    return (positions - run_starts).sum(axis=-1)
+
+
+def _ordered_pairs(ranks):
+    """Count the pairs i < j with ranks[i] < ranks[j] and with ranks[i] <= ranks[j]
+    in every row, with a bottom-up merge sort
+
+    At every pass, each block of width elements is sorted, and the elements of
+    every right block are located in its left neighbour with one searchsorted
+    call for the whole array (blocks are told apart by adding an offset to the
+    keys). Sorting the offset keys then merges the block pairs.
+
+    Each of the log n passes does O(n log n) work (the binary searches, and
+    the stable sort merging the sorted runs), so O(n log^2 n) in all. Merging
+    the blocks with a scatter instead of the sort keeps the same bound, as
+    the binary searches remain, and is slower in practice.
+    """
+    num_rows, size = ranks.shape
+    less = np.zeros(num_rows, dtype=np.int64)
+    less_equal = np.zeros(num_rows, dtype=np.int64)
+    if size < 2:
+        return less, less_equal
+    positions = np.arange(size)
+    rows = np.repeat(np.arange(num_rows), size)
+    values = ranks.ravel()
+    span = size + 1
+    width = 1
+    while width < size:
+        block = positions // width
+        num_merges = -(-size // (2 * width))
+        merge = (rows * num_merges + np.tile(block // 2, num_rows)) * span
+        is_right = np.tile(block % 2 == 1, num_rows)
+        keys = merge + values
+        left_keys = keys[~is_right]
+        right_keys = keys[is_right]
+        right_start = merge[is_right]
+        start = np.searchsorted(left_keys, right_start, side="left")
+        right_rows = rows[is_right]
+        less += np.bincount(right_rows, np.searchsorted(left_keys, right_keys, side="left") - start,
+                            minlength=num_rows).astype(np.int64)
+        less_equal += np.bincount(right_rows, np.searchsorted(left_keys, right_keys, side="right") - start,
+                                  minlength=num_rows).astype(np.int64)
+        values = np.sort(keys, kind="stable") - merge
+        width *= 2
+    return less, less_equal
@@ -3,6 +3,7 @@ import sklearn
 import pandas as pd
 import numpy as np
 import os
+import copy
 import argparse
 import tensorboard
 
@@ -15,6 +16,10 @@ import torch
 import torch.nn as nn
 import torch.utils.data
 
+from .metrics import concordance_index
+from .pairs import PairList, PairSampler, pair_cache
+from .shared import SharedArray
+
 import pytorch_lightning as pl
 from pytorch_lightning import Trainer
 from pytorch_lightning.callbacks import EarlyStopping
@@ -80,14 +85,76 @@ class FullyConnectedLinear(nn.Module):
           x = layer(x)
       return x
 
+def gene_scaler(gene_exprs):
+    """ Per gene mean and standard deviation of a (cell lines, genes) matrix,
+    used to z-score it. Genes with no variance get a standard deviation of 1,
+    so that they are only centered instead of turning into NaNs
+    """
+    mean = np.mean(gene_exprs, axis=0, dtype=np.float64)
+    std = np.std(gene_exprs, axis=0, dtype=np.float64)
+    return mean, _unit_std(mean, std)
+
+
+def _unit_std(mean, std):
+    """ std with 1 for the genes whose deviation is only rounding noise
+    relative to their mean, shared by gene_scaler and matrix_scaler so that
+    they treat the same genes as constant
+    """
+    std[std <= 1e-7 * np.maximum(np.abs(mean), 1.0)] = 1.0
+    return std
+
+
+def autocast(precision, device='cpu'):
+    """ Context running the matrix products of the networks in bfloat16,
+    with float32 weights and accumulation, when precision is 'bf16'. Does
+    nothing for precision 32
+    """
+    return torch.autocast(device_type=device, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+
+class CINETScorer(nn.Module):
+    """
+    Scoring part of a trained DeepCINET: the fully connected network and the
+    standardization of its inputs. It is all predict needs, and what
+    BaseCINET.load rebuilds from a saved model without the training
+    machinery of the LightningModule.
+    """
+    def __init__(self, layers_size, dropout, batchnorm, linear=False):
+        super(CINETScorer, self).__init__()
+        self.layers_size = list(layers_size)
+        self.dropout = dropout
+        self.batchnorm = batchnorm
+        self.linear = linear
+        if linear:
+            self.fc = FullyConnectedLinear(self.layers_size, dropout, batchnorm)
+        else:
+            self.fc = FullyConnected(self.layers_size, dropout, batchnorm)
+        self.register_buffer('gene_mean', torch.zeros(self.layers_size[0]))
+        self.register_buffer('gene_std', torch.ones(self.layers_size[0]))
+
+    def standardize(self, genes):
+        return (genes - self.gene_mean) / self.gene_std
+
+    def forward(self, genes):
+        return self.fc(self.standardize(genes))
+
+
 class Dataset(torch.utils.data.Dataset):
     """Data set class which returns a pytorch data set object
         Returns a iterable data set object extending from the pytorch dataset
-        object.
+        object. Gene expressions are z-scored with scaler, a (mean, std) pair
+        (see gene_scaler), or with the statistics of the selected rows when it
+        is None. The pair used is kept in the scaler attribute.
+
+        dataframe is a DataFrame of gene expressions with a 'target' column,
+        or a (genes, responses) pair of arrays as built once per fit by
+        BaseCINET: the rows idxs of the float32 matrix genes are then copied
+        once and standardized in place, without any intermediate DataFrame.
     """
 
-    def __init__(self, dataframe, is_train, batch_size, delta=0, idxs=None, pre_built = False, pairs= None):
+    def __init__(self, dataframe, is_train, batch_size, delta=0, idxs=None, pre_built = False, pairs= None, unique_cells=False, scaler=None):
         self.batch_size = batch_size
+        self.unique_cells = unique_cells
         if pre_built:
             self._sample_list = pairs
             self._is_train = is_train
@@ -95,8 +162,15 @@ class Dataset(torch.utils.data.Dataset):
             self.gene_exprs = dataframe
             self.drug_resps = self.gene_exprs["target"].to_numpy()
             self.cell_lines = self.gene_exprs.index.values.tolist()
-            self.gene_exprs = self.gene_exprs.drop(["target"], axis=1).to_numpy()
-            self.gene_exprs = (self.gene_exprs - np.mean(self.gene_exprs, axis=0)) / np.std(self.gene_exprs, axis=0)
+            self.gene_exprs = self.gene_exprs.drop(["target"], axis=1).to_numpy(dtype=np.float32)
+            self.gene_exprs = self._standardize(self.gene_exprs, scaler)
+        elif isinstance(dataframe, tuple):
+            self.gene_exprs = self._gather(dataframe, idxs, scaler)
+            print("SHAPE2: ", self.gene_exprs.shape)
+
+            self._is_train = is_train
+            self.delta = delta
+            self._sample_list = self._build_pairs(self.delta)
         else:
             if idxs is not None:
                 self.gene_exprs = dataframe.iloc[idxs]
@@ -106,7 +180,7 @@ class Dataset(torch.utils.data.Dataset):
             # self.cell_lines = self.gene_exprs["cell_line"].to_numpy()
             self.cell_lines = self.gene_exprs.index.values.tolist()
             # self.gene_exprs = self.gene_exprs.drop(["target", "cell_line"], axis=1).to_numpy()
-            self.gene_exprs = self.gene_exprs.drop(["target"], axis=1).to_numpy()
+            self.gene_exprs = self.gene_exprs.drop(["target"], axis=1).to_numpy(dtype=np.float32)
             # number_of_genes = self.gene_exprs[0].size
             # number_of_cell_lines = self.gene_exprs[:,0].size
             # sds = np.std(self.gene_exprs, axis=0)
@@ -118,7 +192,7 @@ class Dataset(torch.utils.data.Dataset):
             # print(str(count) + "/" + str(number_of_genes) + " genes have 0 standard deviation.")
             # print("There are " + str(number_of_cell_lines) + " cell-lines in this dataset.")
             
-            self.gene_exprs = (self.gene_exprs - np.mean(self.gene_exprs, axis=0)) / np.std(self.gene_exprs, axis=0)
+            self.gene_exprs = self._standardize(self.gene_exprs, scaler)
 
 
             print("SHAPE2: ", self.gene_exprs.shape)
@@ -127,6 +201,39 @@ class Dataset(torch.utils.data.Dataset):
             self.delta = delta
             self._sample_list = self._build_pairs(self.delta)
 
+        # Keep the standardized matrix as one contiguous float32 tensor so
+        # that a whole batch is gathered with a single index operation
+        self.gene_exprs = torch.from_numpy(np.ascontiguousarray(self.gene_exprs, dtype=np.float32))
+        self._shared_exprs = None
+
+    def _standardize(self, gene_exprs, scaler):
+        if scaler is None:
+            scaler = gene_scaler(gene_exprs)
+        self.scaler = scaler
+        mean, std = scaler
+        # In float32, as the statistics would otherwise promote the matrix
+        gene_exprs = gene_exprs - np.asarray(mean, dtype=np.float32)
+        gene_exprs /= np.asarray(std, dtype=np.float32)
+        return gene_exprs
+
+    def _gather(self, data, idxs, scaler):
+        ''' Standardized copy of the rows idxs of the (genes, responses) arrays
+        data, the statistics of the rows being streamed from genes when scaler
+        is None
+        '''
+        genes, responses = data
+        rows = np.arange(len(genes)) if idxs is None else np.asarray(idxs, dtype=np.int64)
+        self.drug_resps = np.asarray(responses)[rows]
+        self.cell_lines = rows.tolist()
+        if scaler is None:
+            scaler = matrix_scaler(genes, rows)
+        self.scaler = scaler
+        mean, std = scaler
+        gene_exprs = np.take(genes, rows, axis=0).astype(np.float32, copy=False)
+        gene_exprs -= np.asarray(mean, dtype=np.float32)
+        gene_exprs /= np.asarray(std, dtype=np.float32)
+        return gene_exprs
+
     def __len__(self):
         return len(self._sample_list)
 
@@ -134,17 +241,48 @@ class Dataset(torch.utils.data.Dataset):
         return len(self.gene_exprs[0])
 
     def __getitem__(self, index):
+        if isinstance(index, (list, np.ndarray, torch.Tensor)):
+            return self.train_batch(index) if self._is_train else self.test_batch(index)
         return self.train_item(index) if self._is_train else self.test_item(index)
 
     def train_item(self, pair_idx):
-        row = self._sample_list[pair_idx]
-        gene1 = self._load_item(row['idxA'])
-        gene2 = self._load_item(row['idxB'])
-        label = torch.tensor(row['label'], dtype=torch.float32)
+        idxA, idxB, label = self._sample_list[pair_idx]
+        gene1 = self._load_item(idxA)
+        gene2 = self._load_item(idxB)
+        label = torch.tensor(label, dtype=torch.float32)
         return {'geneA': gene1,
                 'geneB': gene2,
                 'labels': label}
 
+    def train_batch(self, pair_idxs):
+        ''' Gather a whole batch of pairs, pair_idxs being positions in the
+        pair list (as yielded by a BatchSampler)
+        '''
+        return self._pair_batch(self._sample_list[np.asarray(pair_idxs)])
+
+    def _pair_batch(self, pairs):
+        labels = torch.from_numpy(pairs.labels).float()
+        if self.unique_cells:
+            # Each cell line appears once in 'genes', the pairs refer to it
+            # through positions in that matrix
+            cells, positions = np.unique(np.concatenate([pairs.idxA, pairs.idxB]), return_inverse=True)
+            positions = torch.from_numpy(positions.astype(np.int64))
+            return {'genes': self.gene_exprs[torch.from_numpy(cells.astype(np.int64))],
+                    'idxA': positions[:len(pairs)],
+                    'idxB': positions[len(pairs):],
+                    'labels': labels}
+        idxA = torch.from_numpy(pairs.idxA.astype(np.int64))
+        idxB = torch.from_numpy(pairs.idxB.astype(np.int64))
+        return {'geneA': self.gene_exprs[idxA],
+                'geneB': self.gene_exprs[idxB],
+                'labels': labels}
+
+    def test_batch(self, idxs):
+        idxs = np.asarray(idxs)
+        return {'gene': self.gene_exprs[torch.from_numpy(idxs.astype(np.int64))],
+                'response': torch.from_numpy(self.drug_resps[idxs].astype(np.float32)),
+                'cell_line': torch.from_numpy(idxs)}
+
     def test_item(self, idx):
         gene = self._load_item(idx)
         response = self._load_response(idx)
@@ -158,9 +296,7 @@ class Dataset(torch.utils.data.Dataset):
         :param idx: the cell line index in our input csv
         :return: returns a gene expression variable
         """
-        gene = self.gene_exprs[idx]
-        gene = torch.tensor(gene.copy(), dtype=torch.float32)
-        return gene
+        return self.gene_exprs[idx].clone()
 
     def _load_response(self, idx):
         response = self.drug_resps[idx]
@@ -171,6 +307,40 @@ class Dataset(torch.utils.data.Dataset):
     #     cell_lines_selected = self.cell_lines[idx]
     #     return cell_lines_selected
 
+    def __getstate__(self):
+        ''' Data sets are pickled for every spawned DataLoader worker. The
+        standardized matrix and the pair arrays are moved to shared memory
+        the first time, and from then on only references to them are pickled,
+        so workers map the data instead of each receiving a copy
+        '''
+        if self._shared_exprs is None:
+            self._shared_exprs = SharedArray(self.gene_exprs.numpy())
+            self.gene_exprs = torch.from_numpy(self._shared_exprs.array)
+        if isinstance(self._sample_list, PairList):
+            self._sample_list.share()
+        state = self.__dict__.copy()
+        del state['gene_exprs']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.gene_exprs = torch.from_numpy(self._shared_exprs.array)
+
+    def __copy__(self):
+        # Plain shallow copy, copy.copy would otherwise go through __getstate__
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        return other
+
+    def with_delta(self, delta):
+        ''' Shallow copy of this data set with the pairs of another delta, the
+        standardized gene expression matrix is shared
+        '''
+        other = copy.copy(self)
+        other.delta = delta
+        other._sample_list = other._build_pairs(delta)
+        return other
+
     def _build_pairs(self, delta):
         ''' build pairs of indices and labels for training data
         '''
@@ -180,14 +350,11 @@ class Dataset(torch.utils.data.Dataset):
             return self.drug_resps
 
     def get_concordant_pair_list(self, delta):
-        pairs = []
-        size = self.gene_exprs.shape[0]
-        print("SIZE: ", size)
-        for i in range(size - 1):
-            for j in range(i + 1, size, 1):
-                if (abs(self.drug_resps[i] - self.drug_resps[j]) > delta): 
-                    pairs.append({'idxA': i, 'idxB': j,
-                                    'label': self.get_relationship_from_index(i, j)})
+        """ Build the PairList of all pairs whose responses differ by more
+        than delta
+        """
+        print("SIZE: ", self.gene_exprs.shape[0])
+        pairs = pair_cache.get(self.drug_resps, delta)
         # Quick and dirty fix
         # Duplicate the very last row if there's only one row to be fed into a batch
         # i.e. total length / batch size leads to a remainder of one
@@ -195,7 +362,7 @@ class Dataset(torch.utils.data.Dataset):
         # (Batchnorm can't work on just one row)
         if len(pairs) % self.batch_size == 1:
             print("🏙 Adding one!!")
-            pairs.append(pairs[-1])
+            pairs = pairs[np.append(np.arange(len(pairs)), len(pairs) - 1)]
 
         return pairs
 
@@ -207,6 +374,332 @@ class Dataset(torch.utils.data.Dataset):
         drug_j = self.drug_resps[j]
         return int(drug_i > drug_j)
 
+class StreamDataset(torch.utils.data.IterableDataset, Dataset):
+    """Iterable data set which samples valid training pairs on the fly
+
+    Instead of materializing every pair with a response difference above
+    delta, pairs are drawn uniformly among the valid ones with a PairSampler,
+    so memory stays O(n) and the epoch length is set by pairs_per_epoch.
+    Whole batches are yielded, so it is meant to be used with batch_size=None
+    (see pair_loader).
+    """
+
+    def __init__(self, dataframe, batch_size, delta=0, idxs=None, pairs_per_epoch=100000, unique_cells=False,
+                 scaler=None):
+        self.pairs_per_epoch = pairs_per_epoch
+        # Epochs iterated in this process, see __iter__
+        self._epoch = 0
+        super(StreamDataset, self).__init__(dataframe, True, batch_size, delta, idxs, unique_cells=unique_cells,
+                                            scaler=scaler)
+
+    def __len__(self):
+        return -(-self.pairs_per_epoch // self.batch_size)
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:
+            # Drawn from the torch generator so that epochs differ but stay
+            # reproducible under torch.manual_seed
+            seed = int(torch.randint(2 ** 31 - 1, ()).item())
+            batches = range(len(self))
+        else:
+            # The persistent workers of pair_loader keep their seed from one
+            # epoch to the next, the epoch tells the epochs apart
+            seed = [worker_info.seed, self._epoch]
+            batches = range(worker_info.id, len(self), worker_info.num_workers)
+        self._epoch += 1
+        rng = np.random.default_rng(seed)
+        for batch in batches:
+            batch_size = min(self.batch_size, self.pairs_per_epoch - batch * self.batch_size)
+            # Same batchnorm fix as get_concordant_pair_list: never yield a
+            # batch with a single row
+            yield self._pair_batch(self._sample_list.sample(max(batch_size, 2), rng))
+
+    def _build_pairs(self, delta):
+        return PairSampler(self.drug_resps, delta)
+
+
+class MemmapMatrix:
+    """Rows of a float32 matrix memory-mapped from a file, standardized lazily
+
+    Indexing returns a tensor of the standardized rows asked for, which are
+    the only ones read from the file, so a data set can use a matrix larger
+    than memory. numpy and to materialize all the rows, for the users of a
+    whole data set (e.g. ValidationEarlyStopping).
+
+    Parameters
+    ----------
+    source : SharedArray or str
+        The matrix, a SharedArray or the path of a .npy file (such as the
+        caches of cinet.io). Both pickle by reference.
+    rows : array_like
+        Rows of the matrix that make up this one.
+    mean, std : numpy.ndarray
+        Per gene statistics to standardize with (see matrix_scaler).
+    """
+
+    def __init__(self, source, rows, mean, std):
+        self.source = source
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(1.0 / np.asarray(std), dtype=np.float32)
+        self._matrix = None
+        self.shape = (len(self.rows), self.matrix.shape[1])
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            if isinstance(self.source, str):
+                self._matrix = np.load(self.source, mmap_mode='r')
+            else:
+                self._matrix = self.source.array
+        return self._matrix
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, torch.Tensor):
+            index = index.numpy()
+        block = np.asarray(self.matrix[self.rows[index]], dtype=np.float32)
+        return torch.from_numpy((block - self.mean) * self.scale)
+
+    def numpy(self, chunk_size=4096):
+        result = np.empty(self.shape, dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            result[start:start + chunk_size] = self[np.arange(start, min(start + chunk_size, len(self)))].numpy()
+        return result
+
+    def to(self, device):
+        return torch.from_numpy(self.numpy()).to(device)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_matrix'] = None
+        return state
+
+
+def matrix_scaler(matrix, rows, chunk_size=4096):
+    """ gene_scaler of the rows of a (memory-mapped) matrix, accumulated
+    over chunks of rows so that they are never all in memory. Like np.std,
+    the deviations are summed around the mean, in a second pass
+    """
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    total = np.zeros(matrix.shape[1])
+    for start in range(0, len(rows), chunk_size):
+        total += np.asarray(matrix[rows[start:start + chunk_size]], dtype=np.float64).sum(axis=0)
+    mean = total / len(rows)
+    squares = np.zeros(matrix.shape[1])
+    for start in range(0, len(rows), chunk_size):
+        block = np.asarray(matrix[rows[start:start + chunk_size]], dtype=np.float64) - mean
+        squares += np.einsum('ij,ij->j', block, block)
+    return mean, _unit_std(mean, np.sqrt(squares / len(rows)))
+
+
+class MemmapDataset(Dataset):
+    """Data set reading the gene expressions of a batch from a memory-mapped
+    float32 matrix
+
+    Unlike Dataset, no copy of the selected rows is made: the rows of every
+    batch are read from the matrix and standardized when the batch is
+    gathered, with per gene statistics computed once by streaming over the
+    rows (or given as scaler). Memory use doesn't depend on the size of the
+    matrix, only on the batch size.
+
+    Parameters
+    ----------
+    matrix : SharedArray or str
+        The gene expressions of all the cell lines, see MemmapMatrix.
+    responses : array_like
+        The responses of all the cell lines.
+    is_train, batch_size, delta, idxs, unique_cells, scaler
+        As for Dataset, idxs selecting rows of matrix.
+    """
+
+    def __init__(self, matrix, responses, is_train, batch_size, delta=0, idxs=None, unique_cells=False, scaler=None):
+        self.batch_size = batch_size
+        self.unique_cells = unique_cells
+        self._is_train = is_train
+        self.delta = delta
+        source = matrix
+        matrix = np.load(matrix, mmap_mode='r') if isinstance(matrix, str) else matrix.array
+        rows = np.arange(len(matrix)) if idxs is None else np.asarray(idxs, dtype=np.int64)
+        self.drug_resps = np.asarray(responses)[rows]
+        if scaler is None:
+            scaler = matrix_scaler(matrix, rows)
+        self.scaler = scaler
+        self.gene_exprs = MemmapMatrix(source, rows, *scaler)
+        self._shared_exprs = None
+        self._sample_list = self._build_pairs(self.delta)
+
+    def __getstate__(self):
+        # The matrix pickles by reference already, only the pairs are shared
+        if isinstance(self._sample_list, PairList):
+            self._sample_list.share()
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+def pair_loader(dataset, batch_size, shuffle=True, num_workers=0):
+    """Returns a DataLoader yielding whole batches of a Dataset
+
+    Batches of indices drawn by a BatchSampler are gathered by the data set
+    in one index operation instead of collating batch_size single items.
+    StreamDataset objects already yield batches and are iterated as is.
+    A trailing batch of a single row is dropped (batchnorm can't work on it).
+    With num_workers > 0, workers are spawned once and reused every epoch.
+    """
+    kwargs = {'num_workers': num_workers}
+    if num_workers > 0:
+        # Workers are kept alive across epochs, and map the shared memory of
+        # the data set once (see Dataset.__getstate__)
+        kwargs['multiprocessing_context'] = 'spawn'
+        kwargs['persistent_workers'] = True
+    if isinstance(dataset, torch.utils.data.IterableDataset):
+        return torch.utils.data.DataLoader(dataset, batch_size=None, **kwargs)
+    if shuffle:
+        sampler = torch.utils.data.RandomSampler(dataset)
+    else:
+        sampler = torch.utils.data.SequentialSampler(dataset)
+    return torch.utils.data.DataLoader(
+        dataset,
+        sampler=torch.utils.data.BatchSampler(sampler, batch_size, drop_last=len(dataset) % batch_size == 1),
+        batch_size=None,
+        **kwargs)
+
+
+def shutdown_workers(loader):
+    """Stop the persistent worker processes of a DataLoader of pair_loader,
+    which otherwise live as long as the DataLoader. It can still be iterated
+    afterwards, new workers are then spawned
+    """
+    iterator = getattr(loader, '_iterator', None)
+    if iterator is not None:
+        if hasattr(iterator, '_shutdown_workers'):
+            iterator._shutdown_workers()
+        loader._iterator = None
+
+
+class PairConcordance(nn.Module):
+    """ Streaming pair concordance of an epoch
+
+    Keeps running counts of concordant, discordant and tied pairs (and the
+    loss) as tensors on the device of the model, so a step only adds to them
+    and nothing is retained between steps. The concordance is computed over
+    every pair of the epoch rather than averaged over batches, tied scores
+    counting for one half.
+    """
+
+    def __init__(self):
+        super(PairConcordance, self).__init__()
+        # Not persistent: they are not part of the trained model
+        self.register_buffer('concordant', torch.zeros((), dtype=torch.long), persistent=False)
+        self.register_buffer('discordant', torch.zeros((), dtype=torch.long), persistent=False)
+        self.register_buffer('tied', torch.zeros((), dtype=torch.long), persistent=False)
+        self.register_buffer('loss_sum', torch.zeros(()), persistent=False)
+        self.register_buffer('steps', torch.zeros((), dtype=torch.long), persistent=False)
+
+    @torch.no_grad()
+    def update(self, output, labels, loss):
+        sign = torch.sign(output.view(-1))
+        target = labels.view(-1) * 2 - 1
+        self.concordant += (sign == target).sum()
+        self.discordant += (sign == -target).sum()
+        self.tied += (sign == 0).sum()
+        self.loss_sum += loss.detach()
+        self.steps += 1
+
+    def compute(self):
+        """ Returns the average loss per step and the concordance of the
+        pairs seen since the last reset
+        """
+        total = (self.concordant + self.discordant + self.tied).clamp(min=1)
+        ci = (self.concordant + 0.5 * self.tied) / total
+        return self.loss_sum / self.steps.clamp(min=1), ci
+
+    def reset(self):
+        for buffer in self.buffers():
+            buffer.zero_()
+
+
+def _native_batches(loader):
+    """ Batches of a DataLoader built by pair_loader for DeepCINET.fit_native.
+    For map-style data sets loaded in the main process, batches are gathered
+    from a shuffled index tensor without going through the DataLoader
+    """
+    dataset = loader.dataset
+    if loader.num_workers > 0 or isinstance(dataset, torch.utils.data.IterableDataset):
+        yield from loader
+        return
+    # pair_loader passes its BatchSampler as the sampler of the DataLoader
+    batch_size = loader.sampler.batch_size
+    if isinstance(loader.sampler.sampler, torch.utils.data.RandomSampler):
+        order = torch.randperm(len(dataset))
+    else:
+        order = torch.arange(len(dataset))
+    for idxs in torch.split(order, batch_size):
+        if len(idxs) == 1 and len(dataset) > 1:
+            # Same as pair_loader, batchnorm can't work on one row
+            continue
+        yield dataset[idxs.numpy()]
+
+
+class ValidationEarlyStopping(pl.Callback):
+    """ Early stopping on the concordance index of a validation data set
+
+    After every training epoch the cell lines of the validation data set are
+    scored and the concordance index of the scores with their responses is
+    computed. The weights of the best epoch are kept in memory and restored
+    when training ends, which happens once patience epochs passed without
+    improvement. Works as a Lightning callback, and with
+    DeepCINET.fit_native through update and restore.
+    """
+
+    def __init__(self, dataset, patience):
+        self.gene = dataset.gene_exprs
+        self.response = dataset.drug_resps
+        self.patience = patience
+        self.best_ci = -1.0
+        self.best_epoch = -1
+        self.best_state = None
+        self.epoch = -1
+        self.wait = 0
+
+    def update(self, model):
+        """ Evaluate the model after an epoch, returns True if training should stop
+        """
+        self.epoch += 1
+        training = model.training
+        model.eval()
+        with torch.no_grad(), model.autocast():
+            scores = model.score(self.gene.to(model.device)).view(-1).cpu().numpy()
+        model.train(training)
+        ci = concordance_index(self.response, scores)
+        print("Epoch %d: val_CI=%.3f" % (self.epoch, ci))
+        if ci > self.best_ci:
+            self.best_ci = ci
+            self.best_epoch = self.epoch
+            self.best_state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+            self.wait = 0
+        else:
+            self.wait += 1
+        return self.wait >= self.patience
+
+    def restore(self, model):
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+            print("Restored the weights of epoch %d (val_CI=%.3f)" % (self.best_epoch, self.best_ci))
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        if self.update(pl_module):
+            trainer.should_stop = True
+
+    def on_fit_end(self, trainer, pl_module):
+        self.restore(pl_module)
+
+
 class DeepCINET(pl.LightningModule):
     """ Base class for our DeepCINET implemented in pytorch lightning
     Provides methods to train and validate as well as configuring the optimizer
@@ -221,6 +714,7 @@ class DeepCINET(pl.LightningModule):
         # to be tuned hyper-parameters
         self.data_dir = data_dir or os.getcwd()
         self.nnHiddenLayers = config["nnHiddenLayers"]
+        self.delta = config.get("delta", 0.0)
         self.data_sz = config["dat_size"]
         if linear:
             self.ratio = config["ratio"]
@@ -239,8 +733,14 @@ class DeepCINET(pl.LightningModule):
         self.best_val_ci = -1  # max 1
         self.test_results = {}
         self.criterion = nn.MarginRankingLoss()
+        self.train_metrics = PairConcordance()
+        self.val_metrics = PairConcordance()
         self.convolution = nn.Identity()
         self.linear = linear
+        # Standardization of the training data, applied to raw inputs by
+        # standardize (see set_scaler)
+        self.register_buffer('gene_mean', torch.zeros(self.data_sz))
+        self.register_buffer('gene_std', torch.ones(self.data_sz))
 
         if self.linear:
             self.fc = FullyConnectedLinear(self.layers_size, self.dropout, self.batchnorm)
@@ -250,48 +750,110 @@ class DeepCINET(pl.LightningModule):
         self.log_model_parameters()
 
 
+    def set_scaler(self, mean, std):
+        """ Keep the per gene mean and standard deviation used to z-score
+        the training data
+        """
+        with torch.no_grad():
+            self.gene_mean.copy_(torch.as_tensor(mean, dtype=self.gene_mean.dtype))
+            self.gene_std.copy_(torch.as_tensor(std, dtype=self.gene_std.dtype))
+
+    def standardize(self, genes):
+        """ z-score raw gene expressions like the training data
+        """
+        return (genes - self.gene_mean) / self.gene_std
+
+    def autocast(self):
+        """ autocast context of the precision of the hyperparameters
+        """
+        return autocast(self.hyperparams.get('precision', 32), self.device.type)
+
+    def score(self, genes):
+        """ Scores of a batch of cell lines, in float32 under bf16 autocast
+        as well so that pair differences and the loss keep their precision
+        """
+        return self.fc(genes).float()
+
     def forward(self, geneA, geneB):
-        tA = self.fc(geneA)
-        tB = self.fc(geneB)
+        tA = self.score(geneA)
+        tB = self.score(geneB)
         z = (tA - tB)
         return z
 
-    def training_step(self, batch, batch_idx):
-        geneA = batch['geneA']
-        geneB = batch['geneB']
-        labels = batch['labels']
+    def forward_cells(self, genes, idxA, idxB):
+        """ Siamese forward pass on a batch of unique cell lines: every cell
+        is scored once and the pair differences are gathered from the scores
+        """
+        scores = self.score(genes).view(-1)
+        return scores[idxA] - scores[idxB]
 
-        output = self.forward(geneA, geneB)
+    def forward_matrix(self, gene, response):
+        """ Score a batch of cell lines once and compare all of them: returns
+        the score differences and labels of every pair of the batch whose
+        responses differ by more than delta
+        """
+        scores = self.score(gene).view(-1)
+        resp_diff = response[:, None] - response[None, :]
+        mask = torch.triu(resp_diff.abs() > self.delta, diagonal=1)
+        output = (scores[:, None] - scores[None, :])[mask]
+        return output, (resp_diff[mask] > 0).type_as(scores)
+
+    def pair_output(self, batch):
+        """ Returns the pair score differences of a batch and their labels
+        """
+        if 'response' in batch:
+            # batch of cell lines, all pairs objective
+            return self.forward_matrix(batch['gene'], batch['response'])
+        if 'genes' in batch:
+            output = self.forward_cells(batch['genes'], batch['idxA'], batch['idxB'])
+        else:
+            output = self.forward(batch['geneA'], batch['geneB'])
+        return output, batch['labels']
+
+    def _shared_step(self, batch):
+        """ Returns the pair score differences, labels and loss of a batch,
+        or None if the batch has no pair
+        """
+        output, labels = self.pair_output(batch)
+        if output.numel() == 0:
+            # No pair of this batch of cell lines is further apart than delta
+            return None
         # labels_hinge = labels.view(-1).detach()
         labels_hinge = torch.where(labels == 0, torch.tensor(-1).type_as(labels), torch.tensor(1).type_as(labels))
         loss = self.criterion(output.view(-1), torch.zeros(labels_hinge.size()).type_as(labels), labels_hinge)
 
         # Compute L1 and L2 loss component if using ECINET
         if self.linear:
-            weights = []
-            for parameter in self.parameters():
-                weights.append(parameter.view(-1))
-            reg = (self.ratio * torch.abs(torch.cat(weights)).sum()) + (
-                        (1 - self.ratio) * torch.square(torch.cat(weights)).sum())
-            loss += reg * self.reg_contr
+            loss += self.regularization() * self.reg_contr
+        return output, labels, loss
+
+    def regularization(self):
+        """ Elastic net penalty of the weights, reduced parameter by parameter
+        in place instead of on a concatenated copy of all of them
+        """
+        l1 = 0
+        l2 = 0
+        for parameter in self.parameters():
+            weights = parameter.view(-1)
+            l1 = l1 + torch.linalg.vector_norm(weights, 1)
+            l2 = l2 + torch.dot(weights, weights)
+        return self.ratio * l1 + (1 - self.ratio) * l2
+
+    def training_step(self, batch, batch_idx):
+        step = self._shared_step(batch)
+        if step is None:
+            return None
+        output, labels, loss = step
 
         # loggin number of steps
         self.t_steps += 1
 
-        np_output = torch.sigmoid(output.view(-1)).detach()
-        output_class = torch.where(np_output < 0.5,
-                                   torch.tensor(0).type_as(np_output),
-                                   torch.tensor(1).type_as(np_output))
-        correct = torch.sum(output_class == labels).type_as(np_output)
-        total = torch.tensor(np_output.size(0)).type_as(np_output)
-        CI = correct / total
-
-        tensorboard_logs = {'train_loss': loss, 'CI': CI}
-        return {'loss': loss, 'custom_logs': tensorboard_logs}
+        self.train_metrics.update(output.detach(), labels, loss)
+        return {'loss': loss}
 
-    def training_epoch_end(self, outputs):
-        avg_loss = torch.stack([x['custom_logs']['train_loss'].mean() for x in outputs]).mean()
-        CI = torch.stack([x['custom_logs']['CI'].mean() for x in outputs]).mean()
+    def on_train_epoch_end(self):
+        avg_loss, CI = self.train_metrics.compute()
+        self.train_metrics.reset()
 
         # TODO: This does not work, as lightning does not update the
         # progress bar on training epoch end
@@ -302,42 +864,20 @@ class DeepCINET(pl.LightningModule):
         # return {'log': tensorboard_logs, 'progress_bar': tensorboard_logs}
 
     def validation_step(self, batch, batch_idx):
-        geneA = batch['geneA']
-        geneB = batch['geneB']
-        labels = batch['labels']
-
-        output = self.forward(geneA, geneB)
-        # labels_hinge = labels.view(-1).detach()
-        labels_hinge = torch.where(labels == 0, torch.tensor(-1).type_as(labels), torch.tensor(1).type_as(labels))
-        loss = self.criterion(output.view(-1), torch.zeros(labels_hinge.size()).type_as(labels), labels_hinge)
-
-        # Compute L1 and L2 loss component
-        if self.linear:
-            weights = []
-            for parameter in self.parameters():
-                weights.append(parameter.view(-1))
-            reg = (self.ratio * torch.abs(torch.cat(weights)).sum()) + (
-                        (1 - self.ratio) * torch.square(torch.cat(weights)).sum())
-            loss += reg * self.reg_contr
-
-        np_output = torch.sigmoid(output.view(-1)).detach()
-        output_class = torch.where(np_output < 0.5,
-                                   torch.tensor(0).type_as(np_output),
-                                   torch.tensor(1).type_as(np_output))
-        correct = torch.sum(output_class == labels).type_as(np_output)
-        total = torch.tensor(np_output.size(0)).type_as(np_output)
-        CI = correct / total
-
-        val_logs = {'val_loss': loss, 'val_CI': CI}
+        step = self._shared_step(batch)
+        if step is None:
+            return None
+        output, labels, loss = step
 
         # TODO: Pytorch currently doesn't reduce the output in validation when
         #       we use more than one GPU, becareful this might not be supported
         #       future versions
-        return val_logs
+        self.val_metrics.update(output, labels, loss)
 
-    def validation_epoch_end(self, outputs):
-        val_avg_loss = torch.stack([x['val_loss'].mean() for x in outputs]).mean()
-        ci = torch.stack([x['val_CI'].mean() for x in outputs]).mean().cpu()
+    def on_validation_epoch_end(self):
+        val_avg_loss, ci = self.val_metrics.compute()
+        ci = ci.cpu()
+        self.val_metrics.reset()
 
         self.cvdata.append({
             'CI': ci,
@@ -356,6 +896,49 @@ class DeepCINET(pl.LightningModule):
         self.log('val_loss', val_avg_loss, prog_bar=True)
         self.log('val_ci', ci, prog_bar=True)
 
+    def fit_native(self, train_dl, compile_model=False, early_stopping=None):
+        """ Train the network with a plain PyTorch loop instead of a Lightning
+        Trainer, for max_epochs epochs of train_dl
+
+        Batches of a map-style data set loaded in the main process are
+        gathered directly from shuffled index tensors, skipping the DataLoader
+        machinery. The optimizer, scheduler and loss are the same as with
+        Lightning. If compile_model is set (and torch.compile is available)
+        the training step is compiled. early_stopping is an optional
+        ValidationEarlyStopping.
+        """
+        device = torch.device('cuda' if self.hyperparams['device'] == 'gpu' else 'cpu')
+        self.to(device)
+        [optimizer], [scheduler] = self.configure_optimizers()
+        shared_step = self._shared_step
+        if compile_model and hasattr(torch, 'compile'):
+            shared_step = torch.compile(shared_step, dynamic=True)
+
+        self.train()
+        for epoch in range(self.hyperparams['max_epochs']):
+            for batch in _native_batches(train_dl):
+                batch = {key: value.to(device) for key, value in batch.items()}
+                with self.autocast():
+                    step = shared_step(batch)
+                if step is None:
+                    continue
+                output, labels, loss = step
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
+                optimizer.step()
+                self.t_steps += 1
+                self.train_metrics.update(output.detach(), labels, loss)
+            scheduler.step()
+            avg_loss, CI = self.train_metrics.compute()
+            self.train_metrics.reset()
+            print("Epoch %d: avg_loss=%.4g, train_CI=%.3f" % (epoch, avg_loss, CI))
+            if early_stopping is not None and early_stopping.update(self):
+                break
+        if early_stopping is not None:
+            early_stopping.restore(self)
+        self.eval()
+        self.cpu()
+
     def test_step(self, batch, batch_idx):
         gene = batch['gene']
         y_true = np.array(batch['response'])
@@ -0,0 +1,363 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from .shared import SharedArray
+
+
+# Upper bound on the number of elements of the response difference block
+# evaluated at once when enumerating pairs.
+_BLOCK_ELEMENTS = 2 ** 22
+
+
+def concordant_pairs(responses, delta=0.0, chunk_size=None):
+    """Build every pair of samples whose responses differ by more than delta
+
+    Pairs are enumerated in the same order as a nested loop over ``i < j``,
+    but the comparison is done with vectorized NumPy operations on blocks of
+    anchor rows so that memory stays bounded on large panels.
+
+    Parameters
+    ----------
+    responses : numpy.ndarray
+        One dimensional array of drug responses (targets).
+    delta : float
+        Minimum absolute difference between two responses for the pair to be
+        included. Set to 0.0 by default.
+    chunk_size : int
+        Number of anchor rows compared per block. By default it is chosen so
+        that a block holds about four million differences.
+
+    Returns
+    -------
+    tuple
+        ``(idxA, idxB, labels)`` where ``idxA`` and ``idxB`` are int32 arrays
+        of row indices and ``labels`` is a uint8 array set to 1 when the
+        response of ``idxA`` is greater than the response of ``idxB``.
+    """
+    responses = np.asarray(responses)
+    size = responses.shape[0]
+    if chunk_size is None:
+        chunk_size = max(1, _BLOCK_ELEMENTS // max(size, 1))
+
+    idxA, idxB, labels = [], [], []
+    for start in range(0, size - 1, chunk_size):
+        stop = min(start + chunk_size, size - 1)
+        # Only columns after the first anchor of the block can pair with it
+        diff = responses[start:stop, None] - responses[None, start + 1:]
+        mask = np.abs(diff) > delta
+        # Drop the lower triangle (j <= i) of the block
+        mask &= np.arange(start + 1, size)[None, :] > np.arange(start, stop)[:, None]
+        rows, cols = np.nonzero(mask)
+        idxA.append((rows + start).astype(np.int32))
+        idxB.append((cols + start + 1).astype(np.int32))
+        labels.append((diff[rows, cols] > 0).astype(np.uint8))
+
+    if not idxA:
+        return (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.uint8))
+    return np.concatenate(idxA), np.concatenate(idxB), np.concatenate(labels)
+
+
+class PairList:
+    """Compact, array backed list of training pairs
+
+    Stores the two row indices of every pair as int32 arrays and the labels
+    bit-packed, which costs about 8.125 bytes per pair instead of a Python
+    dict per pair. The arrays pickle as raw buffers, so handing a PairList
+    to DataLoader worker processes is cheap.
+
+    Parameters
+    ----------
+    idxA : array_like
+        Row index of the first sample of every pair.
+    idxB : array_like
+        Row index of the second sample of every pair.
+    labels : array_like
+        1 when the response of ``idxA`` is greater than the one of ``idxB``,
+        0 otherwise.
+
+    Once ``share`` is called the arrays live in shared memory and pickling
+    the PairList only sends references to them.
+    """
+
+    def __init__(self, idxA, idxB, labels):
+        self.idxA = np.ascontiguousarray(idxA, dtype=np.int32)
+        self.idxB = np.ascontiguousarray(idxB, dtype=np.int32)
+        if self.idxA.shape != self.idxB.shape:
+            raise ValueError("idxA and idxB must have the same length")
+        self._size = len(self.idxA)
+        self._packed_labels = np.packbits(np.asarray(labels, dtype=bool))
+        self._shared = None
+
+    @classmethod
+    def from_responses(cls, responses, delta=0.0):
+        """Build the PairList of all pairs whose responses differ by more than delta"""
+        return cls(*concordant_pairs(responses, delta))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        """Return ``(idxA, idxB, label)`` for an integer index, or a new
+        PairList for a slice, boolean mask or array of indices
+        """
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self._size
+            if not 0 <= index < self._size:
+                raise IndexError("pair index out of range")
+            return int(self.idxA[index]), int(self.idxB[index]), int(self.label(index))
+        # Positions of the selected pairs, so that only their bits are read
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(self._size))
+        else:
+            index = np.asarray(index)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            index = np.where(index < 0, index + self._size, index)
+        return PairList(self.idxA[index], self.idxB[index], self.label(index))
+
+    @property
+    def labels(self):
+        """Unpacked uint8 labels of all pairs"""
+        return np.unpackbits(self._packed_labels, count=self._size)
+
+    def label(self, index):
+        """Label of a single pair (or an array of pairs) read from the packed bits"""
+        return (self._packed_labels[index >> 3] >> (7 - (index & 7))) & 1
+
+    @property
+    def nbytes(self):
+        return self.idxA.nbytes + self.idxB.nbytes + self._packed_labels.nbytes
+
+    def share(self):
+        """Move the arrays to shared memory (see SharedArray), once"""
+        if self._shared is None:
+            self._shared = (SharedArray(self.idxA), SharedArray(self.idxB), SharedArray(self._packed_labels))
+            self.idxA, self.idxB, self._packed_labels = (shared.array for shared in self._shared)
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shared is not None:
+            del state["idxA"], state["idxB"], state["_packed_labels"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shared is not None:
+            self.idxA, self.idxB, self._packed_labels = (shared.array for shared in self._shared)
+
+    def __repr__(self):
+        return "PairList(%d pairs, %d bytes)" % (self._size, self.nbytes)
+
+
+class PairSampler:
+    """Draw valid pairs on demand without enumerating all of them
+
+    Responses are sorted once; for every anchor the samples whose response
+    differs by more than delta form two contiguous runs of the sorted order
+    (below ``r - delta`` and above ``r + delta``), located with
+    ``searchsorted``. The ends of the runs are then checked against the
+    exact test of concordant_pairs, ``abs(r_i - r_j) > delta``, which the
+    rounding of ``r - delta`` and ``r + delta`` can disagree with. Drawing a
+    pair is then an O(log n) lookup, so memory stays O(n) regardless of how
+    many valid pairs exist.
+
+    Parameters
+    ----------
+    responses : numpy.ndarray
+        One dimensional array of drug responses (targets).
+    delta : float
+        Minimum absolute difference between two responses for a valid pair.
+    """
+
+    def __init__(self, responses, delta=0.0):
+        self.responses = np.asarray(responses)
+        self.delta = delta
+        self.order = np.argsort(self.responses, kind="stable")
+        sorted_resps = self.responses[self.order]
+        size = len(sorted_resps)
+        # Partners of the anchor at sorted position i are the sorted positions
+        # [0, lower[i]) and [upper[i], size)
+        self.lower = np.searchsorted(sorted_resps, sorted_resps - delta, side="left")
+        self.upper = np.searchsorted(sorted_resps, sorted_resps + delta, side="right")
+        _fix_boundaries(sorted_resps, delta, self.lower, self.upper)
+        self.counts = self.lower + (size - self.upper)
+        self.cum_counts = np.cumsum(self.counts)
+
+    def __len__(self):
+        """Number of valid (unordered) pairs"""
+        return int(self.cum_counts[-1]) // 2 if len(self.cum_counts) else 0
+
+    def sample(self, num_pairs, rng):
+        """Draw ``num_pairs`` pairs uniformly (with replacement) among valid pairs
+
+        Parameters
+        ----------
+        num_pairs : int
+            Number of pairs to draw.
+        rng : numpy.random.Generator
+            Random generator to draw from.
+
+        Returns
+        -------
+        PairList
+            The sampled pairs.
+        """
+        if len(self) == 0:
+            raise ValueError("There are no pairs with a response difference above delta")
+        # Every ordered (anchor, partner) pair gets one slot in [0, total)
+        draws = rng.integers(0, self.cum_counts[-1], num_pairs)
+        anchors = np.searchsorted(self.cum_counts, draws, side="right")
+        offsets = draws - (self.cum_counts[anchors] - self.counts[anchors])
+        partners = np.where(offsets < self.lower[anchors], offsets,
+                            self.upper[anchors] + offsets - self.lower[anchors])
+        idxA = self.order[anchors]
+        idxB = self.order[partners]
+        return PairList(idxA, idxB, self.responses[idxA] > self.responses[idxB])
+
+
+def _fix_boundaries(sorted_resps, delta, lower, upper):
+    """Move, in place, the run ends of PairSampler to where the exact test
+    ``abs(r - sorted_resps[k]) > delta`` changes. The test is monotonic along
+    the sorted order, and gives the same result for equal responses, so a
+    wrong end moves by whole runs of ties.
+    """
+    size = len(sorted_resps)
+    if size == 0:
+        return
+
+    def valid(anchors, partners):
+        return np.abs(sorted_resps[anchors] - sorted_resps[partners]) > delta
+
+    # lower: the last partner below must be valid, the next sample not
+    while True:
+        move = np.flatnonzero((lower > 0) & ~valid(np.arange(size), np.maximum(lower - 1, 0)))
+        if not len(move):
+            break
+        lower[move] = np.searchsorted(sorted_resps, sorted_resps[lower[move] - 1], side="left")
+    while True:
+        move = np.flatnonzero((lower < size) & valid(np.arange(size), np.minimum(lower, size - 1)))
+        move = move[sorted_resps[lower[move]] <= sorted_resps[move]]
+        if not len(move):
+            break
+        lower[move] = np.searchsorted(sorted_resps, sorted_resps[lower[move]], side="right")
+    # upper: the first partner above must be valid, the previous sample not
+    while True:
+        move = np.flatnonzero((upper < size) & ~valid(np.arange(size), np.minimum(upper, size - 1)))
+        if not len(move):
+            break
+        upper[move] = np.searchsorted(sorted_resps, sorted_resps[upper[move]], side="right")
+    while True:
+        move = np.flatnonzero((upper > 0) & valid(np.arange(size), np.maximum(upper - 1, 0)))
+        move = move[sorted_resps[upper[move] - 1] >= sorted_resps[move]]
+        if not len(move):
+            break
+        upper[move] = np.searchsorted(sorted_resps, sorted_resps[upper[move] - 1], side="left")
+
+
+def sample_pairs(pairs, num_pairs, rng=None):
+    """Draw a random subset of pairs without replacement
+
+    Parameters
+    ----------
+    pairs : PairList
+        Pairs to sample from.
+    num_pairs : int
+        Number of pairs to keep.
+    rng : numpy.random.Generator
+        Random generator to draw from. Uses the global NumPy state by default.
+
+    Returns
+    -------
+    PairList
+        The selected pairs, in their original order.
+    """
+    choice = np.random.choice if rng is None else rng.choice
+    keep = np.sort(choice(len(pairs), num_pairs, replace=False))
+    return pairs[keep]
+
+
+class PairCache:
+    """Memoizes PairLists across repeated builds on the same samples
+
+    Entries are keyed on a hash of the response vector of a fold (which
+    identifies its rows and their order) and on delta. The pairs of a delta
+    are a subset of the pairs of any smaller delta, so when the list of a
+    smaller delta is cached (e.g. by a delta sweep starting with its smallest
+    value, see BaseCINET.fit_delta_path) the requested one is derived from it
+    by filtering. Otherwise it is enumerated directly, never through a larger
+    list. The least recently used entries are evicted once max_bytes is
+    exceeded, and lists larger than max_bytes are not kept. Fits clear the
+    cache when they end.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Upper bound on the memory held by cached pairs.
+        Set to 1 GiB by default.
+    """
+
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def digest(responses):
+        responses = np.ascontiguousarray(responses)
+        sha = hashlib.sha1(str((responses.dtype, responses.shape)).encode())
+        sha.update(responses.tobytes())
+        return sha.hexdigest()
+
+    def get(self, responses, delta=0.0):
+        """Returns the PairList of responses for delta, computing it if needed"""
+        responses = np.asarray(responses)
+        digest = self.digest(responses)
+        key = (digest, float(delta))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        # The cached list of the largest delta below this one, if any
+        bases = [other for other in self._entries if other[0] == digest and other[1] < delta]
+        if bases:
+            base_key = max(bases, key=lambda other: other[1])
+            self._entries.move_to_end(base_key)
+            pairs = self._filter(self._entries[base_key], responses, delta)
+        else:
+            pairs = PairList.from_responses(responses, delta)
+        self._store(key, pairs)
+        return pairs
+
+    @staticmethod
+    def _filter(base, responses, delta):
+        """Pairs of base whose responses differ by more than delta, tested by
+        blocks so that the temporaries stay small next to the list
+        """
+        keep = np.empty(len(base), dtype=bool)
+        for start in range(0, len(base), _BLOCK_ELEMENTS):
+            stop = start + _BLOCK_ELEMENTS
+            keep[start:stop] = np.abs(responses[base.idxA[start:stop]] - responses[base.idxB[start:stop]]) > delta
+        return base[keep]
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def nbytes(self):
+        return sum(pairs.nbytes for pairs in self._entries.values())
+
+    def _store(self, key, pairs):
+        if pairs.nbytes > self.max_bytes:
+            return
+        self._entries[key] = pairs
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            self._entries.popitem(last=False)
+
+
+# Shared by every Dataset of the process, so that the folds of a delta sweep
+# only enumerate their pairs once
+pair_cache = PairCache()
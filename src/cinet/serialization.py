@@ -0,0 +1,104 @@
+import json
+import struct
+
+import numpy as np
+
+
+# Tensor dtypes of the safetensors format and their NumPy equivalents
+_DTYPES = {
+    'BOOL': np.bool_,
+    'U8': np.uint8,
+    'I8': np.int8,
+    'I16': np.int16,
+    'I32': np.int32,
+    'I64': np.int64,
+    'F16': np.float16,
+    'F32': np.float32,
+    'F64': np.float64,
+}
+_DTYPE_NAMES = {np.dtype(dtype): name for name, dtype in _DTYPES.items()}
+
+
+def save_file(tensors, path, metadata=None):
+    """Write arrays to a flat file in the safetensors layout
+
+    The file starts with the length of its header as a little-endian uint64,
+    followed by the header, a JSON object giving the dtype, shape and byte
+    range of every array (and the string to string ``__metadata__``), padded
+    with spaces to a multiple of 8 bytes. The raw bytes of the arrays follow,
+    without gaps as the format requires, in decreasing order of item size:
+    since the data starts on an 8 byte boundary, every array starts at a
+    multiple of its own item size and can be viewed in place. Nothing is
+    pickled, and any safetensors reader can open the file.
+
+    Parameters
+    ----------
+    tensors : dict
+        Arrays (NumPy arrays or CPU torch tensors) by name.
+    path : str
+        Path of the file to write.
+    metadata : dict
+        Strings to store in the header.
+    """
+    arrays = {}
+    for name, value in tensors.items():
+        # Not np.ascontiguousarray, which turns scalars into 1-d arrays
+        array = np.asarray(value)
+        arrays[name] = array if array.flags.c_contiguous else array.copy(order='C')
+    # Stable, so arrays of the same item size keep their order
+    arrays = dict(sorted(arrays.items(), key=lambda item: -item[1].dtype.itemsize))
+    header = {}
+    if metadata:
+        header['__metadata__'] = {str(key): str(value) for key, value in metadata.items()}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype not in _DTYPE_NAMES:
+            raise ValueError("Unsupported dtype %s for %s" % (array.dtype, name))
+        header[name] = {'dtype': _DTYPE_NAMES[array.dtype],
+                        'shape': list(array.shape),
+                        'data_offsets': [offset, offset + array.nbytes]}
+        offset += array.nbytes
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # The data starts on an 8 byte boundary of the file
+    header += b' ' * (-(len(header) + 8) % 8)
+    with open(path, 'wb') as file:
+        file.write(struct.pack('<Q', len(header)))
+        file.write(header)
+        for array in arrays.values():
+            file.write(array.tobytes())
+
+
+def load_file(path, mmap=True):
+    """Read a file written by save_file
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    mmap : bool
+        If true, the arrays are views of a copy-on-write memory map of the
+        file, read from disk when first accessed. Otherwise they are read in
+        memory.
+
+    Returns
+    -------
+    tuple
+        ``(tensors, metadata)``, the arrays by name and the metadata dict.
+    """
+    with open(path, 'rb') as file:
+        size, = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(size).decode('utf-8'))
+        metadata = header.pop('__metadata__', {})
+        if not mmap:
+            buffer = np.frombuffer(bytearray(file.read()), dtype=np.uint8)
+    if mmap:
+        data_size = max([info['data_offsets'][1] for info in header.values()], default=0)
+        if data_size:
+            buffer = np.memmap(path, dtype=np.uint8, mode='c', offset=8 + size, shape=(data_size,))
+        else:
+            buffer = np.empty(0, dtype=np.uint8)
+    tensors = {}
+    for name, info in header.items():
+        start, end = info['data_offsets']
+        tensors[name] = buffer[start:end].view(_DTYPES[info['dtype']]).reshape(info['shape'])
+    return tensors, metadata
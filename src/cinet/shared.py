@@ -0,0 +1,133 @@
+import atexit
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+
+# Memory-mapped files are created in RAM backed /dev/shm when available,
+# and in the regular temporary directory otherwise (e.g. on Windows).
+_SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Space left free in /dev/shm, for the other users of shared memory
+# (e.g. the tensors DataLoader workers send back)
+_SHARED_MARGIN = 2 ** 26
+
+
+def _shared_dir(nbytes):
+    """Directory for a new file of nbytes bytes: /dev/shm if it has room for
+    it, the temporary directory otherwise. Writing past the size of /dev/shm
+    (64 MB by default in Docker) would crash the process with a SIGBUS
+    instead of raising an error
+    """
+    if _SHARED_DIR is not None:
+        try:
+            if shutil.disk_usage(_SHARED_DIR).free >= nbytes + _SHARED_MARGIN:
+                return _SHARED_DIR
+        except OSError:
+            pass
+    return None
+
+# SharedArrays owned by this process, closed at exit so that arrays still
+# referenced by module level objects (e.g. the pair cache) don't leak files
+_owned = weakref.WeakSet()
+
+
+class SharedArray:
+    """NumPy array backed by a memory-mapped file that pickles by reference
+
+    The array is copied once into a file and every process unpickling a
+    SharedArray maps that same file instead of receiving a copy of the data,
+    so sending it to worker processes costs a few bytes whatever its size.
+    Processes other than the owner map the file copy-on-write: they can
+    modify their view without affecting the others.
+
+    The process that created the SharedArray owns the file and removes it
+    when the SharedArray is closed or garbage collected. Mappings that are
+    still open keep working after that on POSIX systems.
+
+    Parameters
+    ----------
+    array : array_like
+        Data to share.
+    dir : str
+        Directory of the file. Defaults to /dev/shm, which lives in RAM, when
+        it exists and has room for the array, and to the temporary directory
+        otherwise. Pass a directory on disk for data meant to stay out of
+        memory.
+    """
+
+    def __init__(self, array, dir=None):
+        array = np.ascontiguousarray(array)
+        self._map(array.shape, array.dtype, dir)
+        self.array[...] = array
+
+    @classmethod
+    def empty(cls, shape, dtype, dir=None):
+        """Returns a SharedArray of zeros for its owner to fill through array,
+        e.g. block by block from a source too large to copy in memory at once
+        """
+        shared = cls.__new__(cls)
+        shared._map(tuple(shape), np.dtype(dtype), dir)
+        return shared
+
+    def _map(self, shape, dtype, dir):
+        self.dtype = dtype
+        self.shape = shape
+        self._owner = True
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes == 0:
+            # Empty files can't be memory-mapped, and there's nothing to share
+            self.path = None
+            self.array = np.empty(shape, dtype)
+            return
+        fd, self.path = tempfile.mkstemp(prefix="cinet-", suffix=".dat", dir=dir or _shared_dir(nbytes))
+        os.close(fd)
+        self.array = np.memmap(self.path, dtype=dtype, mode="w+", shape=shape).view(np.ndarray)
+        _owned.add(self)
+
+    def __getstate__(self):
+        state = {"path": self.path, "dtype": self.dtype, "shape": self.shape}
+        if self.path is None:
+            state["array"] = self.array
+        return state
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self.dtype = state["dtype"]
+        self.shape = state["shape"]
+        self._owner = False
+        if self.path is None:
+            self.array = state["array"]
+        else:
+            self.array = np.memmap(self.path, dtype=self.dtype, mode="c", shape=self.shape).view(np.ndarray)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def close(self):
+        """Remove the backing file if this process owns it"""
+        if self._owner and self.path is not None:
+            self._owner = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Still mapped by another process (Windows), or already gone
+                pass
+
+    def __del__(self):
+        self.close()
+
+    def __repr__(self):
+        return "SharedArray(shape=%s, dtype=%s, path=%s)" % (self.shape, self.dtype, self.path)
+
+
+@atexit.register
+def _close_owned():
+    for shared in list(_owned):
+        shared.close()
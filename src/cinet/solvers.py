@@ -0,0 +1,212 @@
+import numpy as np
+
+
+# Bound on the coordinate descent sweeps of a single quadratic subproblem
+_MAX_SWEEPS = 1000
+
+
+def rank_elastic_net_path(X, pairs, ratio=0.4, reg_contr=0.4, num_lambdas=20, tol=1e-4, max_iter=50):
+    """Solve the elastic net pairwise ranking problem along a regularization path
+
+    Minimizes over the weights w
+
+        (1/P) sum_pairs max(0, 1 - s (x_A - x_B) w)^2 + lambda (ratio |w|_1 + (1 - ratio) |w|_2^2)
+
+    where s is +1 if the response of A is greater than the one of B and -1
+    otherwise, i.e. a squared hinge RankSVM with an elastic net penalty. The
+    bias is left out since it cancels in pair differences.
+
+    The difference vectors x_A - x_B are never built. With the set of pairs
+    violating the margin fixed, the loss is a quadratic form of the scores
+    f = X w through the Laplacian L of the graph of those pairs, so its
+    gradient is (2/P) X^T (L f - c). It is minimized by cyclic coordinate
+    descent in O(n) per coordinate (keeping f and L f up to date), the new
+    weights are accepted after a backtracking line search on the true
+    objective and the set of violating pairs is updated, until it is stable.
+
+    lambda goes from the smallest value for which all weights are zero down to
+    reg_contr on a geometric grid, each solution being the starting point of
+    the next one.
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Standardized gene expressions, of shape (n, d).
+    pairs : PairList
+        Training pairs, indices of rows of X and their labels.
+    ratio : float
+        Share of the L1 penalty, the L2 penalty getting the rest.
+    reg_contr : float
+        Last (smallest) lambda of the path.
+    num_lambdas : int
+        Number of lambda values of the path.
+    tol : float
+        Tolerance on the weight updates, scaled by the curvature.
+    max_iter : int
+        Maximum number of updates of the set of violating pairs per lambda.
+
+    Returns
+    -------
+    tuple
+        ``(lambdas, coefs)``, the lambda values of the path and the weights
+        found for each of them, of shape (num_lambdas, d).
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    size, num_genes = X.shape
+    problem = _RankProblem(X, pairs)
+
+    # At w = 0 every pair violates the margin
+    grad = -2.0 / problem.num_pairs * (X.T @ problem.targets(np.ones(len(problem.sign), dtype=bool)))
+    lambda_max = np.abs(grad).max() / max(ratio, 1e-3)
+    if reg_contr >= lambda_max:
+        lambdas = np.array([reg_contr])
+    else:
+        lambdas = np.geomspace(lambda_max, reg_contr, num_lambdas)
+
+    weights = np.zeros(num_genes)
+    coefs = np.empty((len(lambdas), num_genes))
+    previous = lambda_max
+    for k, lambda_ in enumerate(lambdas):
+        weights = problem.solve(weights, lambda_ * ratio, lambda_ * (1 - ratio), tol, max_iter,
+                                screen=2 * lambda_ * ratio - previous * ratio)
+        coefs[k] = weights
+        previous = lambda_
+    return lambdas, coefs
+
+
+class _RankProblem:
+    """Data of the pairwise ranking problem solved by rank_elastic_net_path"""
+
+    def __init__(self, X, pairs):
+        self.X = X
+        self.XT = np.ascontiguousarray(X.T)
+        self.idxA = pairs.idxA.astype(np.int64)
+        self.idxB = pairs.idxB.astype(np.int64)
+        self.sign = pairs.labels * 2.0 - 1.0
+        self.num_pairs = max(len(pairs), 1)
+
+    def targets(self, active):
+        """c = sum over the active pairs of s (e_A - e_B)"""
+        size = self.X.shape[0]
+        sign = self.sign[active]
+        return (np.bincount(self.idxA[active], sign, minlength=size)
+                - np.bincount(self.idxB[active], sign, minlength=size))
+
+    def laplacian(self, active):
+        """Laplacian of the graph whose edges are the active pairs"""
+        size = self.X.shape[0]
+        idxA = self.idxA[active]
+        idxB = self.idxB[active]
+        edges = np.bincount(idxA * size + idxB, minlength=size * size).reshape(size, size).astype(np.float64)
+        edges += edges.T
+        return np.diag(edges.sum(axis=1)) - edges
+
+    def margins(self, scores):
+        return 1.0 - self.sign * (scores[self.idxA] - scores[self.idxB])
+
+    def objective(self, weights, scores, l1, l2):
+        margins = np.maximum(self.margins(scores), 0.0)
+        return (np.dot(margins, margins) / self.num_pairs
+                + l1 * np.abs(weights).sum() + l2 * np.dot(weights, weights))
+
+    def gradient(self, residual):
+        """Gradient of the loss from the residual L f - c"""
+        return 2.0 / self.num_pairs * (self.XT @ residual)
+
+    def solve(self, weights, l1, l2, tol, max_iter, screen=0.0):
+        """Minimize the objective starting from weights. Coordinates whose
+        gradient is below screen are left out of coordinate descent as long as
+        they satisfy the optimality conditions (sequential strong rule)
+        """
+        scores = self.X @ weights
+        objective = self.objective(weights, scores, l1, l2)
+        for _ in range(max_iter):
+            active = self.margins(scores) > 0
+            new_weights = self._solve_quadratic(weights, scores, active, l1, l2, tol, screen)
+            new_scores = self.X @ new_weights
+
+            # Backtracking line search on the true objective, the quadratic
+            # only matches it while the violating pairs don't change
+            step = 1.0
+            while True:
+                trial_weights = weights + step * (new_weights - weights)
+                trial_scores = scores + step * (new_scores - scores)
+                trial_objective = self.objective(trial_weights, trial_scores, l1, l2)
+                if trial_objective <= objective or step < 1e-4:
+                    break
+                step /= 2
+            decrease = objective - trial_objective
+            weights, scores, objective = trial_weights, trial_scores, trial_objective
+            if step == 1.0 and np.array_equal(self.margins(scores) > 0, active):
+                break
+            if decrease <= tol * max(objective, 1e-12):
+                break
+        return weights
+
+    def _solve_quadratic(self, weights, scores, active, l1, l2, tol, screen):
+        """Coordinate descent on the elastic net with the active pairs fixed
+
+        Only a working set of coordinates is updated: the non-zero weights and
+        those passing the screening rule. Once converged, coordinates outside
+        of it violating the optimality conditions (|gradient| > l1) are added
+        and the descent resumes.
+        """
+        scale = 2.0 / self.num_pairs
+        laplacian = self.laplacian(active)
+        weights = weights.copy()
+        scores = scores.copy()
+        residual = laplacian @ scores - self.targets(active)
+
+        gradient = self.gradient(residual)
+        working = np.flatnonzero((weights != 0) | (np.abs(gradient) >= screen))
+        # Rows of (L X)^T and curvatures, computed for working coordinates only
+        LXT = np.empty_like(self.XT)
+        curvature = np.zeros(len(weights))
+        known = np.zeros(len(weights), dtype=bool)
+        while True:
+            new = working[~known[working]]
+            if len(new):
+                LXT[new] = (laplacian @ self.X[:, new]).T
+                curvature[new] = scale * np.einsum('ij,ij->i', self.XT[new], LXT[new])
+                known[new] = True
+            self._descend(weights, scores, residual, LXT, curvature, working, l1, l2, tol)
+
+            gradient = self.gradient(residual)
+            outside = np.ones(len(weights), dtype=bool)
+            outside[working] = False
+            violators = np.flatnonzero(outside & (np.abs(gradient) > l1 * (1 + 1e-6)))
+            if not len(violators):
+                return weights
+            working = np.union1d(working, violators)
+
+    def _descend(self, weights, scores, residual, LXT, curvature, coords, l1, l2, tol):
+        """Cyclic coordinate descent over coords, updating weights, scores and
+        residual in place
+        """
+        scale = 2.0 / self.num_pairs
+        full_sweep = True
+        working = coords
+        for _ in range(_MAX_SWEEPS):
+            max_change = 0.0
+            for j in coords:
+                if curvature[j] <= 0:
+                    continue
+                gradient = scale * np.dot(self.XT[j], residual)
+                z = curvature[j] * weights[j] - gradient
+                new_weight = np.sign(z) * max(abs(z) - l1, 0.0) / (curvature[j] + 2 * l2)
+                change = new_weight - weights[j]
+                if change != 0.0:
+                    weights[j] = new_weight
+                    scores += change * self.XT[j]
+                    residual += change * LXT[j]
+                    max_change = max(max_change, abs(change) * np.sqrt(curvature[j]))
+            if max_change < tol:
+                if full_sweep:
+                    return
+                # Converged on the non-zero weights, check all of them again
+                full_sweep = True
+                coords = working
+            else:
+                # Iterate on the non-zero weights until they converge
+                full_sweep = False
+                coords = working[weights[working] != 0]
@@ -6,8 +6,8 @@ import pandas as pd
 import json
 import sys
 from io import StringIO
-from lifelines.utils import concordance_index
-from sklearn.preprocessing import StandardScaler
+from cinet.metrics import concordance_index
+from cinet.io import read_table
 from sklearn.model_selection import GridSearchCV
 import pickle
 import numpy
@@ -23,7 +23,7 @@ model = deepCINET(device='gpu')
 # Train the model
 
 # Prepare Input Datacd doc
-train_df = pd.read_csv(file).set_index('cell_line')
+train_df = read_table(file)
 X = train_df.iloc[:,1:]
 y = train_df.iloc[:,0]
 
@@ -36,8 +36,7 @@ test_file = '/home/gputwo/bhklab/kevint/cinet/test_data/GDSC_Test_Data/gene_GDSC
 
 # Test the model
 
-test_df = pd.read_csv(test_file).iloc[:,1:]
-test_df.values[:] =  StandardScaler().fit_transform(test_df)
+test_df = read_table(test_file)
 model.score(test_df.iloc[:, 1:], test_df.iloc[:, 0]) 
 
 # Alternately, instead of model.score(X,y) you can use model.predict(X)
@@ -6,7 +6,8 @@ import pandas as pd
 import json
 import sys
 from io import StringIO
-from lifelines.utils import concordance_index
+from cinet.metrics import concordance_index
+from cinet.io import read_table
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import GridSearchCV
 import pickle
@@ -30,7 +31,7 @@ save_dir = './'
 data = {}
 for file in file_list[:2]: 
     name = file.replace('_response.csv','').replace('rnaseq_','').replace('gene_', '')
-    df = pd.read_csv(file_dir + file).set_index('cell_line')
+    df = read_table(file_dir + file)
     X = df.iloc[:,1:]
     y = df.iloc[:,0]
     grid = GridSearchCV(deepCINET(modelPath= (save_dir + name + '.ckpt'), device='cpu', batch_size=2**12), param_grid, refit = True, verbose = 3,n_jobs=3)
@@ -7,8 +7,8 @@ import pandas as pd
 import json
 import sys
 from io import StringIO
-from lifelines.utils import concordance_index
-from sklearn.preprocessing import StandardScaler
+from cinet.metrics import concordance_index
+from cinet.io import read_table
 from sklearn.model_selection import GridSearchCV
 import pickle
 import numpy
@@ -38,7 +38,7 @@ for param in deepCINET_hparam_tuned:
     file_list = os.listdir(train_dir)
     train_file = list(filter(lambda x: drug in x, file_list))[0]
     # Prepare Input Data
-    df = pd.read_csv(train_dir + train_file).set_index('cell_line')
+    df = read_table(train_dir + train_file)
     X = df.iloc[:,1:]
     y = df.iloc[:,0]
     model_DC.fit(X,y)
@@ -47,8 +47,7 @@ for param in deepCINET_hparam_tuned:
         test_dir = test_directories[key]
         file_list_2 = os.listdir(test_dir)
         test_file = list(filter(lambda x: drug in x, file_list_2))[0]
-        df = pd.read_csv(test_dir + test_file).iloc[:,1:]
-        df.values[:] =  StandardScaler().fit_transform(df)
+        df = read_table(test_dir + test_file)
         DC_result = model_DC.score(df.iloc[:, 1:], df.iloc[:, 0]) 
         EC_result = model_EC.score(df.iloc[:, 1:], df.iloc[:, 0]) 
         if drug in data: 
@@ -6,7 +6,8 @@ import pandas as pd
 import json
 import sys
 from io import StringIO
-from lifelines.utils import concordance_index
+from cinet.metrics import concordance_index
+from cinet.io import read_table
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import GridSearchCV
 import pickle
@@ -30,7 +31,7 @@ modelEN = ElasticNet() # Need to tune alpha, l1_ratio
 # Train the model
 
 # PREPARE INPUT DATA
-train_df = pd.read_csv(file).set_index('cell_line')
+train_df = read_table(file)
 X = train_df.iloc[:,1:]
 # Normalize Gene Expression
 X = (X - np.mean(X,axis=0)) / np.std(X,axis=0)
@@ -46,7 +47,7 @@ print("done fitting")
 # SET UP TEST FILE
 # test_file = '/home/gputwo/bhklab/kevint/cinet/test_data/gCSI_Test_Data/gene_gCSI_rnaseq_Erlotinib_response.csv'
 test_file = '/home/gputwo/bhklab/kevint/cinet/test_data/GDSC_Test_Data/gene_GDSC_rnaseq_Erlotinib_response.csv'
-test_df = pd.read_csv(test_file).iloc[:,1:]
+test_df = read_table(test_file)
 test_df_X = test_df.iloc[:, 1:]
 # Normalize Gene Expression
 test_df_X = (test_df_X - np.mean(test_df_X,axis=0)) / np.std(test_df_X,axis=0)
@@ -0,0 +1,71 @@
+import gc
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from cinet import *
+from cinet.models import Dataset
+
+# Peak memory of the data pipeline of a cross-validated fit: joining X and y,
+# then building the training and validation data sets of the 5 folds. No
+# network is trained. NumPy reports its allocations to tracemalloc, so peak
+# is the most array memory held at once.
+# 'baseline' runs the DataFrame path fit used before _fit_data: pd.concat of X
+# and y, then every Dataset copying its rows with iloc and drop('target'), and
+# the validation rows taken from a re-split X. 'current' runs fit's own
+# pipeline. Both are run by default.
+# Usage: python 04_memory_benchmark.py [cell lines] [genes] [baseline|current|both]
+num_cells = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+num_genes = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+mode = sys.argv[3] if len(sys.argv) > 3 else 'both'
+
+# Random expressions, as read_csv would return them (float64)
+rng = np.random.default_rng(0)
+X = pd.DataFrame(rng.normal(5.0, 2.0, size=(num_cells, num_genes)),
+                 index=['cell_%d' % i for i in range(num_cells)],
+                 columns=['gene_%d' % i for i in range(num_genes)])
+y = pd.Series(rng.random(num_cells), index=X.index, name='target')
+size = X.memory_usage(index=False).sum() / 2 ** 20
+
+
+def baseline(model):
+    combined_df = pd.concat([X, y], axis=1)
+    combined_df.columns.values[-1] = 'target'
+    genes = combined_df.iloc[:, 0:-1]
+    loaders = []
+    for train_index, val_index in model.get_folds(combined_df):
+        train_ds = Dataset(combined_df, True, model.batch_size, model.delta, train_index)
+        val_ds = Dataset(combined_df, True, model.batch_size, model.delta, val_index, scaler=train_ds.scaler)
+        loaders.append((train_ds, val_ds, genes.iloc[val_index]))
+    return loaders
+
+
+def current(model):
+    combined_df = model._prepare_fit(X, y)
+    return model.get_dataloaders(combined_df, True, False)
+
+
+def measure(name, pipeline):
+    model = deepCINET(delta=0.2, batch_size=256, num_workers=0)
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    loaders = pipeline(model)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaders
+    model._release_fit_data()
+    print('%s:' % name)
+    print('  Held after building the folds: %.0f MB (%.2f x X)' % (current / 2 ** 20, current / 2 ** 20 / size))
+    print('  Peak: %.0f MB (%.2f x X)' % (peak / 2 ** 20, peak / 2 ** 20 / size))
+    print('  Time: %.1f s' % elapsed)
+
+
+print('X: %d x %d, %.0f MB (float64)' % (num_cells, num_genes, size))
+if mode in ['baseline', 'both']:
+    measure('Baseline (DataFrame copies)', baseline)
+if mode in ['current', 'both']:
+    measure('Current (one float32 copy)', current)
@@ -19,6 +19,7 @@ import os
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 import matplotlib_venn as venn
+from cinet.io import ExpressionStore
 
 # This function prints and returns all the drugs that are common in the datasets specified in the
 # datasets variable. It is important that we train and test on the same drugs across the training
@@ -268,6 +269,21 @@ def generate_cancer_gene_census_files(dataset, genes):
         print(result)
         result.to_csv(safe_path + drug_name + "-CGC.csv")
 
+# This function is used to gather all the per drug csv files of a dataset (e.g. the ones generated by
+# generate_cancer_gene_census_files) in a single expression store (see cinet.io.ExpressionStore). The expression
+# matrix, which is the same in every drug file, is only stored once, together with the response of every cell-line
+# to every drug. Models are then trained with X, y = ExpressionStore(store_path).load(drug).
+def generate_expression_store(dataset):
+    path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/PSets/Curated Data/" + dataset + "/"
+    store_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/PSets/Curated Data/" + dataset + "-store/"
+    tables = {}
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith(".csv"):
+            tables[filename[0:(len(filename)-4)]] = path + filename
+    store = ExpressionStore.from_tables(store_path, tables)
+    print(dataset + ": " + str(len(store.cells)) + " cell-lines, " + str(len(store.genes)) + " genes, " + str(len(store)) + " drugs")
+    return store
+
 def fix_genes_files(dataset):
     path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/PSets/Curated Data/" + dataset + '-expr/'
     for filename in os.listdir(path):
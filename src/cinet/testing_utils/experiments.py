@@ -6,7 +6,8 @@ import matplotlib.pyplot as plt
 import os
 import json
 from pymrmre import mrmr_ensemble
-from lifelines.utils import concordance_index
+from cinet.metrics import concordance_index
+from cinet.io import read_table
 from sklearn.linear_model import ElasticNet
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
@@ -17,8 +18,7 @@ def train(drug, delta, batch_size, epochs, version, arch, cross_validation):
     # path = "/home/marc_delgado_sanchez_uhn_ca/train_data/"
     file = drug + ".csv"
     whole_path = path + file
-    table = pd.read_csv(whole_path)
-    table = table.set_index(list(table.columns[[0]]))
+    table = read_table(whole_path)
     print(table)
     X = table.iloc[:,1:] # X contains all genomic information
     y = table.iloc[:,0]  # y contains the response data (AAC)
@@ -34,8 +34,8 @@ def train(drug, delta, batch_size, epochs, version, arch, cross_validation):
     with open(json_file_name, "w") as outfile:
         outfile.write(param_json)
     
-    model_file_name = "models/" + drug + "-" + version + ".pth"
-    torch.save(model, model_file_name)
+    model_file_name = "models/" + drug + "-" + version + ".safetensors"
+    model.save(model_file_name)
     return val_ci
 
 def test_gcsi(drug, version):
@@ -44,15 +44,15 @@ def test_gcsi(drug, version):
     file = drug + ".csv"
     whole_path = path + file
 
-    table = pd.read_csv(whole_path).set_index('cell_line')
+    table = read_table(whole_path)
     X = table.iloc[:,1:] # X contains all genomic information
     y = table.iloc[:,0]  # y contains the response data (AAC)
 
     model_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/models/"
     # model_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/models/"
-    model_name = drug + "-" + version + ".pth"
+    model_name = drug + "-" + version + ".safetensors"
     whole_model_path = model_path + model_name
-    model = torch.load(whole_model_path)
+    model = deepCINET.load(whole_model_path)
 
     concordance = model.score(X, y)
     return concordance
@@ -63,15 +63,15 @@ def test_gdsc(drug, version):
     file = drug + ".csv"
     whole_path = path + file
 
-    table = pd.read_csv(whole_path).set_index('cell_line')
+    table = read_table(whole_path)
     X = table.iloc[:,1:] # X contains all genomic information
     y = table.iloc[:,0]  # y contains the response data (AAC)
 
     model_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/models/"
     # model_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/models/"
-    model_name = drug + "-" + version + ".pth"
+    model_name = drug + "-" + version + ".safetensors"
     whole_model_path = model_path + model_name
-    model = torch.load(whole_model_path)
+    model = deepCINET.load(whole_model_path)
 
     concordance = model.score(X, y)
     return concordance
@@ -95,8 +95,7 @@ def test_clinical(version, cohort, drug):
     path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/clinical_data/"
     file = "GSE" + cohort + "_SE_final.csv"
     whole_path = path + file
-    table = pd.read_csv(whole_path)
-    table = table.set_index(list(table.columns[[0]]))
+    table = read_table(whole_path)
     X = table.iloc[:,1:] # X contains all genomic information
     y = table.iloc[:,0]  # y contains the response data (AAC)
 
@@ -104,9 +103,9 @@ def test_clinical(version, cohort, drug):
     # print(y)
 
     model_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/models/DSI Models/"  
-    model_name = drug + "-Clinical-" + cohort + '-' + version + ".pth"
+    model_name = drug + "-Clinical-" + cohort + '-' + version + ".safetensors"
     whole_model_path = model_path + model_name
-    model = torch.load(whole_model_path)
+    model = deepCINET.load(whole_model_path)
 
     preds = model.predict(X)
     concordance = concordance_index(y.tolist(), preds.tolist())
@@ -163,16 +162,29 @@ def architecture_exploration():
                   'epochs': epochs}
     num_exp = len(experiment_drugs)*len(architectures)*len(deltas)
     count = 1
+    path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/train_data/"
+    # path = "/home/marc_delgado_sanchez_uhn_ca/train_data/"
+    tables = {}
+    for drug in experiment_drugs:
+        tables[drug] = read_table(path + drug + ".csv")
     for arch in architectures:
         arch_ci = []
         for drug in experiment_drugs:
-            drug_ci = []
-            vers = 0
-            for delta in deltas:
-                val_ci = train(drug, delta, batch_size, epochs, version=str(vers), arch=arch, cross_validation=True)
-                vers += 1
-                drug_ci.append(np.average(val_ci))
-                print("Experiment " + str(count) + '/' + str(num_exp))
+            X = tables[drug].iloc[:,1:] # X contains all genomic information
+            y = tables[drug].iloc[:,0]  # y contains the response data (AAC)
+            # One pass over the data for all deltas, only the training is repeated
+            model = deepCINET(device='cpu', batch_size=batch_size, max_epochs=epochs, nnHiddenLayers=arch)
+            versions = {delta: str(vers) for vers, delta in enumerate(deltas)}
+            def save_version(delta, model):
+                # Same params and model files as train, one version per delta
+                param = {'delta': delta, 'batch_size': batch_size, 'max_epochs': epochs, 'architecture': arch}
+                with open("params/" + drug + "-" + versions[delta] + "-param.json", "w") as outfile:
+                    outfile.write(json.dumps(param))
+                model.save("models/" + drug + "-" + versions[delta] + ".safetensors")
+            delta_path = model.fit_delta_path(X, y, deltas, callback=save_version)
+            drug_ci = delta_path['ci'].tolist()
+            count += len(deltas)
+            print("Experiment " + str(count - 1) + '/' + str(num_exp))
             arch_ci.append(drug_ci)
         cross_validation_results.append(arch_ci)
     np.save("ArchitectureExperimentResults.npy", cross_validation_results)
@@ -237,8 +249,7 @@ def method_validation():
         drug_result = []
         file = drug + ".csv"
         whole_path = path + file
-        table = pd.read_csv(whole_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(whole_path)
         X = table.iloc[:,1:] # X contains all genomic information
         y = pd.DataFrame({'target': table.iloc[:,0]})  # y contains the response data (AAC)
         selected_genes = mrmr_ensemble(X, y, 100)
@@ -269,10 +280,8 @@ def model_inference():
     for drug in drugs:
         drug_result = []
         file = drug + ".csv"
-        gdsc_table = pd.read_csv(gdsc_path + file)
-        gcsi_table = pd.read_csv(gcsi_path + file)
-        gdsc_table = gdsc_table.set_index(list(gdsc_table.columns[[0]]))
-        gcsi_table = gcsi_table.set_index(list(gcsi_table.columns[[0]]))
+        gdsc_table = read_table(gdsc_path + file)
+        gcsi_table = read_table(gcsi_path + file)
         common_cells = set.intersection(set(gdsc_table.index), set(gcsi_table.index))
         other_cells_gcsi = set(gcsi_table.index) - common_cells
         other_cells_gdsc = set(gdsc_table.index) - common_cells
@@ -328,12 +337,9 @@ def correlation_exploration():
     for drug in drugs:
         drug_result = []
         file = drug + ".csv"
-        train_table = pd.read_csv(train_path + file)
-        gdsc_table = pd.read_csv(gdsc_path + file)
-        gcsi_table = pd.read_csv(gcsi_path + file)
-        gdsc_table = gdsc_table.set_index(list(gdsc_table.columns[[0]]))
-        gcsi_table = gcsi_table.set_index(list(gcsi_table.columns[[0]]))
-        train_table = train_table.set_index(list(train_table.columns[[0]]))
+        train_table = read_table(train_path + file)
+        gdsc_table = read_table(gdsc_path + file)
+        gcsi_table = read_table(gcsi_path + file)
 
         X = train_table.iloc[:,1:] # X contains all genomic information
         y = pd.DataFrame({'target': train_table.iloc[:,0]})  # y contains the response data (AAC)
@@ -466,15 +472,12 @@ def learn_experiment():
         test_path = "/home/marc_delgado_sanchez_uhn_ca/test_data/"
         # train_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/train_data/" + drug + ".csv"
         train_path = "/home/marc_delgado_sanchez_uhn_ca/train_data/" + drug + ".csv"
-        table = pd.read_csv(train_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(train_path)
         X = table.iloc[:,1:] # X contains all genomic information
         y = pd.DataFrame({'target': table.iloc[:,0]})  # y contains the response data (AAC)
         selected_genes = mrmr_ensemble(X, y, gene_indices)
-        gcsi = pd.read_csv(test_path + "gCSI_Test_Data/" + drug + ".csv")
-        gcsi = gcsi.set_index(list(gcsi.columns[[0]]))
-        gdsc = pd.read_csv(test_path + "GDSC_Test_Data/" + drug + ".csv")
-        gdsc = gdsc.set_index(list(gdsc.columns[[0]]))
+        gcsi = read_table(test_path + "gCSI_Test_Data/" + drug + ".csv")
+        gdsc = read_table(test_path + "GDSC_Test_Data/" + drug + ".csv")
         X_gcsi = gcsi[selected_genes[0][0]]
         y_gcsi = gcsi.iloc[:,0]
         X_gdsc = gdsc[selected_genes[0][0]]
@@ -512,8 +515,7 @@ def train_test_split_plot():
     for drug in drugs:
         file = drug + ".csv"
         whole_path = path + file
-        table = pd.read_csv(whole_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(whole_path)
         scores = []
         for index in indices:
             X = table.iloc[:,1:index] # X contains all genomic information
@@ -539,8 +541,7 @@ def cross_validation_plot():
     for drug in drugs:
         file = drug + ".csv"
         whole_path = path + file
-        table = pd.read_csv(whole_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(whole_path)
         scores = []
         for index in indices:
             X = table.iloc[:,1:index] # X contains all genomic information
@@ -584,8 +585,7 @@ def cross_val_mrmr():
     for drug in drugs:
         file = drug + ".csv"
         whole_path = path + file
-        table = pd.read_csv(whole_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(whole_path)
         scores = []
         X = table.iloc[:,1:]
         y = pd.DataFrame({'target': table.iloc[:,0]}) # y contains the response data (AAC)
@@ -629,13 +629,10 @@ def gcsi_gdsc_tests():
     for drug in experiment_drugs:
         test_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/test_data/"
         train_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/train_data/" + drug + ".csv"
-        gcsi = pd.read_csv(test_path + "gCSI_Test_Data/" + drug + ".csv")
-        gdsc = pd.read_csv(test_path + "GDSC_Test_Data/" + drug + ".csv")
+        gcsi = read_table(test_path + "gCSI_Test_Data/" + drug + ".csv")
+        gdsc = read_table(test_path + "GDSC_Test_Data/" + drug + ".csv")
 
-        gcsi = gcsi.set_index(list(gcsi.columns[[0]]))
-        gdsc = gdsc.set_index(list(gdsc.columns[[0]]))
-        table = pd.read_csv(train_path)
-        table = table.set_index(list(table.columns[[0]]))
+        table = read_table(train_path)
         X = table.iloc[:,1:] # X contains all genomic information
         y = pd.DataFrame({'target': table.iloc[:,0]})  # y contains the response data (AAC)
 
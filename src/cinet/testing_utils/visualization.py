@@ -1,4 +1,5 @@
 from cinet import *
+from cinet.io import read_table
 from sklearn.metrics import r2_score
 import numpy as np
 import pandas as pd
@@ -13,19 +14,19 @@ def obtain_distr(drug_name):
     train_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/train_data/"
     train_file = drug_name + ".csv"
     whole_train_path = train_path + train_file
-    table = pd.read_csv(whole_train_path).set_index('cell_line')
+    table = read_table(whole_train_path)
     train_y = table.iloc[:,0]  # y contains the response data (AAC)
 
     gcsi_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/test_data/gCSI_Test_Data/"
     gcsi_file = drug_name + ".csv"
     whole_gcsi_path = gcsi_path + gcsi_file
-    table = pd.read_csv(whole_gcsi_path).set_index('cell_line')
+    table = read_table(whole_gcsi_path)
     gcsi_y = table.iloc[:,0]  # y contains the response data (AAC)
 
     gdsc_path = "C:/Users/marcd/OneDrive/Escritorio/UHN/DeepCINET/Code/cinet/test_data/GDSC_Test_Data/"
     gdsc_file = drug_name + ".csv"
     whole_gdsc_path = gdsc_path + gdsc_file
-    table = pd.read_csv(whole_gdsc_path).set_index('cell_line')
+    table = read_table(whole_gdsc_path)
     gdsc_y = table.iloc[:,0]  # y contains the response data (AAC)
 
     return (train_y, gcsi_y, gdsc_y)
@@ -35,7 +36,7 @@ def plot_distribution(drug_name):
     train_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/train_data/"
     train_file = drug_name + ".csv"
     whole_train_path = train_path + train_file
-    table = pd.read_csv(whole_train_path).set_index('cell_line')
+    table = read_table(whole_train_path)
     train_y = table.iloc[:,0]  # y contains the response data (AAC)
     plt.subplot(3,1,1)
     plt.hist(train_y, bins=300, range=(0,1), color="lightblue")
@@ -47,7 +48,7 @@ def plot_distribution(drug_name):
     gcsi_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/test_data/gCSI_Test_Data/"
     gcsi_file = drug_name + ".csv"
     whole_gcsi_path = gcsi_path + gcsi_file
-    table = pd.read_csv(whole_gcsi_path).set_index('cell_line')
+    table = read_table(whole_gcsi_path)
     gcsi_y = table.iloc[:,0]  # y contains the response data (AAC)
     plt.subplot(3,1,2)
     plt.hist(gcsi_y, bins=300, range=(0,1), color="orange")
@@ -60,7 +61,7 @@ def plot_distribution(drug_name):
     gdsc_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/test_data/GDSC_Test_Data/"
     gdsc_file = drug_name + ".csv"
     whole_gdsc_path = gdsc_path + gdsc_file
-    table = pd.read_csv(whole_gdsc_path).set_index('cell_line')
+    table = read_table(whole_gdsc_path)
     gdsc_y = table.iloc[:,0]  # y contains the response data (AAC)
     plt.subplot(3,1,3)
     plt.hist(gdsc_y, bins=300, range=(0,1), color="red")
@@ -78,9 +79,9 @@ def plotnine_distribution(drug_name):
     train_file = drug_name + ".csv"
     gcsi_file = "gCSI_Test_Data/" + drug_name + ".csv"
     gdsc_file = "GDSC_Test_Data/" + drug_name + ".csv"
-    train_table = pd.read_csv(train_path + train_file)
-    gcsi_table = pd.read_csv(test_path + gcsi_file)
-    gdsc_table = pd.read_csv(test_path + gdsc_file)
+    train_table = read_table(train_path + train_file)
+    gcsi_table = read_table(test_path + gcsi_file)
+    gdsc_table = read_table(test_path + gdsc_file)
     tables = [(train_table, "CCLE"), (gcsi_table, "gCSI"), (gdsc_table, "GDSC")]
     result = pd.concat([df.assign(dataset=k) for (df, k) in tables])
     fig = (p9.ggplot(result, p9.aes(x='target', color='dataset', fill='dataset')) + p9.geom_density(alpha=0.1)
@@ -95,9 +96,9 @@ def seaborn_distribution(drug_name):
     train_file = drug_name + ".csv"
     gcsi_file = "gCSI_Test_Data/" + drug_name + ".csv"
     gdsc_file = "GDSC_Test_Data/" + drug_name + ".csv"
-    train_table = pd.read_csv(train_path + train_file)
-    gcsi_table = pd.read_csv(test_path + gcsi_file)
-    gdsc_table = pd.read_csv(test_path + gdsc_file)
+    train_table = read_table(train_path + train_file)
+    gcsi_table = read_table(test_path + gcsi_file)
+    gdsc_table = read_table(test_path + gdsc_file)
     tables = [(train_table, "CCLE"), (gcsi_table, "gCSI"), (gdsc_table, "GDSC")]
     result = pd.concat([df.assign(dataset=k) for (df, k) in tables])
     fig = sns.displot(result, x="target", hue="dataset", kind="kde", fill=True, legend=False).set(title=drug_name, xlim=(0,1), xlabel="", ylabel="")
@@ -189,13 +190,13 @@ def check_datasets(drugs):
         # gcsi_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/test_data/gCSI_Test_Data/"
         gcsi_file = drug_name + ".csv"
         whole_gcsi_path = gcsi_path + gcsi_file
-        gcsi_table = pd.read_csv(whole_gcsi_path)
+        gcsi_table = read_table(whole_gcsi_path).reset_index()
         gcsi_cells = gcsi_table.iloc[:,0]
 
         # gdsc_path = "/home/marc_delgado_sanchez_uhn_ca/cinet/test_data/GDSC_Test_Data/"
         gdsc_file = drug_name + ".csv"
         whole_gdsc_path = gdsc_path + gdsc_file
-        gdsc_table = pd.read_csv(whole_gdsc_path)
+        gdsc_table = read_table(whole_gdsc_path).reset_index()
         gdsc_cells = gdsc_table.iloc[:,0]
 
         test_cells = pd.merge(gdsc_cells, gcsi_cells)
@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def expression_data():
+    """Small synthetic (X, y): gene expressions of cell lines and a response driven by three genes"""
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(5.0, 2.0, size=(80, 12)),
+                     index=['cell_%d' % i for i in range(80)],
+                     columns=['gene_%d' % i for i in range(12)])
+    y = pd.Series(X.to_numpy()[:, :3].sum(axis=1) + rng.normal(scale=0.5, size=80), index=X.index, name='target')
+    y = (y - y.min()) / (y.max() - y.min())
+    return X, y
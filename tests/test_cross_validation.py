@@ -0,0 +1,33 @@
+import pytest
+
+from cinet import deepCINET
+
+
+def model_for(**kwargs):
+    return deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=2, batch_size=32, engine='native',
+                     **kwargs)
+
+
+def test_parallel_folds_match_sequential(expression_data):
+    X, y = expression_data
+    [sequential] = model_for(n_jobs=1).fit(X, y, cross_validation=True)
+    [parallel] = model_for(n_jobs=2).fit(X, y, cross_validation=True)
+    # Up to a pair ranked differently because of the thread count of the matmuls (one pair is about 4e-4)
+    assert parallel == pytest.approx(sequential, abs=2e-3)
+
+
+def test_fit_delta_path_callback_saves_each_delta(expression_data, tmp_path):
+    X, y = expression_data
+    saved = []
+
+    def save(delta, model):
+        path = str(tmp_path / ('%s.safetensors' % delta))
+        model.save(path)
+        saved.append((delta, path))
+
+    model_for().fit_delta_path(X, y, deltas=[0.0, 0.1], callback=save)
+    assert [delta for delta, _ in saved] == [0.0, 0.1]
+    for delta, path in saved:
+        loaded = deepCINET.load(path)
+        assert loaded.delta == delta
+        assert loaded.predict(X).notna().all().all()
@@ -0,0 +1,58 @@
+import contextlib
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from cinet import deepCINET
+from cinet.models import ValidationEarlyStopping
+
+
+class LinearScorer(nn.Module):
+    """Scores the cell lines with a linear function of their genes"""
+
+    device = torch.device('cpu')
+
+    def __init__(self, num_genes):
+        super().__init__()
+        self.weight = nn.Parameter(torch.zeros(num_genes))
+
+    def score(self, genes):
+        return genes @ self.weight
+
+    def autocast(self):
+        return contextlib.nullcontext()
+
+
+class Validation:
+    def __init__(self, genes, responses):
+        self.gene_exprs = genes
+        self.drug_resps = responses
+
+
+def test_stops_after_patience_and_restores_the_best_weights():
+    genes = torch.randn(30, 3, generator=torch.Generator().manual_seed(0))
+    responses = genes[:, 0].numpy()
+    early_stopping = ValidationEarlyStopping(Validation(genes, responses), patience=2)
+    model = LinearScorer(3)
+    stops = []
+    # CI of 1 at the second epoch, then worse
+    for weight in [[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [-1.0, 0.0, 0.0]]:
+        with torch.no_grad():
+            model.weight.copy_(torch.tensor(weight))
+        stops.append(early_stopping.update(model))
+    assert stops == [False, False, False, True]
+    assert early_stopping.best_epoch == 1 and early_stopping.best_ci == 1.0
+    early_stopping.restore(model)
+    torch.testing.assert_close(model.weight.detach(), torch.tensor([1.0, 0.0, 0.0]))
+
+
+def test_fit_stops_early(expression_data, capsys):
+    X, y = expression_data
+    model = deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=40, batch_size=64, engine='native',
+                      patience=1)
+    model.fit(X, y, cross_validation=False)
+    output = capsys.readouterr().out
+    num_epochs = output.count('val_CI=')
+    assert 2 <= num_epochs < 40
+    assert 'Restored the weights of epoch' in output
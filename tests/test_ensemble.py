@@ -0,0 +1,130 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from cinet import deepCINET, deepCINETEnsemble
+from cinet.ensemble import StackedFullyConnected, _StackedAdam
+from cinet.models import FullyConnected
+from cinet.metrics import concordance_index
+
+
+@pytest.fixture
+def ensemble(expression_data):
+    X, y = expression_data
+    model = deepCINETEnsemble(deltas=[0.0, 0.1], learning_rates=[0.01, 0.001], nnHiddenLayers=(8, 0, 0, 0),
+                              num_workers=0, max_epochs=2, batch_size=64)
+    model.fit(X, y)
+    return model
+
+
+def test_predict_returns_member_scores(ensemble, expression_data):
+    X, y = expression_data
+    predictions = ensemble.predict(X)
+    assert predictions.shape == (2, len(X))
+    assert list(predictions.index) == ensemble.members()
+    assert list(predictions.columns) == list(X.index)
+    for k, estimator in enumerate(ensemble.estimators_):
+        np.testing.assert_allclose(predictions.iloc[k].to_numpy(), estimator.predict(X).to_numpy())
+
+
+def test_score_per_member(ensemble, expression_data):
+    X, y = expression_data
+    scores = ensemble.score(X, y)
+    expected = [concordance_index(y.to_numpy(), estimator.predict(X).to_numpy()) for estimator in ensemble.estimators_]
+    np.testing.assert_allclose(scores, expected)
+
+
+def test_save_load_round_trip(ensemble, expression_data, tmp_path):
+    X, y = expression_data
+    path = str(tmp_path / 'ensemble.safetensors')
+    ensemble.save(path)
+    loaded = deepCINET.load(path)
+    assert isinstance(loaded, deepCINETEnsemble)
+    assert loaded.members() == ensemble.members()
+    pd.testing.assert_frame_equal(loaded.predict(X), ensemble.predict(X), rtol=1e-6)
+
+
+@pytest.mark.parametrize('params', [{'patience': 2}, {'n_jobs': 2}, {'unique_cells': False},
+                                    {'engine': 'lightning'}, {'out_of_core': True}])
+def test_unsupported_options_rejected(expression_data, params):
+    X, y = expression_data
+    with pytest.raises(AssertionError):
+        deepCINETEnsemble(deltas=[0.0, 0.1], num_workers=0, **params).fit(X, y)
+
+
+def test_unsupported_fit_arguments_rejected(expression_data):
+    X, y = expression_data
+    model = deepCINETEnsemble(deltas=[0.0, 0.1], num_workers=0)
+    for kwargs in [{'cross_validation': True}, {'random_pairs': True}, {'pair_sampling': 'stream'}]:
+        with pytest.raises(AssertionError):
+            model.fit(X, y, **kwargs)
+
+
+def test_fit_delta_path(expression_data):
+    X, y = expression_data
+    model = deepCINETEnsemble(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=1, batch_size=64)
+    path = model.fit_delta_path(X, y, deltas=[0.0, 0.2])
+    assert list(path.index) == [0.0, 0.2]
+    assert list(path.columns) == ['ci', 'pairs']
+    assert path['pairs'].iloc[0] > path['pairs'].iloc[1] > 0
+    assert model.deltas is None
+
+
+def networks(num_genes=6, seeds=(1, 2, 3)):
+    members = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        members.append(FullyConnected([num_genes, 5, 4, 1], 0.0, True))
+    return members
+
+
+def test_stacked_forward_matches_members():
+    members = networks()
+    stacked = StackedFullyConnected(members)
+    genes = torch.randn(20, 6)
+    for mode in ['train', 'eval']:
+        for network in members + [stacked]:
+            getattr(network, mode)()
+        with torch.no_grad():
+            scores = stacked(genes)
+            for k, network in enumerate(members):
+                torch.testing.assert_close(scores[k], network(genes).view(-1))
+
+
+def test_stacked_training_step_matches_members():
+    members = networks()
+    stacked = StackedFullyConnected(copy.deepcopy(members))
+    learning_rates = torch.tensor([0.01, 0.05, 0.001])
+    deltas = torch.tensor([0.0, 0.2, 0.4])
+    rng = np.random.default_rng(0)
+    genes = torch.randn(16, 6)
+    responses = torch.from_numpy(rng.random(16)).float()
+    idxA = torch.from_numpy(rng.integers(0, 16, 40))
+    idxB = torch.from_numpy(rng.integers(0, 16, 40))
+    signs = (responses[idxA] > responses[idxB]).float() * 2 - 1
+    mask = (responses[idxA] - responses[idxB]).abs()[None, :] > deltas[:, None]
+
+    stacked.train()
+    optimizer = _StackedAdam(stacked.parameters(), learning_rates)
+    for _ in range(3):
+        scores = stacked(genes)
+        losses = (torch.relu(-signs * (scores[:, idxA] - scores[:, idxB])) * mask).sum(1) / mask.sum(1)
+        optimizer.zero_grad()
+        losses.sum().backward()
+        optimizer.step(mask.sum(1) > 0)
+
+    for k, network in enumerate(members):
+        network.train()
+        member_optimizer = torch.optim.Adam(network.parameters(), lr=float(learning_rates[k]))
+        for _ in range(3):
+            scores = network(genes).view(-1)
+            loss = (torch.relu(-signs * (scores[idxA] - scores[idxB])) * mask[k]).sum() / mask[k].sum()
+            member_optimizer.zero_grad()
+            loss.backward()
+            member_optimizer.step()
+        expected = network.state_dict()
+        for key, value in stacked.member_state_dict(k).items():
+            torch.testing.assert_close(value, expected[key], rtol=1e-5, atol=1e-5)
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cinet.io import ExpressionStore, read_table
+
+
+def write_table(path, cells, genes, seed):
+    rng = np.random.default_rng(seed)
+    table = pd.DataFrame(rng.normal(size=(len(cells), len(genes))), index=cells, columns=genes)
+    table.insert(0, 'target', rng.random(len(cells)))
+    table.index.name = 'cell_line'
+    table.to_csv(path)
+    return table
+
+
+def test_read_table_round_trip(tmp_path):
+    path = str(tmp_path / 'drug.csv')
+    table = write_table(path, ['c%d' % i for i in range(20)], ['g%d' % i for i in range(6)], 0)
+    for _ in range(2):
+        # Parsed the first time, read from the cache the second
+        cached = read_table(path)
+        assert cached.index.equals(table.index)
+        assert list(cached.columns) == list(table.columns)
+        assert cached.dtypes.eq(np.float32).all()
+        np.testing.assert_allclose(cached.to_numpy(), table.to_numpy(), rtol=1e-6)
+    # Changes to the returned frame don't reach the cache
+    cached.iloc[0, 0] = 100.0
+    assert read_table(path).iloc[0, 0] != 100.0
+
+
+def test_read_table_invalidated_by_changes(tmp_path):
+    path = str(tmp_path / 'drug.csv')
+    write_table(path, ['c%d' % i for i in range(5)], ['g0', 'g1'], 0)
+    read_table(path)
+    table = write_table(path, ['c%d' % i for i in range(8)], ['g0', 'g1', 'g2'], 1)
+    # Make sure the modification time differs
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    np.testing.assert_allclose(read_table(path).to_numpy(), table.to_numpy(), rtol=1e-6)
+    cache_dir = tmp_path / '.cinet_cache'
+    assert len(list(cache_dir.glob('drug-*.npy'))) == 1
+
+
+def test_read_table_non_numeric(tmp_path):
+    path = str(tmp_path / 'labels.csv')
+    pd.DataFrame({'cell_line': ['a', 'b'], 'tissue': ['lung', 'skin']}).to_csv(path, index=False)
+    assert list(read_table(path)['tissue']) == ['lung', 'skin']
+
+
+def test_expression_store_round_trip(tmp_path):
+    genes = ['g%d' % i for i in range(5)]
+    expression = pd.DataFrame(np.random.default_rng(0).normal(size=(10, 5)),
+                              index=['c%d' % i for i in range(10)], columns=genes)
+    tables = {}
+    for k, drug in enumerate(['drugA', 'drugB']):
+        cells = list(np.random.default_rng(k).permutation(expression.index)[:7])
+        table = expression.loc[cells].copy()
+        table.insert(0, 'target', np.random.default_rng(k).random(7))
+        table.index.name = 'cell_line'
+        table.to_csv(str(tmp_path / (drug + '.csv')))
+        tables[drug] = table
+
+    store = ExpressionStore.from_tables(str(tmp_path / 'store'),
+                                        {drug: str(tmp_path / (drug + '.csv')) for drug in tables})
+    store = ExpressionStore(str(tmp_path / 'store'))
+    assert len(store) == 2 and 'drugA' in store and 'drugC' not in store
+    for drug, table in tables.items():
+        X, y = store.load(drug)
+        assert list(X.index) == list(table.index)
+        np.testing.assert_allclose(X.to_numpy(), table[genes].to_numpy(), rtol=1e-6)
+        np.testing.assert_allclose(y.to_numpy(), table['target'].to_numpy(), rtol=1e-6)
+        X, _ = store.load(drug, genes=['g3', 'g1'])
+        np.testing.assert_allclose(X.to_numpy(), table[['g3', 'g1']].to_numpy(), rtol=1e-6)
+        np.testing.assert_allclose(store.table(drug).to_numpy(), table.to_numpy(), rtol=1e-6)
+    with pytest.raises(KeyError):
+        store.load('drugC')
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from cinet.metrics import concordance_index, concordance_index_batch
+
+
+def brute_force_ci(y_true, y_pred):
+    concordant = 0.0
+    comparable = 0
+    for i in range(len(y_true)):
+        for j in range(i + 1, len(y_true)):
+            if y_true[i] == y_true[j]:
+                continue
+            comparable += 1
+            if y_pred[i] == y_pred[j]:
+                concordant += 0.5
+            elif (y_true[i] > y_true[j]) == (y_pred[i] > y_pred[j]):
+                concordant += 1
+    return concordant / comparable
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_concordance_index_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    y_true = rng.random(60)
+    y_pred = rng.random(60)
+    assert concordance_index(y_true, y_pred) == pytest.approx(brute_force_ci(y_true, y_pred))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_concordance_index_with_ties(seed):
+    rng = np.random.default_rng(seed)
+    # Few distinct values, so that responses and predictions are both tied
+    y_true = rng.integers(0, 5, 80).astype(float)
+    y_pred = rng.integers(0, 4, 80).astype(float)
+    assert concordance_index(y_true, y_pred) == pytest.approx(brute_force_ci(y_true, y_pred))
+
+
+def test_concordance_index_perfect_and_reversed():
+    y = np.arange(10.0)
+    assert concordance_index(y, y) == 1.0
+    assert concordance_index(y, -y) == 0.0
+    assert concordance_index(y, np.zeros(10)) == 0.5
+
+
+def test_concordance_index_all_tied_responses():
+    with pytest.raises(ZeroDivisionError):
+        concordance_index(np.ones(5), np.arange(5.0))
+
+
+def test_concordance_index_batch_matches_single():
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 10, 50).astype(float)
+    y_pred = rng.integers(0, 6, (7, 50)).astype(float)
+    expected = [brute_force_ci(y_true, row) for row in y_pred]
+    np.testing.assert_allclose(concordance_index_batch(y_true, y_pred), expected)
+    assert concordance_index_batch(y_true, y_pred).shape == (7,)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import torch
+
+from cinet import deepCINET
+from cinet.metrics import concordance_index
+from cinet.models import PairConcordance
+
+
+def network(X, y, **kwargs):
+    """A deepCINET with its fit data prepared and an untrained network in evaluation mode"""
+    model = deepCINET(nnHiddenLayers=(8, 4, 0, 0), num_workers=0, **kwargs)
+    model._prepare_fit(X, y)
+    module = model.get_model(model.config)
+    module.eval()
+    return model, module
+
+
+def test_unique_cells_matches_pair_forward(expression_data):
+    X, y = expression_data
+    model, module = network(X, y)
+    pairs = np.arange(0, 300, 7)
+    with torch.no_grad():
+        model.unique_cells = False
+        per_pair = module.pair_output(model.get_pair_dataset(None, np.arange(60))[pairs])
+        model.unique_cells = True
+        unique = module.pair_output(model.get_pair_dataset(None, np.arange(60))[pairs])
+    model._release_fit_data()
+    torch.testing.assert_close(unique[0].view(-1), per_pair[0].view(-1))
+    torch.testing.assert_close(unique[1], per_pair[1])
+
+
+def test_matrix_objective_pairs_and_labels(expression_data):
+    X, y = expression_data
+    model, module = network(X, y, objective='matrix', delta=0.1)
+    dataset = model.get_pair_dataset(None, np.arange(len(X)))
+    rows = np.arange(5, 45, 2)
+    batch = dataset[rows]
+    model._release_fit_data()
+    with torch.no_grad():
+        output, labels = module.pair_output(batch)
+        scores = module.score(batch['gene']).view(-1).numpy()
+    responses = batch['response'].numpy()
+    # Every pair i < j of the batch further apart than delta, in the order of a nested loop
+    expected = [(scores[i] - scores[j], float(responses[i] > responses[j]))
+                for i in range(len(rows)) for j in range(i + 1, len(rows))
+                if abs(responses[i] - responses[j]) > 0.1]
+    assert len(output) == len(expected) > 0
+    np.testing.assert_allclose(output.numpy(), [diff for diff, _ in expected], rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(labels.numpy(), [label for _, label in expected])
+
+
+def test_pair_concordance_matches_concordance_index():
+    rng = np.random.default_rng(0)
+    # Rounded, so that some scores are tied
+    scores = np.round(rng.normal(size=40), 1)
+    responses = rng.random(40)
+    idxA, idxB = np.triu_indices(40, k=1)
+    labels = (responses[idxA] > responses[idxB]).astype(np.float32)
+    metric = PairConcordance()
+    # Streamed over batches of pairs, as during an epoch
+    for start in range(0, len(idxA), 97):
+        batch = slice(start, start + 97)
+        output = torch.from_numpy(scores[idxA[batch]] - scores[idxB[batch]]).float()
+        metric.update(output, torch.from_numpy(labels[batch]), torch.tensor(1.0))
+    loss, ci = metric.compute()
+    assert float(loss) == 1.0
+    assert float(ci) == pytest.approx(concordance_index(responses, scores), abs=1e-6)
+    metric.reset()
+    assert int(metric.concordant + metric.discordant + metric.tied) == 0
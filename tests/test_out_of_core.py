@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cinet import deepCINET
+from cinet.io import ExpressionStore, read_table
+
+
+def watched(model, check):
+    """Have check(model) called every time model trains a network, while the fit data is alive"""
+    train_model = model.train_model
+
+    def checked_train_model(*args, **kwargs):
+        train_model(*args, **kwargs)
+        check(model)
+
+    model.train_model = checked_train_model
+    return model
+
+
+def model_for(**kwargs):
+    return deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=1, batch_size=16, engine='native',
+                     out_of_core=True, **kwargs)
+
+
+def is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_fit_data_is_memory_mapped(expression_data, tmp_path):
+    X, y = expression_data
+    seen = []
+
+    def check(model):
+        assert is_memory_mapped(model._fit_data[0])
+        assert model._gene_matrix.path.startswith(str(tmp_path))
+        np.testing.assert_array_equal(model._fit_data[0], X.to_numpy(dtype=np.float32))
+        seen.append(os.listdir(tmp_path))
+
+    model = watched(model_for(out_of_core_dir=str(tmp_path)), check)
+    [ci] = model.fit(X, y, cross_validation=True)
+    assert 0.0 <= ci <= 1.0
+    assert len(seen) == 5 and all(len(files) == 1 for files in seen)
+    # The file is removed once the fit is over
+    assert os.listdir(tmp_path) == []
+
+
+def test_validation_rows_predicted_in_chunks(expression_data):
+    X, y = expression_data
+    rows = np.arange(3, 70, 4)
+
+    def check(model):
+        predictions = model._predict_fit_rows(rows, X.index)
+        pd.testing.assert_index_equal(predictions.index, X.index[rows])
+        np.testing.assert_allclose(predictions.to_numpy(), model.predict(X.iloc[rows]).to_numpy(), rtol=1e-6)
+
+    watched(model_for(), check).fit(X, y, cross_validation=False)
+
+
+def test_fit_from_npy_file(expression_data, tmp_path):
+    X, y = expression_data
+    path = str(tmp_path / 'X.npy')
+    np.save(path, X.to_numpy(dtype=np.float32))
+
+    def check(model):
+        # Trained from the file itself, nothing is written
+        assert model._gene_matrix == path
+        assert model._fit_data[0].filename == os.path.abspath(path)
+
+    model = watched(model_for(), check)
+    model.fit(path, y, cross_validation=True)
+    assert os.path.exists(path)
+    assert model.genes_ is None
+    assert len(model.predict(X)) == len(X)
+
+
+def test_fit_from_npy_file_converted(expression_data, tmp_path):
+    X, y = expression_data
+    path = str(tmp_path / 'X.npy')
+    np.save(path, X.to_numpy(dtype=np.float64))
+
+    def check(model):
+        assert model._gene_matrix.path != path
+        assert model._fit_data[0].dtype == np.float32
+
+    watched(model_for(), check).fit(path, y, cross_validation=False)
+
+
+def test_fit_from_read_table(expression_data, tmp_path):
+    X, y = expression_data
+    path = str(tmp_path / 'drug.csv')
+    pd.concat([y, X], axis=1).to_csv(path)
+    table = read_table(path)
+
+    def check(model):
+        np.testing.assert_allclose(model._fit_data[0], X.to_numpy(dtype=np.float32))
+        np.testing.assert_allclose(model._fit_data[1], y.to_numpy(), rtol=1e-6)
+
+    model = watched(model_for(), check)
+    model.fit(table, 'target', cross_validation=False)
+    assert model.genes_ == list(X.columns)
+    assert model.config['dat_size'] == X.shape[1]
+
+
+def test_fit_from_expression_store(expression_data, tmp_path):
+    X, y = expression_data
+    responses = pd.DataFrame({'drug': y.where(np.arange(len(y)) % 3 != 0)})
+    store = ExpressionStore.write(str(tmp_path / 'store'), X, responses)
+    X_drug, y_drug = store.load('drug')
+    pd.testing.assert_series_equal(store.responses('drug'), y_drug)
+
+    def check(model):
+        np.testing.assert_array_equal(model._fit_data[0], X_drug.to_numpy())
+
+    model = watched(model_for(), check)
+    model.fit(store.frame(), store.responses('drug'), cross_validation=False)
+    assert model.genes_ == list(X.columns)
+
+
+def test_missing_cell_lines_rejected(expression_data):
+    X, y = expression_data
+    with pytest.raises(Exception, match='same indices'):
+        model_for().fit(X.iloc[10:], y, cross_validation=False)
+
+
+def test_y_aligned_on_x(expression_data):
+    X, y = expression_data
+    shuffled = y.sample(frac=1.0, random_state=0)
+
+    def check(model):
+        np.testing.assert_array_equal(model._fit_data[0], X.to_numpy(dtype=np.float32))
+        np.testing.assert_array_equal(model._fit_data[1], y.to_numpy())
+
+    watched(model_for(), check).fit(X, shuffled, cross_validation=False)
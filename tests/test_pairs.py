@@ -0,0 +1,148 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from cinet.pairs import PairCache, PairList, PairSampler, concordant_pairs, sample_pairs
+
+
+def nested_loop_pairs(responses, delta):
+    pairs = []
+    for i in range(len(responses)):
+        for j in range(i + 1, len(responses)):
+            if abs(responses[i] - responses[j]) > delta:
+                pairs.append((i, j, int(responses[i] > responses[j])))
+    return pairs
+
+
+def responses(seed, size=70):
+    # Rounded like AAC values, so that some differences fall on delta exactly
+    return np.round(np.random.default_rng(seed).random(size), 2)
+
+
+@pytest.mark.parametrize('delta', [0.0, 0.05, 0.1, 0.2])
+@pytest.mark.parametrize('seed', range(3))
+def test_concordant_pairs_matches_nested_loop(seed, delta):
+    resps = responses(seed)
+    idxA, idxB, labels = concordant_pairs(resps, delta, chunk_size=7)
+    assert list(zip(idxA.tolist(), idxB.tolist(), labels.tolist())) == nested_loop_pairs(resps, delta)
+
+
+def test_concordant_pairs_empty():
+    idxA, idxB, labels = concordant_pairs(np.array([0.5]), 0.0)
+    assert len(idxA) == len(idxB) == len(labels) == 0
+
+
+def test_pair_list_indexing():
+    resps = responses(0)
+    expected = nested_loop_pairs(resps, 0.1)
+    pairs = PairList.from_responses(resps, 0.1)
+    assert len(pairs) == len(expected)
+    assert [pairs[k] for k in range(len(pairs))] == expected
+    assert pairs[-1] == expected[-1]
+    subset = pairs[np.array([0, 3, 5])]
+    assert [subset[k] for k in range(3)] == [expected[0], expected[3], expected[5]]
+    np.testing.assert_array_equal(pairs.label(np.arange(len(pairs))), [label for _, _, label in expected])
+    with pytest.raises(IndexError):
+        pairs[len(pairs)]
+
+
+def test_pair_list_pickles_shared():
+    pairs = PairList.from_responses(responses(1), 0.05).share()
+    other = pickle.loads(pickle.dumps(pairs))
+    np.testing.assert_array_equal(other.idxA, pairs.idxA)
+    np.testing.assert_array_equal(other.idxB, pairs.idxB)
+    np.testing.assert_array_equal(other.labels, pairs.labels)
+
+
+def test_sample_pairs_is_a_subset():
+    pairs = PairList.from_responses(responses(2), 0.0)
+    subset = sample_pairs(pairs, 50, np.random.default_rng(0))
+    assert len(subset) == 50
+    all_pairs = set(zip(pairs.idxA.tolist(), pairs.idxB.tolist()))
+    assert set(zip(subset.idxA.tolist(), subset.idxB.tolist())) <= all_pairs
+
+
+def test_pair_list_subsets():
+    resps = responses(0)
+    pairs = PairList.from_responses(resps, 0.0)
+    labels = pairs.labels
+    for index in [slice(3, 40, 3), slice(None, None, -5), np.array([5, -1, 0, 7]),
+                  np.arange(len(pairs)) % 4 == 1, np.array([], dtype=np.int64)]:
+        subset = pairs[index]
+        np.testing.assert_array_equal(subset.idxA, pairs.idxA[index])
+        np.testing.assert_array_equal(subset.idxB, pairs.idxB[index])
+        np.testing.assert_array_equal(subset.labels, labels[index])
+
+
+@pytest.mark.parametrize('delta', [0.0, 0.05, 0.1, 0.2])
+def test_pair_cache_matches_nested_loop(delta):
+    cache = PairCache()
+    resps = responses(3)
+    pairs = cache.get(resps, delta)
+    assert [pairs[k] for k in range(len(pairs))] == nested_loop_pairs(resps, delta)
+    # Cached
+    assert cache.get(resps, delta) is pairs
+
+
+def test_pair_cache_builds_the_requested_delta():
+    cache = PairCache()
+    resps = responses(5, 100)
+    cache.get(resps, 0.2)
+    # Not through the delta=0 list
+    assert [key[1] for key in cache._entries] == [0.2]
+
+
+def test_pair_cache_derives_from_a_smaller_delta():
+    cache = PairCache()
+    resps = responses(6)
+    base = cache.get(resps, 0.05)
+    for delta in [0.1, 0.2, 0.3]:
+        pairs = cache.get(resps, delta)
+        assert [pairs[k] for k in range(len(pairs))] == nested_loop_pairs(resps, delta)
+    assert sorted(key[1] for key in cache._entries) == [0.05, 0.1, 0.2, 0.3]
+    assert cache.get(resps, 0.05) is base
+
+
+def test_pair_cache_evicts():
+    resps = responses(4, 200)
+    cache = PairCache(max_bytes=PairList.from_responses(resps, 0.0).nbytes + 1)
+    cache.get(resps, 0.0)
+    cache.get(resps, 0.1)
+    cache.get(resps, 0.2)
+    assert cache.nbytes <= cache.max_bytes
+    # Lists larger than the cache are not kept
+    small = PairCache(max_bytes=100)
+    pairs = small.get(resps, 0.0)
+    assert len(pairs) == len(nested_loop_pairs(resps, 0.0))
+    assert small.nbytes == 0
+
+
+@pytest.mark.parametrize('delta', [0.0, 0.05, 0.1, 0.2, 0.3])
+@pytest.mark.parametrize('seed', range(20))
+def test_pair_sampler_counts_valid_pairs(seed, delta):
+    resps = responses(seed, 60)
+    assert len(PairSampler(resps, delta)) == len(nested_loop_pairs(resps, delta))
+
+
+@pytest.mark.parametrize('delta', [0.05, 0.1, 0.2])
+def test_pair_sampler_draws_valid_pairs_uniformly(delta):
+    resps = responses(7, 40)
+    valid = {(i, j) for i, j, _ in nested_loop_pairs(resps, delta)}
+    sampler = PairSampler(resps, delta)
+    num_draws = 600 * len(valid)
+    pairs = sampler.sample(num_draws, np.random.default_rng(0))
+    assert np.all(np.abs(resps[pairs.idxA] - resps[pairs.idxB]) > delta)
+    np.testing.assert_array_equal(pairs.labels, resps[pairs.idxA] > resps[pairs.idxB])
+    unordered = np.sort(np.stack([pairs.idxA, pairs.idxB]), axis=0)
+    drawn, counts = np.unique(unordered[0] * len(resps) + unordered[1], return_counts=True)
+    assert {(int(k) // len(resps), int(k) % len(resps)) for k in drawn} == valid
+    # 600 expected draws per pair, a standard deviation of about 24.5
+    assert counts.min() > 600 - 6 * 24.5 and counts.max() < 600 + 6 * 24.5
+
+
+def test_pair_sampler_no_pairs():
+    sampler = PairSampler(np.array([0.5, 0.5, 0.5]), 0.0)
+    assert len(sampler) == 0
+    with pytest.raises(ValueError):
+        sampler.sample(3, np.random.default_rng(0))
@@ -0,0 +1,41 @@
+import re
+
+import numpy as np
+
+from cinet import deepCINET
+
+
+def fit(X, y, precision):
+    model = deepCINET(nnHiddenLayers=(16, 8, 0, 0), num_workers=0, max_epochs=3, batch_size=64, engine='native',
+                      precision=precision)
+    model.fit(X, y, cross_validation=False)
+    return model
+
+
+def epoch_losses(output):
+    return np.array([float(loss) for loss in re.findall(r'avg_loss=([^,]+),', output)])
+
+
+def test_bf16_training_matches_fp32(expression_data, capsys):
+    X, y = expression_data
+    fp32 = fit(X, y, 32)
+    fp32_losses = epoch_losses(capsys.readouterr().out)
+    bf16 = fit(X, y, 'bf16')
+    bf16_losses = epoch_losses(capsys.readouterr().out)
+    assert len(bf16_losses) == len(fp32_losses) == 3
+    assert np.isfinite(bf16_losses).all()
+    # bfloat16 keeps 8 bits of mantissa, about 2 to 3 significant digits
+    np.testing.assert_allclose(bf16_losses, fp32_losses, rtol=0.1, atol=5e-3)
+    predictions = bf16.predict(X).to_numpy()
+    assert np.isfinite(predictions).all()
+    np.testing.assert_allclose(predictions, fp32.predict(X).to_numpy(), rtol=0.05, atol=0.02)
+
+
+def test_bf16_predict_matches_fp32(expression_data):
+    X, y = expression_data
+    model = fit(X, y, 32)
+    fp32 = model.predict(X).to_numpy()
+    model.precision = 'bf16'
+    bf16 = model.predict(X).to_numpy()
+    np.testing.assert_allclose(bf16, fp32, rtol=0.02, atol=5e-3)
+    assert not np.array_equal(bf16, fp32)
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import torch
+
+from cinet import deepCINET
+from cinet.models import gene_scaler, matrix_scaler
+from cinet.pairs import pair_cache
+
+
+def fitted(X, y):
+    model = deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=2, batch_size=64, engine='native')
+    model.fit(X, y, cross_validation=False)
+    return model
+
+
+def test_predict_standardizes_raw_inputs(expression_data):
+    X, y = expression_data
+    model = fitted(X, y)
+    standardized = (X - model.siamese_model.gene_mean.numpy()) / model.siamese_model.gene_std.numpy()
+    with torch.no_grad():
+        expected = model.siamese_model.fc(torch.tensor(standardized.to_numpy(), dtype=torch.float32)).view(-1)
+    np.testing.assert_allclose(model.predict(X).to_numpy(), expected.numpy(), rtol=1e-5, atol=1e-6)
+
+
+def test_predict_network_without_scaler(expression_data):
+    X, y = expression_data
+    model = fitted(X, y)
+    # As a network pickled before the scaler buffers existed
+    del model.siamese_model._buffers['gene_mean']
+    del model.siamese_model._buffers['gene_std']
+    with torch.no_grad():
+        expected = model.siamese_model.fc(torch.tensor(X.to_numpy(), dtype=torch.float32)).view(-1)
+    np.testing.assert_allclose(model.predict(X).to_numpy(), expected.numpy(), rtol=1e-5, atol=1e-6)
+
+
+def test_predict_chunks(expression_data):
+    X, y = expression_data
+    model = fitted(X, y)
+    full = model.predict(X)
+    model.predict_chunk_size = 7
+    np.testing.assert_allclose(model.predict(X).to_numpy(), full.to_numpy(), rtol=1e-6)
+    assert list(full.index) == list(X.index)
+
+
+def test_fit_clears_the_pair_cache(expression_data):
+    X, y = expression_data
+    fitted(X, y)
+    assert pair_cache.nbytes == 0
+    model = deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=0, max_epochs=1, batch_size=64, engine='native')
+    path = model.fit_delta_path(X, y, deltas=[0.2, 0.0, 0.1])
+    assert list(path.index) == [0.2, 0.0, 0.1]
+    assert pair_cache.nbytes == 0
+
+
+def test_pair_batches_by_default(expression_data):
+    X, y = expression_data
+    model = deepCINET(num_workers=0)
+    assert model.unique_cells is False
+    model._prepare_fit(X, y)
+    batch = model.get_pair_dataset(None, np.arange(40))[np.arange(8)]
+    assert set(batch) == {'geneA', 'geneB', 'labels'}
+    model.unique_cells = True
+    batch = model.get_pair_dataset(None, np.arange(40))[np.arange(8)]
+    assert set(batch) == {'genes', 'idxA', 'idxB', 'labels'}
+    model._release_fit_data()
+
+
+def test_model_path_loaded_once_until_modified(expression_data, tmp_path):
+    X, y = expression_data
+    model = fitted(X, y)
+    path = str(tmp_path / 'model.pt')
+    torch.save(model.siamese_model, path)
+    model.modelPath = path
+    expected = model.predict(X)
+    network = model.siamese_model
+    model.predict(X)
+    # Not read again while the file is unchanged
+    assert model.siamese_model is network
+    torch.save(model.siamese_model, path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(model.predict(X).to_numpy(), expected.to_numpy())
+    assert model.siamese_model is not network
+
+
+def test_gene_and_matrix_scalers_agree():
+    rng = np.random.default_rng(0)
+    genes = rng.normal(5.0, 2.0, size=(50, 4)).astype(np.float32)
+    genes[:, 1] = 1000.1
+    genes[:, 2:] = 3.0
+    genes[25:, 3] = np.nextafter(np.float32(3.0), np.float32(4.0))
+    mean, std = gene_scaler(genes)
+    chunked_mean, chunked_std = matrix_scaler(genes, np.arange(50), chunk_size=7)
+    np.testing.assert_allclose(chunked_mean, mean, rtol=1e-12)
+    np.testing.assert_allclose(chunked_std, std, rtol=1e-9)
+    # Constant genes, and one differing only by float32 rounding, are only centered
+    assert list(std[1:]) == [1.0, 1.0, 1.0]
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pytest
+
+from cinet import ECINET, deepCINET
+from cinet.serialization import load_file, save_file
+
+
+def test_save_file_round_trip(tmp_path):
+    tensors = {'weight': np.arange(12, dtype=np.float32).reshape(3, 4),
+               'odd': np.arange(7, dtype=np.float32),
+               'count': np.array(3, dtype=np.int64),
+               'flags': np.array([True, False])}
+    path = str(tmp_path / 'arrays.safetensors')
+    save_file(tensors, path, {'name': 'test'})
+    for mmap in [True, False]:
+        loaded, metadata = load_file(path, mmap=mmap)
+        assert metadata == {'name': 'test'}
+        assert set(loaded) == set(tensors)
+        for name, array in tensors.items():
+            assert loaded[name].dtype == array.dtype
+            np.testing.assert_array_equal(loaded[name], array)
+
+
+@pytest.mark.parametrize('estimator', [
+    lambda: deepCINET(nnHiddenLayers=(8, 4, 0, 0), num_workers=0, max_epochs=2, batch_size=64, engine='native'),
+    lambda: ECINET(num_workers=0, max_epochs=2, batch_size=64, engine='native'),
+])
+def test_save_load_round_trip(tmp_path, expression_data, estimator):
+    X, y = expression_data
+    model = estimator()
+    model.fit(X, y, cross_validation=False)
+    path = str(tmp_path / 'model.safetensors')
+    model.save(path)
+    loaded = type(model).load(path)
+    for name in model._param_names():
+        assert getattr(loaded, name) == (getattr(model, name) if name != 'modelPath' else '')
+    assert loaded.genes_ == model.genes_
+    np.testing.assert_array_equal(loaded.predict(X).to_numpy(), model.predict(X).to_numpy())
+    # Columns are matched by name
+    shuffled = X[X.columns[::-1]]
+    np.testing.assert_array_equal(loaded.predict(shuffled).to_numpy(), model.predict(X).to_numpy())
+
+
+def test_save_file_aligns_arrays(tmp_path):
+    # An odd number of float32 values before 8 byte values
+    tensors = {'gene_mean': np.zeros(735, dtype=np.float32), 'num_batches_tracked': np.array(5, dtype=np.int64),
+               'flags': np.ones(3, dtype=np.bool_), 'weight': np.ones((3, 5), dtype=np.float64),
+               'half': np.ones(3, dtype=np.float16)}
+    path = str(tmp_path / 'arrays.safetensors')
+    save_file(tensors, path)
+    with open(path, 'rb') as file:
+        size = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(size))
+    assert (8 + size) % 8 == 0
+    offsets = sorted(info['data_offsets'] for info in header.values())
+    # No gaps, as safetensors readers require
+    assert offsets[0][0] == 0 and all(a[1] == b[0] for a, b in zip(offsets, offsets[1:]))
+    for name, info in header.items():
+        assert info['data_offsets'][0] % tensors[name].dtype.itemsize == 0
+    loaded, _ = load_file(path)
+    for name, array in tensors.items():
+        np.testing.assert_array_equal(loaded[name], array)
+        assert loaded[name].ctypes.data % array.dtype.itemsize == 0
@@ -0,0 +1,62 @@
+import multiprocessing
+
+import numpy as np
+import torch
+
+from cinet import deepCINET
+from cinet import shared
+from cinet.models import pair_loader, shutdown_workers
+from cinet.shared import SharedArray
+
+
+def test_shared_array_falls_back_when_shm_is_full(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, '_SHARED_DIR', str(tmp_path))
+    monkeypatch.setattr(shared, '_SHARED_MARGIN', 2 ** 40)
+    array = SharedArray(np.arange(10, dtype=np.float32))
+    try:
+        assert not array.path.startswith(str(tmp_path))
+        np.testing.assert_array_equal(array.array, np.arange(10, dtype=np.float32))
+    finally:
+        array.close()
+
+
+def test_shared_array_uses_shm_with_room(monkeypatch, tmp_path):
+    monkeypatch.setattr(shared, '_SHARED_DIR', str(tmp_path))
+    array = SharedArray(np.arange(10, dtype=np.float32))
+    try:
+        assert array.path.startswith(str(tmp_path))
+    finally:
+        array.close()
+
+
+def test_fold_workers_stopped_after_training(expression_data):
+    X, y = expression_data
+    model = deepCINET(nnHiddenLayers=(8, 0, 0, 0), num_workers=1, max_epochs=1, batch_size=64, engine='native')
+    # Worker processes alive when each fold starts training
+    alive = []
+    train_model = model.train_model
+
+    def counting_train_model(*args, **kwargs):
+        alive.append(len(multiprocessing.active_children()))
+        train_model(*args, **kwargs)
+
+    model.train_model = counting_train_model
+    model.fit(X, y, cross_validation=True)
+    assert len(alive) == 5
+    assert alive == [0] * 5
+
+
+def test_stream_epochs_differ_with_persistent_workers(expression_data):
+    X, y = expression_data
+    model = deepCINET(num_workers=1, batch_size=16, pairs_per_epoch=64)
+    combined_df = model._prepare_fit(X, y)
+    dataset = model.get_pair_dataset(combined_df, np.arange(len(X)), pair_sampling='stream')
+    loader = pair_loader(dataset, 16, shuffle=False, num_workers=1)
+    try:
+        epochs = [torch.cat([batch['labels'] for batch in loader]) for _ in range(2)]
+        assert loader._iterator is not None
+    finally:
+        shutdown_workers(loader)
+        model._release_fit_data()
+    assert epochs[0].shape == epochs[1].shape
+    assert not torch.equal(epochs[0], epochs[1])
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from cinet.interfaces import ECINET
+from cinet.pairs import PairList
+from cinet.solvers import rank_elastic_net_path
+
+
+def problem(seed=0, size=40, num_genes=8):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(size, num_genes))
+    responses = X[:, :3] @ np.array([1.0, -0.5, 0.25]) + rng.normal(scale=0.3, size=size)
+    return X, PairList.from_responses(responses, 0.1)
+
+
+def objective(X, pairs, weights, l1, l2):
+    sign = pairs.labels * 2.0 - 1.0
+    scores = X @ weights
+    margins = np.maximum(1.0 - sign * (scores[pairs.idxA] - scores[pairs.idxB]), 0.0)
+    return np.dot(margins, margins) / len(pairs) + l1 * np.abs(weights).sum() + l2 * np.dot(weights, weights)
+
+
+def loss_gradient(X, pairs, weights):
+    sign = pairs.labels * 2.0 - 1.0
+    diffs = X[pairs.idxA] - X[pairs.idxB]
+    margins = np.maximum(1.0 - sign * (diffs @ weights), 0.0)
+    return -2.0 / len(pairs) * ((sign * margins) @ diffs)
+
+
+@pytest.mark.parametrize('ratio', [0.2, 0.5, 0.9])
+def test_rank_elastic_net_path_optimality(ratio):
+    X, pairs = problem()
+    lambdas, coefs = rank_elastic_net_path(X, pairs, ratio=ratio, reg_contr=0.01, num_lambdas=10, tol=1e-8,
+                                           max_iter=200)
+    assert coefs.shape == (len(lambdas), X.shape[1])
+    assert lambdas[-1] == pytest.approx(0.01)
+    for lambda_, weights in zip(lambdas, coefs):
+        l1, l2 = lambda_ * ratio, lambda_ * (1 - ratio)
+        grad = loss_gradient(X, pairs, weights) + 2 * l2 * weights
+        nonzero = weights != 0
+        # Subgradient conditions of the elastic net
+        np.testing.assert_allclose(grad[nonzero], -l1 * np.sign(weights[nonzero]), atol=1e-4)
+        assert np.all(np.abs(grad[~nonzero]) <= l1 + 1e-4)
+
+
+def test_rank_elastic_net_path_beats_perturbations():
+    X, pairs = problem(1)
+    lambdas, coefs = rank_elastic_net_path(X, pairs, ratio=0.4, reg_contr=0.05, num_lambdas=5)
+    l1, l2 = 0.05 * 0.4, 0.05 * 0.6
+    best = objective(X, pairs, coefs[-1], l1, l2)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        trial = coefs[-1] + rng.normal(scale=1e-2, size=X.shape[1])
+        assert best <= objective(X, pairs, trial, l1, l2) + 1e-9
+
+
+def test_rank_elastic_net_path_starts_at_zero():
+    X, pairs = problem(2)
+    lambdas, coefs = rank_elastic_net_path(X, pairs, ratio=0.5, reg_contr=0.01, num_lambdas=6)
+    assert np.all(coefs[0] == 0)
+    assert np.all(np.diff(lambdas) < 0)
+
+
+@pytest.mark.parametrize('params', [{'num_lambdas': 0}, {'solver': 'lbfgs'}])
+def test_ecinet_rejects_invalid_solver_params(expression_data, params):
+    X, y = expression_data
+    with pytest.raises(AssertionError):
+        ECINET(solver=params.pop('solver', 'coordinate_descent'), num_workers=0, **params).fit(X, y)